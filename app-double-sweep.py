@@ -74,7 +74,7 @@ def update_screen():
     global insertions
 
     try:
-        grouped_sweep = read_analyzed_sweep(data_dir, params)
+        grouped_sweep = read_analyzed_sweep(data_dir, params, lazy=True)
         insertions = read_insertions(ins_data_dir, params['screen_name'],
                                      params['assembly'],
                                      params['trim_length'])
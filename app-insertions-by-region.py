@@ -6,9 +6,10 @@ from bokeh.plotting import figure, output_file, show, curdoc
 from bokeh.layouts import column, row
 from matplotlib import cm, colors
 from math import log2
-from scipy.stats import fisher_exact
 
 from sweeptools.plotting.insertionsrange import plot_insertions, ins_select_range
+from sweeptools.analyzeinsertions import window_counts
+from sweeptools.fishertest import fisher_exact_batch
 
 # import sweeptools as tls
 # from importlib import reload
@@ -35,22 +36,22 @@ ins = plot_insertions(data_dir, screen_name, assembly,
 select = ins_select_range(ins)
 
 
-def get_ratios(insertions, start, end):
+def get_ratios(start, end):
 
-    ins_sel = insertions[insertions.pos.between(start, end)]
-    counts_per_strand = ins_sel.groupby(['chan', 'strand']).size()
+    counts_per_strand = window_counts(data_dir, screen_name, assembly,
+                                      trim_length, chrom, start, end)
 
     # Get counts for each channel and strand, set to 1 if no counts
-    cnts_per_strand = {'+h': counts_per_strand.get(('high', '+'), 1),
-                       '-h': counts_per_strand.get(('high', '-'), 1),
-                       '+l': counts_per_strand.get(('low', '+'), 1),
-                       '-l': counts_per_strand.get(('low', '-'), 1)}
+    cnts_per_strand = {'+h': max(counts_per_strand[('high', '+')], 1),
+                       '-h': max(counts_per_strand[('high', '-')], 1),
+                       '+l': max(counts_per_strand[('low', '+')], 1),
+                       '-l': max(counts_per_strand[('low', '-')], 1)}
 
     # print(cnts_per_strand)
 
-    counts_both_strands = ins_sel.groupby(['chan']).size()
-    cnts_both_strands = {'h': counts_both_strands.get(('high'), 1),
-                         'l': counts_both_strands.get(('low'), 1)}
+    counts_both_strands = counts_per_strand.groupby(level='chan').sum()
+    cnts_both_strands = {'h': max(counts_both_strands['high'], 1),
+                         'l': max(counts_both_strands['low'], 1)}
     # print(cnts_both_strands)
 
     ratios = {'+': log2(cnts_per_strand['+h']/cnts_per_strand['+l']),
@@ -61,15 +62,11 @@ def get_ratios(insertions, start, end):
                                     columns=['log2rat'])
 
     tot_space = end - start
-    _, p_plus = fisher_exact([[cnts_per_strand['+h'], tot_space],
-                              [cnts_per_strand['+l'], tot_space]],
-                             alternative='two-sided')
-    _, p_minus = fisher_exact([[cnts_per_strand['-h'], tot_space],
-                               [cnts_per_strand['-l'], tot_space]],
-                              alternative='two-sided')
-    _, p_both = fisher_exact([[cnts_both_strands['h'], tot_space],
-                              [cnts_both_strands['l'], tot_space]],
-                             alternative='two-sided')
+    p_plus, p_minus, p_both = fisher_exact_batch(
+        [cnts_per_strand['+h'], cnts_per_strand['-h'], cnts_both_strands['h']],
+        tot_space,
+        [cnts_per_strand['+l'], cnts_per_strand['-l'], cnts_both_strands['l']],
+        tot_space)
 
     rat_df['p'] = [p_plus, p_minus, p_both]
     rat_df['log2rat_masked'] = rat_df.log2rat.where(rat_df.p < 0.00001)
@@ -83,7 +80,7 @@ def update_ratios(attr, old, new):
     start_sel = int(range_tool.x_range.start)
     end_sel = int(range_tool.x_range.end)
 
-    ratios = get_ratios(insertions, start_sel, end_sel)
+    ratios = get_ratios(start_sel, end_sel)
 
     rat_source.data['log2rat'] = ratios['log2rat']
     rat_source.data['p'] = ratios['p']
@@ -99,9 +96,6 @@ def update_ratios(attr, old, new):
 
 
 range_tool = select.tools[0]
-ins_source = [x.data_source for x in ins.renderers
-              if x.name == 'insertions'][0]
-insertions = pd.DataFrame(ins_source.data)[['chan', 'chr', 'strand', 'pos']]
 
 range_tool.x_range.on_change('start', update_ratios)
 range_tool.x_range.on_change('end', update_ratios)
@@ -116,7 +110,7 @@ rat.xgrid.visible = False
 rat.ygrid.visible = False
 rat.outline_line_color = None
 
-ratios = get_ratios(insertions, ins.x_range.start, ins.x_range.end)
+ratios = get_ratios(ins.x_range.start, ins.x_range.end)
 
 ratios['log2rat_str'] = ratios.log2rat.apply(lambda x: f'{x:.1f}')
 ratios['ypos'] = [3.5, 2.5, 1.5]
@@ -0,0 +1,185 @@
+'''Compares 'run_adaptive_sweep' with the full double sweep on a stub
+analyzer with a realistic number of genes. The stub counts the insertions
+of each gene within the window of every sweep point from simulated
+insertions: most genes are neutral, some are enriched in one channel over
+the whole gene and some only near their 5' or 3' end, so their log2 MI
+changes with the window. Reports the number of points run and how the
+genes flagged by 'flag_by_slope' on the adaptive sweep (with slopes from
+interpolated log2_mi next to points not run) compare with those of the
+full sweep. Run from the repository root with:
+
+    python -m benchmarks.bench_adaptive_sweep
+'''
+# %%
+import contextlib
+import io
+import os
+import stat
+import sys
+import tempfile
+import time
+import numpy as np
+
+from sweeptools.analyzesweep import (get_sweep_data, get_sweep_slopes,
+                                     flag_by_slope)
+from sweeptools.runsweep import run_double_sweep, run_adaptive_sweep
+
+n_genes = 20000
+slope_thr = 1
+p_thr = 1e-5
+blocks_per_gene = [1, 2, 3]
+params = {'screen_name': 'stub',
+          'assembly': 'hg38',
+          'trim_length': '50',
+          'mode': 'collapse',
+          'overlap': 'both',
+          'direction': 'sense',
+          'step': 500}
+
+# Insertions are keyed by gene * _gene_span + position + _flank
+_gene_span = 10**7
+_flank = 5000
+
+# Counts insertions of every gene in the window of a sweep point, from the
+# insertions saved by 'write_insertions'. Genes with an empty window are
+# left out. P-values use the normal approximation of the binomial test of
+# the high channel fraction (numpy only, so each call starts fast), p_fdr is
+# p * n / rank as in screen-analyzer
+stub_analyzer = '''#!PYTHON
+import sys
+from math import erfc, sqrt
+import numpy as np
+
+args = dict(zip(sys.argv[3::2], sys.argv[4::2]))
+srt_off = int(args['--start'][2:])
+end_off = int(args['--end'][2:])
+
+data = np.load('INSERTIONS')
+genes = np.arange(len(data['length']))
+start = srt_off
+end = data['length'] + end_off
+valid = start <= end
+base = genes * SPAN + FLANK
+
+counts = dict()
+for chan in ['low', 'high']:
+    keys = data[chan]
+    counts[chan] = (np.searchsorted(keys, base + end, side='right')
+                    - np.searchsorted(keys, base + start, side='left'))
+low, high = counts['low'][valid], counts['high'][valid]
+low_total, high_total = len(data['low']), len(data['high'])
+
+frac = high_total / (low_total + high_total)
+n = np.maximum(low + high, 1)
+z = np.abs(high - n * frac) / np.sqrt(n * frac * (1 - frac))
+p = np.array([erfc(x / sqrt(2)) for x in z.tolist()])
+rank = np.empty(len(p))
+rank[np.argsort(p, kind='stable')] = np.arange(1, len(p) + 1)
+fdr = p * len(p) / rank
+log2_mi = np.log2(((high + 1) / high_total) / ((low + 1) / low_total))
+
+with open(args['--output'], 'w') as f:
+    f.write('gene\\tlow\\thigh\\tp\\tfdr\\tlog2mi\\n')
+    for row in zip(genes[valid].tolist(), low.tolist(), high.tolist(),
+                   p.tolist(), fdr.tolist(), log2_mi.tolist()):
+        f.write('GENE%05d\\t%d\\t%d\\t%r\\t%r\\t%r\\n' % row)
+'''
+
+
+def write_insertions(filename: str, n_genes: int, seed: int = 0) -> None:
+    '''Simulated insertions of the low and high channels around 'n_genes'
+    genes. 88% of genes are neutral, 6% have a different high/low ratio
+    over the whole gene and 6% only within a region near their 5' or 3'
+    end.
+    '''
+
+    rng = np.random.default_rng(seed)
+    length = np.clip(rng.lognormal(np.log(25000), 0.8, n_genes), 3000,
+                     10**6).astype(np.int64)
+    density = rng.lognormal(np.log(1e-3), 0.7, n_genes)
+
+    kind = rng.choice(3, n_genes, p=[0.88, 0.06, 0.06])
+    ratio = np.where(kind == 1, 2**rng.normal(0, 1.5, n_genes), 1)
+    local_ratio = np.where(kind == 2, 2**(rng.choice([-1, 1], n_genes)
+                                          * rng.uniform(1.5, 3, n_genes)),
+                           1)
+    region = (300 + rng.exponential(1500, n_genes)).astype(np.int64)
+    at_5p = rng.random(n_genes) < 0.5
+
+    keys = dict()
+    for chan, scale in [('low', 1), ('high', 2)]:
+        span = length + 2*_flank
+        n = rng.poisson(density * scale * span
+                        * np.maximum(np.maximum(ratio, local_ratio), 1))
+        gene = np.repeat(np.arange(n_genes), n)
+        pos = (rng.random(len(gene)) * span[gene]).astype(np.int64) - _flank
+        if chan == 'high':
+            # Thin insertions to the ratio at their position
+            in_region = np.where(at_5p[gene],
+                                 (pos >= 0) & (pos < region[gene]),
+                                 (pos > length[gene] - region[gene])
+                                 & (pos <= length[gene]))
+            in_gene = (pos >= 0) & (pos <= length[gene])
+            r = np.where(in_gene, ratio[gene], 1)
+            r = np.where(in_region, local_ratio[gene], r)
+            keep = rng.random(len(gene)) * np.maximum(
+                np.maximum(ratio, local_ratio), 1)[gene] < r
+            gene, pos = gene[keep], pos[keep]
+        keys[chan] = np.sort(gene * _gene_span + pos + _flank)
+
+    np.savez(filename, length=length, **keys)
+
+
+def write_stub(filename: str, insertions: str) -> str:
+    with open(filename, 'w') as f:
+        f.write(stub_analyzer
+                .replace('PYTHON', sys.executable)
+                .replace('INSERTIONS', insertions)
+                .replace('SPAN', str(_gene_span))
+                .replace('FLANK', str(_flank)))
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IEXEC)
+    return filename
+
+
+def flagged_genes(sweep_data, fill_grid: bool = False) -> set:
+    grouped_sweep = get_sweep_slopes(sweep_data, params['step'],
+                                     fill_grid).groupby('gene_name')
+    return set(flag_by_slope(grouped_sweep, p_thr, slope_thr).gene)
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_insertions(f'{data_dir}/insertions.npz', n_genes)
+        analyzer = write_stub(f'{data_dir}/screen-analyzer',
+                              f'{data_dir}/insertions.npz')
+
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            manifest = run_double_sweep(f'{data_dir}/full', params,
+                                        analyzer=analyzer, retries=0)
+            full = get_sweep_data(f'{data_dir}/full', params)
+            full_flags = flagged_genes(full)
+        assert (manifest.status == 'done').all()
+        n_full = len(manifest)
+        print(f'{n_genes} genes - full sweep: {n_full} points in '
+              f'{time.perf_counter() - start_time:.0f} secs - '
+              f'{len(full_flags)} flagged genes')
+
+        for n_blocks in blocks_per_gene:
+            out_dir = f'{data_dir}/adaptive-{n_blocks}'
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                manifest = run_adaptive_sweep(
+                    out_dir, params, blocks_per_gene=n_blocks,
+                    analyzer=analyzer, retries=0)
+                adaptive = get_sweep_data(out_dir, params)
+                flags = flagged_genes(adaptive, fill_grid=True)
+            n_run = (manifest.status == 'done').sum()
+            found = len(flags & full_flags)
+            print(f'blocks_per_gene={n_blocks}: {n_run} points '
+                  f'({n_full/n_run:.1f}x fewer) in '
+                  f'{time.perf_counter() - start_time:.0f} secs - '
+                  f'{found} of {len(full_flags)} flagged genes found, '
+                  f'{len(flags - full_flags)} not flagged in full sweep')
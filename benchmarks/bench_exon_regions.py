@@ -0,0 +1,130 @@
+'''Checks that 'get_exon_regions' returns the same regions as the per base
+implementation it replaced, and compares their runtime on the largest
+RefSeq genes. Uses the RefSeq file in 'refseq_dir' if present, otherwise
+synthetic transcripts shaped like DMD and TTN. Run from the repository root
+with:
+
+    python -m benchmarks.bench_exon_regions
+'''
+# %%
+import contextlib
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzeinsertions import (get_exon_regions, contig_list_lims,
+                                          read_refseq, get_gene_positions)
+
+refseq_dir = '../data/refseq'
+assembly = 'hg38'
+genes = ['DMD', 'TTN']
+
+# Synthetic genes: (transcripts, exons per transcript, gene length in bp)
+synthetic_shapes = {'DMD': (40, 79, 2220000), 'TTN': (15, 363, 281000)}
+
+
+def get_exon_regions_per_base(gene_pos: pd.DataFrame) -> pd.DataFrame:
+    '''Per base implementation previously used as 'get_exon_regions'.'''
+
+    exon = gene_pos.copy(deep=True)
+    exon = exon.reset_index(drop=True)
+    exon['tx_id'] = exon.index + 1
+
+    cols = ['exonStarts', 'exonEnds']
+    exon[cols] = exon[cols].applymap(lambda x: x.split(','))
+
+    exon['cdsRange'] = exon.apply(lambda x: range(x.cdsStart, x.cdsEnd),
+                                  axis=1)
+    exon['exonRange'] = (exon
+                         .apply(lambda t:
+                                [range(int(x), int(y)) for i, x
+                                 in enumerate(t['exonStarts']) for j, y
+                                 in enumerate(t['exonEnds']) if i == j
+                                 and x != '' and y != ''], axis=1))
+
+    exon = exon.explode('exonRange')
+    exon = exon.reset_index(drop=True)
+    exon['exon_id'] = exon.index + 1
+    exon = exon.drop(columns=['#bin', 'exonStarts', 'exonEnds', 'score',
+                              'cdsStartStat', 'cdsEndStat', 'exonFrames',
+                              'cdsStart', 'cdsEnd'])
+
+    exon['exCds_lst'] = exon.apply(lambda t: [x for x in t.exonRange
+                                              if x in t.cdsRange], axis=1)
+    exon['exUtr_lst'] = exon.apply(lambda t: [x for x in t.exonRange
+                                              if x not in t.cdsRange], axis=1)
+
+    exon['exCds'] = exon.apply(lambda t: contig_list_lims(t.exCds_lst), axis=1)
+    exon['exUtr'] = exon.apply(lambda t: contig_list_lims(t.exUtr_lst), axis=1)
+
+    exon_regions = exon.melt(id_vars=['name2', 'name', 'exon_id', 'tx_id'],
+                             value_vars=['exCds', 'exUtr'],
+                             var_name='reg_type', value_name='reg_lims')
+    exon_regions = exon_regions.explode('reg_lims').dropna()
+
+    return exon_regions
+
+
+def synthetic_gene_pos(gene: str, n_tx: int, n_exons: int, length: int,
+                       seed: int = 0) -> pd.DataFrame:
+    '''Random transcripts of a gene in the format of 'get_gene_positions'.
+    Includes non-coding transcripts and cds limits inside and outside
+    exons.
+    '''
+    rng = np.random.default_rng(seed)
+    tx_start = 31000000
+    rows = []
+    for i in range(n_tx):
+        n = int(rng.integers(n_exons // 2, n_exons + 1))
+        starts = (np.sort(rng.choice(length // 600, n, replace=False)) * 600
+                  + tx_start)
+        ends = starts + rng.integers(50, 500, n)
+        if i % 5 == 4:
+            cds_start = cds_end = int(ends[-1])
+        else:
+            cds_start = int(rng.integers(starts[0], ends[n // 4]))
+            cds_end = int(rng.integers(starts[3 * n // 4], ends[-1]))
+        rows.append({'#bin': 0, 'name': f'NM_{i:06d}.1', 'chrom': 'chrX',
+                     'strand': '-', 'txStart': int(starts[0]),
+                     'txEnd': int(ends[-1]), 'cdsStart': cds_start,
+                     'cdsEnd': cds_end, 'exonCount': n,
+                     'exonStarts': ','.join(map(str, starts)) + ',',
+                     'exonEnds': ','.join(map(str, ends)) + ',',
+                     'score': 0, 'name2': gene, 'cdsStartStat': 'cmpl',
+                     'cdsEndStat': 'cmpl', 'exonFrames': '', 'coding': True,
+                     'known': True})
+    return pd.DataFrame(rows)
+
+
+# %%
+if __name__ == '__main__':
+
+    if os.path.exists(f'{refseq_dir}/ncbi-genes-{assembly}.txt'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            refseq = read_refseq(refseq_dir, assembly)
+            gene_positions = {gene: get_gene_positions(gene, refseq)
+                              for gene in genes}
+        print(f'RefSeq genes from {refseq_dir}')
+    else:
+        gene_positions = {gene: synthetic_gene_pos(gene, *shape)
+                          for gene, shape in synthetic_shapes.items()}
+        print('Synthetic genes')
+
+    for gene, gene_pos in gene_positions.items():
+        start_time = time.perf_counter()
+        intervals = get_exon_regions(gene_pos)
+        int_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        per_base = get_exon_regions_per_base(gene_pos)
+        base_time = time.perf_counter() - start_time
+
+        print(f'{gene} ({len(gene_pos)} transcripts, {len(intervals)} '
+              f'regions) - intervals: {int_time*1000:.1f} ms - '
+              f'per base: {base_time:.2f} secs - '
+              f'speedup: {base_time/int_time:.0f}x')
+
+        pd.testing.assert_frame_equal(intervals, per_base)
+        print('Outputs match.')
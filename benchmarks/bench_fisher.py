@@ -0,0 +1,51 @@
+'''Measures the throughput of 'fisher_exact_batch' and 'bh_fdr' on the
+tables of a synthetic sweep, and estimates the time scipy.stats.fisher_exact
+takes for them (they are compared with scipy in tests/test_fisher.py).
+Run from the repository root with:
+
+    python -m benchmarks.bench_fisher
+'''
+# %%
+import time
+import numpy as np
+from scipy.stats import fisher_exact
+
+from sweeptools.fishertest import fisher_exact_batch, bh_fdr
+
+n_genes = 20000
+n_points = 625
+low_total, high_total = 1500000, 3000000
+
+
+# %%
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+
+    # Counts of a synthetic sweep: genes with few insertions are common,
+    # so many tables repeat
+    size = rng.lognormal(3, 1.2, n_genes)[:, None]
+    low = rng.poisson(size * rng.uniform(0.2, 1.2, (n_genes, n_points)))
+    high = rng.poisson(size * rng.uniform(0.2, 1.2, (n_genes, n_points)) * 2)
+    low, high = low.ravel(), high.ravel()
+
+    start_time = time.perf_counter()
+    p = fisher_exact_batch(low, high, low_total - low, high_total - high)
+    batch_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    p_fdr = bh_fdr(p, np.tile(np.arange(n_points), n_genes))
+    fdr_time = time.perf_counter() - start_time
+
+    n_unique = len(np.unique(low * (high.max() + 1) + high))
+    sample = rng.choice(len(low), 200, replace=False)
+    start_time = time.perf_counter()
+    for i in sample:
+        fisher_exact([[low[i], high[i]],
+                      [low_total - low[i], high_total - high[i]]])
+    scipy_time = (time.perf_counter() - start_time) / len(sample) * len(low)
+
+    print(f'{len(low):,} tables ({n_unique:,} distinct) - batch: '
+          f'{batch_time:.1f} secs ({len(low)/batch_time/1e6:.1f}M tables '
+          f'per sec) - BH per point: {fdr_time:.1f} secs - scipy per '
+          f'table (estimated): {scipy_time/60:.0f} mins')
@@ -0,0 +1,61 @@
+'''Measures how 'FisherCache' saves tests of repeated tables in
+'fisher_exact_batch': tables of a synthetic sweep are tested without cache,
+with an empty cache, again with the filled cache, and with a new cache
+reading the on-disk tier saved by the first one. Checks that p-values are
+the same in all cases. Run from the repository root with:
+
+    python -m benchmarks.bench_fisher_cache
+'''
+# %%
+import tempfile
+import time
+import numpy as np
+
+from sweeptools.fishertest import fisher_exact_batch, FisherCache
+
+n_genes = 20000
+n_points = 625
+low_total, high_total = 1500000, 3000000
+
+
+def timed_batch(low, high, cache):
+    start_time = time.perf_counter()
+    p = fisher_exact_batch(low, high, low_total - low, high_total - high,
+                           cache=cache)
+    return p, time.perf_counter() - start_time
+
+
+# %%
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    size = rng.lognormal(3, 1.2, n_genes)[:, None]
+    low = rng.poisson(size * rng.uniform(0.2, 1.2, (n_genes, n_points)))
+    high = rng.poisson(size * rng.uniform(0.2, 1.2, (n_genes, n_points)) * 2)
+    low, high = low.ravel(), high.ravel()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = f'{cache_dir}/fisher-cache.parquet'
+
+        p_ref, secs = timed_batch(low, high, None)
+        print(f'{len(low):,} tables - no cache: {secs:.1f} secs')
+
+        cache = FisherCache(maxsize=1000000, path=path)
+        for run in ['empty cache', 'filled cache']:
+            p, secs = timed_batch(low, high, cache)
+            np.testing.assert_array_equal(p, p_ref)
+            print(f'{run}: {secs:.1f} secs - {cache.stats()}')
+        cache.save()
+
+        disk_cache = FisherCache(maxsize=1000000, path=path)
+        p, secs = timed_batch(low, high, disk_cache)
+        np.testing.assert_array_equal(p, p_ref)
+        print(f'on-disk tier: {secs:.1f} secs - {disk_cache.stats()}')
+
+        small_cache = FisherCache(maxsize=1000)
+        p, secs = timed_batch(low, high, small_cache)
+        np.testing.assert_array_equal(p, p_ref)
+        print(f'cache of 1000 tables: {secs:.1f} secs - '
+              f'{small_cache.stats()}')
+
+    print('P-values match.')
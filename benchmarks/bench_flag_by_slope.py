@@ -0,0 +1,116 @@
+'''Compares the runtime of 'flag_by_slope' with the per gene implementation
+it replaced on a synthetic analyzed screen (their outputs are compared in
+tests/test_flag_by_slope.py). Run from the repository root with:
+
+    python -m benchmarks.bench_flag_by_slope
+'''
+# %%
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzesweep import flag_by_slope, flags_query
+from benchmarks.synthetic import synthetic_analyzed_sweep
+
+n_genes = 20000
+thresholds = [(1, 1e-5), (2, 1e-3), (0.5, 1e-8)]  # (slope_thr, p_thr)
+
+
+def flag_by_slope_loop(grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy,
+                       p_thr: float, slope_thr: float) -> pd.DataFrame:
+    '''Per gene implementation previously used as 'flag_by_slope'.'''
+
+    flagged_df_list = []
+    ct = 0
+
+    for name, group in grouped_sweep:
+
+        # Continue if at least one point in sweep is highly significant
+        if not group.query('p < @p_thr').empty:
+
+            flags_sdir = group.query(flags_query('start'))
+            flags_edir = group.query(flags_query('end'))
+
+            # Remove flags that fall in regions outside of genes and those
+            # where a smaller part of the gene results in a p-value lower
+            # than p_thr
+            if not flags_sdir.empty:
+                flags_sdir = flags_sdir.reset_index().query('srt_off > 0 '
+                                                            '& end_off <= 0'
+                                                            '& p < @p_thr')
+            if not flags_edir.empty:
+                flags_edir = flags_edir.reset_index().query('srt_off >= 0 '
+                                                            '& end_off <= 0')
+
+                # Remove flags where going into the gene results in a p-value
+                # lower than p_thr (trickier than for sdir since the previous
+                # p-value is not saved in flags_edir, so you have to look it
+                # up in the group)
+                step = abs(group.reset_index()['end_off'].iloc[1]
+                           - group.reset_index()['end_off'].iloc[0])
+                flags_edir['prev_end_off'] = flags_edir['end_off'] - step
+                flags_edir = flags_edir.set_index(['srt_off', 'prev_end_off'])
+                flags_edir = flags_edir[group.loc[flags_edir.index].p
+                                        < p_thr]
+
+            if not flags_sdir.empty or not flags_edir.empty:
+                ct += 1
+                # print(f'Flagged: {name}')
+
+                try:
+                    mi_at_tx = group.loc[0, 0].log2_mi
+                    p_at_tx = group.loc[0, 0].p
+                    p_fdr_at_tx = group.loc[0, 0].p_fdr
+                except KeyError:
+                    mi_at_tx = np.nan
+                    p_at_tx = np.nan
+                    p_fdr_at_tx = np.nan
+
+                df = pd.Series({'gene': name,
+                                'mi_at_tx': mi_at_tx,
+                                'p_at_tx': p_at_tx,
+                                'p_fdr_at_tx': p_fdr_at_tx})
+
+                flagged_df_list.append(df)
+
+    print(f'# flagged genes: {ct}')
+
+    if flagged_df_list:
+        flagged = pd.concat(flagged_df_list, axis=1).T
+        flagged = flagged.iloc[abs(flagged.mi_at_tx).sort_values().index]
+        flagged.mi_at_tx = flagged.mi_at_tx.astype(float).round(2)
+        flagged.p_at_tx = flagged.p_at_tx.astype(float).apply(lambda x:
+                                                              f'{x:.2e}')
+    else:
+        flagged = pd.DataFrame(columns=['gene', 'mi_at_tx', 'p_at_tx'])
+
+    flagged = flagged.reset_index(drop=True)
+    # print('\nLikely already seen:')
+    # print("\n".join(already))
+
+    return flagged
+
+
+# %%
+if __name__ == '__main__':
+
+    # Complete grid: the per gene implementation raises KeyError when the
+    # point at the previous end offset of a flag is missing
+    grouped_sweep = synthetic_analyzed_sweep(n_genes).groupby('gene_name')
+    print(f'Synthetic sweep: {n_genes} genes')
+
+    for slope_thr, p_thr in thresholds:
+        print(f'\nslope_thr={slope_thr} - p_thr={p_thr}')
+
+        start_time = time.perf_counter()
+        vectorized = flag_by_slope(grouped_sweep, p_thr, slope_thr)
+        vec_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        looped = flag_by_slope_loop(grouped_sweep, p_thr, slope_thr)
+        loop_time = time.perf_counter() - start_time
+
+        print(f'Vectorized: {vec_time:.2f} secs - '
+              f'per gene loop: {loop_time:.2f} secs - '
+              f'speedup: {loop_time/vec_time:.0f}x - '
+              f'{len(vectorized)} flagged genes')
@@ -0,0 +1,57 @@
+'''Checks that 'flag_by_slope_scan' flags the same genes as calling
+'flag_by_slope' once per (slope_thr, p_thr) pair, and compares their runtime
+on a synthetic analyzed screen. Run from the repository root with:
+
+    python -m benchmarks.bench_flag_by_slope_scan
+'''
+# %%
+import contextlib
+import io
+import itertools
+import time
+import numpy as np
+
+from sweeptools.analyzesweep import flag_by_slope, flag_by_slope_scan
+from benchmarks.synthetic import synthetic_analyzed_sweep
+
+n_genes = 20000
+slope_thrs = [0.25, 0.5, 1, 2, 4]
+p_thrs = [1e-2, 1e-3, 1e-5, 1e-8, 1e-12]
+thresholds = list(itertools.product(slope_thrs, p_thrs))
+
+
+# %%
+if __name__ == '__main__':
+
+    grouped_sweep = synthetic_analyzed_sweep(n_genes,
+                                             missing=0.05).groupby('gene_name')
+    print(f'Synthetic sweep: {n_genes} genes - '
+          f'{len(thresholds)} threshold pairs')
+
+    start_time = time.perf_counter()
+    scan = flag_by_slope_scan(grouped_sweep, thresholds)
+    scan_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        single = {(slope_thr, p_thr): flag_by_slope(grouped_sweep, p_thr,
+                                                    slope_thr)
+                  for slope_thr, p_thr in thresholds}
+    single_time = time.perf_counter() - start_time
+
+    print(f'Scan: {scan_time:.2f} secs - '
+          f'one call per pair: {single_time:.2f} secs - '
+          f'speedup: {single_time/scan_time:.1f}x')
+
+    scan = scan.groupby(['slope_thr', 'p_thr'])['gene']
+    for slope_thr, p_thr in thresholds:
+        expected = np.sort(single[(slope_thr, p_thr)].gene.to_numpy())
+        try:
+            found = np.sort(scan.get_group((slope_thr, p_thr)).to_numpy())
+        except KeyError:
+            found = np.array([], dtype=object)
+        assert np.array_equal(found, expected.astype(object)), \
+            (slope_thr, p_thr)
+        print(f'slope_thr={slope_thr} - p_thr={p_thr}: '
+              f'{len(found)} flagged genes')
+    print('Outputs match.')
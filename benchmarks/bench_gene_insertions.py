@@ -0,0 +1,108 @@
+'''Checks that 'read_gene_insertions' returns the same insertions as the
+query over the whole screen it replaced, on sorted and unsorted synthetic
+insertions, and compares their runtime per gene. Run from the repository
+root with:
+
+    python -m benchmarks.bench_gene_insertions
+'''
+# %%
+import contextlib
+import io
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzeinsertions import read_gene_insertions, _chr_names
+
+n_insertions = 20000000
+n_genes = 50
+
+
+def read_gene_insertions_query(gene: str, insertions: pd.DataFrame,
+                               gene_pos: pd.DataFrame,
+                               padding: int = 2000) -> pd.DataFrame:
+    '''Implementation previously used as 'read_gene_insertions' (its query
+    written as a boolean mask).
+    '''
+
+    min_pos = min(gene_pos['txStart']) - padding
+    max_pos = max(gene_pos['txEnd']) + padding
+
+    chrom = gene_pos['chrom'].iloc[0]
+    gene_strand = gene_pos['strand'].iloc[0]
+
+    insertions = insertions[(insertions['chr'] == chrom)
+                            & (insertions['pos'] >= min_pos)
+                            & (insertions['pos'] <= max_pos)]
+    insertions['dir'] = insertions['strand'].apply(
+        lambda x: 'sense' if x == gene_strand else 'antisense')
+
+    return insertions
+
+
+def synthetic_insertions(n: int, seed: int = 0) -> pd.DataFrame:
+    '''Random insertions in the format returned by 'read_insertions',
+    unsorted.
+    '''
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'chan': pd.Categorical.from_codes(rng.integers(0, 2, n),
+                                          categories=['high', 'low']),
+        'chr': pd.Categorical.from_codes(rng.integers(1, 25, n),
+                                         categories=_chr_names),
+        'strand': pd.Categorical.from_codes(rng.integers(0, 2, n),
+                                            categories=['+', '-']),
+        'pos': rng.integers(0, 250000000, n, dtype=np.int32)})
+
+
+def synthetic_genes(n: int, seed: int = 0) -> list:
+    '''Random gene positions in the format of 'get_gene_positions'.'''
+    rng = np.random.default_rng(seed)
+    genes = []
+    for i in range(n):
+        start = int(rng.integers(0, 248000000))
+        genes.append(pd.DataFrame({
+            'chrom': _chr_names[rng.integers(1, 25)],
+            'strand': rng.choice(['+', '-']),
+            'txStart': [start, start + 1000],
+            'txEnd': [start + int(rng.integers(1000, 2000000)),
+                      start + 5000]}))
+    return genes
+
+
+# %%
+if __name__ == '__main__':
+
+    unsorted = synthetic_insertions(n_insertions)
+    chr_idx = unsorted.chr.cat.codes.to_numpy()
+    sorted_ins = unsorted.iloc[np.lexsort((unsorted.pos, chr_idx))] \
+        .reset_index(drop=True)
+    genes = synthetic_genes(n_genes)
+    print(f'Synthetic insertions: {n_insertions} - genes: {n_genes}')
+
+    for name, insertions in [('sorted', sorted_ins), ('unsorted', unsorted)]:
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            read_gene_insertions('GENE', insertions, genes[0])
+            first_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            searched = [read_gene_insertions(f'GENE{i}', insertions, pos)
+                        for i, pos in enumerate(genes)]
+            search_time = (time.perf_counter() - start_time) / n_genes
+
+        start_time = time.perf_counter()
+        queried = [read_gene_insertions_query(f'GENE{i}', insertions, pos)
+                   for i, pos in enumerate(genes)]
+        query_time = (time.perf_counter() - start_time) / n_genes
+
+        print(f'{name.capitalize()} - first call: {first_time:.2f} secs - '
+              f'per gene: binary search {search_time*1000:.1f} ms, '
+              f'query {query_time*1000:.0f} ms - '
+              f'speedup: {query_time/search_time:.0f}x')
+
+        # 'dir' is categorical when applied over a categorical 'strand'
+        for s, q in zip(searched, queried):
+            pd.testing.assert_frame_equal(s, q.astype({'dir': object}))
+        print(f'Outputs match ({sum(len(x) for x in queried)} insertions).')
@@ -0,0 +1,132 @@
+'''Compares 'get_sweep_data' with the row wise reader it replaced, on a
+synthetic double sweep written to a temporary directory. Run from the
+repository root with:
+
+    python -m benchmarks.bench_get_sweep_data
+'''
+# %%
+import os
+import re
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzesweep import get_sweep_data, sweep_path
+from benchmarks.synthetic import write_synthetic_analyzer_files
+
+# Synthetic screen: 20k genes on a 25x25 grid (step 500), ie. 625 files
+n_genes = 20000
+params = {'screen_name': 'synthetic',
+          'assembly': 'hg38',
+          'trim_length': '50',
+          'mode': 'collapse',
+          'start': 'tx',
+          'end': 'tx',
+          'overlap': 'both',
+          'direction': 'sense',
+          'step': 500}
+
+
+def get_sweep_data_rowwise(data_dir: str, params: dict) -> pd.DataFrame:
+    '''Implementation previously used in 'get_sweep_data'.'''
+
+    data_path = sweep_path(data_dir, params)
+
+    files = os.listdir(data_path)
+    df_list = []  # Initialize list to append data
+    repeated_genes = set()
+    for idx, filename in enumerate(files):
+
+        if filename.startswith('out'):
+
+            # print(f'Reading file: {idx + 1} of {len(files)}')
+
+            # Get param values from filename
+            match = re.search(r'_start=(.*?)_', filename)
+            start = match.group(1)
+            match = re.search(r'_end=(.*?)_', filename)
+            end = match.group(1)
+
+            # File to df, add columns for each param value and add to list
+            df = pd.read_csv(data_path + filename, sep='\t',
+                             index_col=None, header=None)
+            df[6] = start
+            df[7] = end
+
+            # Remove header line if included
+            if df.iloc[0][0] == 'gene':
+                df = df.drop([0])
+
+            df = df.rename(columns={0: 'gene_name', 1: 'low_counts',
+                                    2: 'high_counts', 3: 'p',
+                                    4: 'p_fdr', 5: 'log2_mi',
+                                    6: 'start', 7: 'end'})
+
+            repeated = df.groupby('gene_name').apply(lambda x: len(x))
+            repeated_genes.update(repeated[repeated > 1].index)
+
+            df = df.groupby('gene_name').first()
+            df = df.reset_index()
+
+            df_list.append(df)
+
+    if repeated_genes:
+        print('-- Warning! The following genes were repeated, so only first '
+              'instance was considered:')
+        print('\n'.join(repeated_genes))
+
+    # Create single dataframe from list
+    sweep_data = pd.concat(df_list, axis=0, ignore_index=True)
+
+    # sweep_data = sweep_data.rename(columns={0: 'gene_name', 1: 'low_counts',
+    #                                         2: 'high_counts', 3: 'p',
+    #                                         4: 'p_fdr', 5: 'log2_mi',
+    #                                         6: 'start', 7: 'end'})
+
+    # Trandform parameter into numbers, eg. 'tx-100' is changed to column
+    # 'offset' with value -100:int
+    sweep_data[['srt_off', 'end_off']] = sweep_data[['start', 'end']].applymap(
+        lambda x: ''.join(re.split('(-|\\+)', x)[1:3])).astype(np.int16)
+
+    # Rearrange and change data types
+    sweep_data = sweep_data.sort_values(by=['gene_name', 'srt_off', 'end_off'])
+    sweep_data = sweep_data.drop(['start', 'end'], axis=1)
+
+    int_cols = ['low_counts', 'high_counts', 'srt_off', 'end_off']
+    sweep_data[int_cols] = (sweep_data[int_cols]
+                            .apply(lambda x:
+                                   pd.to_numeric(x, downcast='integer')))
+
+    float_cols = ['p', 'p_fdr', 'log2_mi']
+    sweep_data[float_cols] = (sweep_data[float_cols]
+                              .apply(lambda x:
+                                     pd.to_numeric(x, downcast='float')))
+
+    return sweep_data
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+
+        write_synthetic_analyzer_files(data_dir, params, n_genes)
+        n_files = len(os.listdir(sweep_path(data_dir, params)))
+        print(f'Synthetic sweep: {n_genes} genes, {n_files} files')
+
+        start_time = time.perf_counter()
+        columnar = get_sweep_data(data_dir, params)
+        new_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        rowwise = get_sweep_data_rowwise(data_dir, params)
+        old_time = time.perf_counter() - start_time
+
+    print(f'Columnar reader: {new_time:.2f} secs')
+    print(f'Row wise reader: {old_time:.2f} secs')
+
+    # Row labels depend on the order in which files were listed
+    pd.testing.assert_frame_equal(columnar.reset_index(drop=True),
+                                  rowwise.reset_index(drop=True))
+    print(f'Outputs match. Speedup: {old_time/new_time:.0f}x')
@@ -0,0 +1,76 @@
+'''Compares the runtime of 'read_insertion_file' with the per record ctypes
+loop previously used in 'write_insertions', on files generated with
+'CInsertion' (their outputs are compared in tests/test_insertion_decoder.py).
+Run from the repository root with:
+
+    python -m benchmarks.bench_insertion_decoder
+'''
+# %%
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from ctypes import sizeof
+
+from sweeptools.analyzeinsertions import CInsertion, read_insertion_file
+
+n_insertions = 2000000
+
+
+def write_insertion_file(filename: str, n: int, seed: int = 0) -> None:
+    '''Writes 'n' random insertions with the ctypes layout of 'CInsertion'.
+    '''
+    rng = np.random.default_rng(seed)
+    codes = [x for x in list(range(0, 26)) if not x == 23]
+    chrs = rng.choice(codes, n)
+    strands = rng.choice([b'+', b'-'], n)
+    positions = rng.integers(0, 250000000, n)
+
+    records = (CInsertion * n)()
+    for i in range(n):
+        records[i].c = int(chrs[i])
+        records[i].s = strands[i]
+        records[i].p = int(positions[i])
+
+    with open(filename, 'wb') as file:
+        file.write(bytes(records))
+
+
+def read_insertion_file_ctypes(filename: str) -> pd.DataFrame:
+    '''Per record implementation previously used in 'write_insertions'.'''
+
+    keys = [x for x in list(range(0, 26)) if not x == 23]
+    values = [f'chr{i}' for i in range(0, 23)] + ['chrX'] + ['chrY']
+    chr_dict = dict(zip(keys, values))
+
+    insertions = []
+    with open(filename, 'rb') as file:
+        c_ins = CInsertion()
+        while file.readinto(c_ins) == sizeof(c_ins):
+            ins = [chr_dict[c_ins.c], str(c_ins.s, 'utf-8'), c_ins.p]
+            insertions.append(ins)
+
+    return pd.DataFrame(insertions, columns=['chr', 'strand', 'pos'])
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        filename = f'{data_dir}/high'
+        write_insertion_file(filename, n_insertions)
+        print(f'Synthetic insertion file: {n_insertions} insertions, '
+              f'{os.path.getsize(filename)} bytes')
+
+        start_time = time.perf_counter()
+        read_insertion_file(filename)
+        dec_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        read_insertion_file_ctypes(filename)
+        loop_time = time.perf_counter() - start_time
+
+        print(f'Structured dtype: {dec_time:.2f} secs - '
+              f'ctypes loop: {loop_time:.2f} secs - '
+              f'speedup: {loop_time/dec_time:.0f}x')
@@ -0,0 +1,46 @@
+'''Checks that 'insertion_density' renders the same normalized curves as
+scipy.stats.gaussian_kde, which 'plot_transcripts' used before, and
+compares their runtime for genes of increasing size and number of
+insertions. Run from the repository root with:
+
+    python -m benchmarks.bench_insertion_density
+'''
+# %%
+import time
+import numpy as np
+from scipy import stats
+
+from sweeptools.analyzeinsertions import insertion_density
+
+# (insertions, gene length in bp), positions evaluated every 10 bp with
+# 2 kb padding as in 'plot_transcripts'
+cases = [(2, 5000), (30, 20000), (300, 80000), (3000, 300000),
+         (20000, 2200000), (5, 2200000)]
+padd = 2000
+
+
+# %%
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    for n, length in cases:
+        # Half uniform over the gene and half in a hotspot
+        pos = np.r_[rng.integers(-padd, length + padd, n // 2),
+                    rng.normal(length / 3, length / 20,
+                               n - n // 2).astype(int)]
+        x = np.arange(-padd, length + padd + 1, 10)
+
+        start_time = time.perf_counter()
+        kde = stats.gaussian_kde(pos).evaluate(x)
+        kde_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        dens = insertion_density(pos, x)
+        dens_time = time.perf_counter() - start_time
+
+        diff = np.abs(kde / kde.max() - dens / dens.max()).max()
+        print(f'{n} insertions in {length:,} bp - gaussian_kde: '
+              f'{kde_time:.3f} secs - insertion_density: {dens_time:.3f} '
+              f'secs - max difference: {diff:.1e}')
+        assert diff < 1e-9
+    print('Normalized curves match.')
@@ -0,0 +1,104 @@
+'''Checks that 'read_insertions_region' returns the same insertions as the
+per record ctypes scan of the insertion files it replaced, and compares
+their runtime per region on synthetic insertion files. Run from the
+repository root with:
+
+    python -m benchmarks.bench_insertion_region
+'''
+# %%
+import contextlib
+import io
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from ctypes import sizeof
+
+from sweeptools.analyzeinsertions import (CInsertion, read_insertions_region,
+                                          write_insertion_index)
+from benchmarks.bench_insertion_decoder import write_insertion_file
+
+n_insertions = 2000000
+n_regions = 5
+screen_name, assembly, trim_length = 'SYNTHETIC', 'hg38', 50
+
+
+def read_insertions_region_ctypes(data_dir: str, screen_name: str,
+                                  assembly: str, trim_length: int,
+                                  chrom: str, start: int, end: int,
+                                  padd: int = 0) -> pd.DataFrame:
+    '''Per record implementation previously used as
+    'read_insertions_region'.
+    '''
+
+    start = start - padd
+    end = end + padd
+
+    data_path = (f'''{data_dir}/{screen_name}/'''
+                 f'''{assembly}/{trim_length}/''')
+
+    keys = [x for x in list(range(0, 26)) if not x == 23]
+    values = [f'chr{i}' for i in range(0, 23)] + ['chrX'] + ['chrY']
+    chr_dict = dict(zip(keys, values))
+
+    insertions = []
+    for c in ['high', 'low']:
+        with open(f'{data_path}{c}', 'rb') as file:
+            c_ins = CInsertion()
+            while file.readinto(c_ins) == sizeof(c_ins):
+                if (chr_dict[c_ins.c] == f'chr{chrom}'
+                        and c_ins.p > start and c_ins.p < end):
+                    insertions.append([c, chr_dict[c_ins.c],
+                                       str(c_ins.s, 'utf-8'), c_ins.p])
+
+    return pd.DataFrame(insertions, columns=['chan', 'chr', 'strand', 'pos'])
+
+
+# %%
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    regions = [(str(rng.choice(['1', '9', 'X'])), int(x), int(x) + 200000)
+               for x in rng.integers(0, 249000000, n_regions)]
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        data_path = f'{data_dir}/{screen_name}/{assembly}/{trim_length}/'
+        os.makedirs(data_path)
+        write_insertion_file(f'{data_path}high', n_insertions, seed=1)
+        write_insertion_file(f'{data_path}low', n_insertions, seed=2)
+        print(f'Synthetic insertion files: {n_insertions} insertions each')
+
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_insertion_index(data_dir, screen_name, assembly,
+                                  trim_length)
+        print(f'Index written in {time.perf_counter() - start_time:.2f} '
+              f'secs')
+
+        idx_time, loop_time = 0, 0
+        for chrom, start, end in regions:
+            start_time = time.perf_counter()
+            indexed = read_insertions_region(data_dir, screen_name, assembly,
+                                             trim_length, chrom, start, end,
+                                             5000)
+            idx_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            looped = read_insertions_region_ctypes(data_dir, screen_name,
+                                                   assembly, trim_length,
+                                                   chrom, start, end, 5000)
+            loop_time += time.perf_counter() - start_time
+
+            # Insertions within each channel are sorted by position
+            looped = looped.sort_values(by=['chan', 'pos', 'strand'],
+                                        ignore_index=True)
+            indexed = indexed.sort_values(by=['chan', 'pos', 'strand'],
+                                          ignore_index=True)
+            pd.testing.assert_frame_equal(indexed.astype({'pos': np.int64}),
+                                          looped)
+
+        print(f'Per region - indexed: {idx_time/n_regions*1000:.1f} ms - '
+              f'ctypes scan: {loop_time/n_regions*1000:.0f} ms - '
+              f'speedup: {loop_time/idx_time:.0f}x')
+        print(f'Outputs match ({n_regions} regions).')
@@ -0,0 +1,65 @@
+'''Checks that a 'LazyGroupedSweep' returns the same gene data as the
+grouped dataframe read by 'read_analyzed_sweep', and compares the time to
+open a screen and read a single gene from a synthetic analyzed screen. Run
+from the repository root with:
+
+    python -m benchmarks.bench_lazy_sweep
+'''
+# %%
+import contextlib
+import io
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzesweep import (write_sweep_data, read_analyzed_sweep,
+                                     get_gene_info)
+from benchmarks.synthetic import synthetic_sweep
+
+n_genes = 20000
+n_lookups = 20
+params = {'screen_name': 'SYNTHETIC',
+          'assembly': 'hg38',
+          'trim_length': '50',
+          'mode': 'collapse',
+          'start': 'tx',
+          'end': 'tx',
+          'overlap': 'both',
+          'direction': 'sense',
+          'step': 500}
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_sweep_data(data_dir, synthetic_sweep(n_genes), params)
+        print(f'Synthetic sweep: {n_genes} genes')
+
+        start_time = time.perf_counter()
+        grouped_sweep = read_analyzed_sweep(data_dir, params)
+        full_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        lazy_sweep = read_analyzed_sweep(data_dir, params, lazy=True)
+        open_time = time.perf_counter() - start_time
+
+        genes = np.random.default_rng(0).choice(
+            list(grouped_sweep.groups.keys()), n_lookups)
+        start_time = time.perf_counter()
+        for gene in genes:
+            gene_info = get_gene_info(gene, lazy_sweep)
+        gene_time = (time.perf_counter() - start_time) / n_lookups
+
+        print(f'Full read: {full_time:.2f} secs - '
+              f'lazy open: {open_time*1000:.1f} ms - '
+              f'lazy read of one gene: {gene_time*1000:.1f} ms')
+
+        for gene in genes:
+            pd.testing.assert_frame_equal(get_gene_info(gene, lazy_sweep),
+                                          get_gene_info(gene, grouped_sweep))
+        assert list(lazy_sweep.groups.keys()) == \
+            list(grouped_sweep.groups.keys())
+        print('Outputs match.')
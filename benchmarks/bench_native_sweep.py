@@ -0,0 +1,132 @@
+'''Checks the counts, p-values, FDR and log2 MI of 'native_sweep_data'
+against a per gene and per sweep point count of the insertions in each
+gene region, and times the whole double sweep of a synthetic screen for
+every overlap and direction. Run from the repository root with:
+
+    python -m benchmarks.bench_native_sweep
+'''
+# %%
+import contextlib
+import io
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from scipy.stats import fisher_exact
+
+from sweeptools.analyzeinsertions import (read_refseq, _insertion_index,
+                                          _chr_names)
+from sweeptools.nativesweep import native_sweep_data, gene_regions
+from benchmarks.bench_insertion_decoder import write_insertion_file
+from benchmarks.bench_refseq import write_refseq_file
+
+n_insertions = 2000000
+n_genes = 20000
+n_checked = 25
+screen_name, assembly, trim_length = 'SYNTHETIC', 'hg38', 50
+params = {'screen_name': screen_name, 'assembly': assembly,
+          'trim_length': trim_length, 'mode': 'collapse', 'step': 500}
+
+
+def count_gene(insertions: pd.DataFrame, regions: pd.DataFrame, gene: str,
+               srt_off: int, end_off: int, direction: str,
+               overlap: str) -> tuple:
+    '''Low and high counts of a gene at one sweep point, counted insertion
+    by insertion.
+    '''
+
+    def bounds(x):
+        if x.strand == '+':
+            return x.tx_start + srt_off, x.tx_end + end_off
+        return x.tx_start - end_off, x.tx_end - srt_off
+
+    gene_reg = regions.loc[gene]
+    lo, hi = bounds(gene_reg)
+    ins = insertions.query('chr == @gene_reg.chrom & pos >= @lo & pos < @hi')
+    if direction == 'sense':
+        ins = ins[ins.strand == gene_reg.strand]
+    elif direction == 'antisense':
+        ins = ins[ins.strand != gene_reg.strand]
+
+    if overlap == 'neither':
+        others = regions[(regions.chrom == gene_reg.chrom)
+                         & (regions.index != gene)]
+        for _, other in others.iterrows():
+            o_lo, o_hi = bounds(other)
+            if o_lo < o_hi:
+                ins = ins[(ins.pos < o_lo) | (ins.pos >= o_hi)]
+
+    return (ins.chan == 'low').sum(), (ins.chan == 'high').sum()
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        data_path = f'{data_dir}/{screen_name}/{assembly}/{trim_length}/'
+        os.makedirs(data_path)
+        write_insertion_file(f'{data_path}high', n_insertions, seed=1)
+        write_insertion_file(f'{data_path}low', n_insertions // 2, seed=2)
+        write_refseq_file(f'{data_dir}/ncbi-genes-{assembly}.txt', n_genes)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            refseq = read_refseq(data_dir, assembly)
+            index = _insertion_index(data_dir, screen_name, assembly,
+                                     trim_length)
+        print(f'Synthetic screen: {n_insertions} high and '
+              f'{n_insertions // 2} low insertions, '
+              f'{refseq.name2.nunique()} genes')
+
+        chr_idx = np.repeat(np.arange(len(_chr_names)),
+                            np.diff(index['chr_offsets']))
+        insertions = pd.DataFrame({
+            'chan': np.array(['high', 'low'])[index['chan']],
+            'chr': np.array(_chr_names)[chr_idx],
+            'strand': index['strand'].astype(str),
+            'pos': np.asarray(index['pos'])})
+        regions = gene_regions(refseq).set_index('gene_name')
+
+        rng = np.random.default_rng(0)
+        checked = rng.choice(regions.index, n_checked, replace=False)
+
+        for overlap, direction in [('both', 'sense'), ('both', 'both'),
+                                   ('neither', 'sense'),
+                                   ('neither', 'antisense')]:
+            point_params = {**params, 'overlap': overlap,
+                            'direction': direction}
+
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                sweep = native_sweep_data(data_dir, refseq, point_params)
+            secs = time.perf_counter() - start_time
+            points = sweep.groupby(['srt_off', 'end_off']).ngroups
+            print(f'overlap={overlap} direction={direction} - {len(sweep)} '
+                  f'rows at {points} sweep points in {secs:.1f} secs')
+
+            # Counts of a sample of genes at a sample of points
+            sample = sweep[sweep.gene_name.isin(checked)].sample(
+                200, random_state=0)
+            for row in sample.itertuples():
+                counts = count_gene(insertions, regions, row.gene_name,
+                                    row.srt_off, row.end_off, direction,
+                                    overlap)
+                assert counts == (row.low_counts, row.high_counts), \
+                    (row, counts)
+
+            # Statistics of all genes at one point
+            point = sweep.query('srt_off == -500 & end_off == 1000')
+            low_total, high_total = n_insertions // 2, n_insertions
+            p = [fisher_exact([[lo, hi], [low_total - lo, high_total - hi]])[1]
+                 for lo, hi in zip(point.low_counts, point.high_counts)]
+            np.testing.assert_allclose(point.p, p, rtol=1e-6)
+            # Tied p-values may be ranked in any order
+            rank = pd.Series(p).rank(method='first').to_numpy()
+            np.testing.assert_allclose(np.sort(point.p_fdr),
+                                       np.sort(np.array(p) * len(p) / rank),
+                                       rtol=1e-6)
+            mi = np.log2(((point.high_counts + 1) / high_total)
+                         / ((point.low_counts + 1) / low_total))
+            np.testing.assert_allclose(point.log2_mi, mi, rtol=1e-6)
+
+        print(f'Counts ({n_checked} genes) and statistics match.')
@@ -0,0 +1,129 @@
+'''Checks that 'optimize_flagged_genes' returns the same optimized points as
+the per gene implementation it replaced, and compares their runtime on a
+synthetic analyzed screen. Run from the repository root with:
+
+    python -m benchmarks.bench_optimize_flagged
+'''
+# %%
+import contextlib
+import io
+import time
+import warnings
+import pandas as pd
+from math import log10
+
+from sweeptools.analyzesweep import flag_by_slope, optimize_flagged_genes
+from benchmarks.synthetic import synthetic_analyzed_sweep
+
+n_genes = 20000
+n_looped = 1000
+p_thr = 1e-5
+slope_thr = 1
+weights = [(2, 1, 0, 0), (1, 1, 1, 1), (1, 2, 0.5, 0)]  # mi, p, ins, off
+
+
+def sort_optimized_mi_loop(group, p_thr=1e-5, weight_mi=1, weight_p=1,
+                           weight_ins=0, weight_off=0):
+    '''Per gene implementation previously used as 'sort_optimized_mi'.'''
+
+    opt = group.copy(deep=True)
+    opt = opt.reset_index()
+
+    opt = opt.query('srt_off >=0 & end_off <= 0 & p < @p_thr')
+
+    opt['norm_mi'] = opt.log2_mi/10
+    opt['norm_log10_p'] = opt.p.apply(
+        lambda x: abs(-log10(x))/50 if x > 0 else 1)
+    max_ins = max(opt.high_counts + opt.low_counts)
+    opt['norm_ins'] = (opt.high_counts + opt.low_counts)/max_ins
+
+    max_off = max(abs(opt.srt_off) + abs(opt.end_off))
+    opt['norm_off'] = 1 - (abs(opt.srt_off) + abs(opt.end_off))/max_off
+
+    opt['score'] = ((weight_mi*opt.norm_mi)**2
+                    + (weight_p*opt.norm_log10_p)**2
+                    + (weight_ins*opt.norm_ins)**2
+                    + (weight_off*opt.norm_off)**2)
+
+    opt = opt.sort_values(by=['score'], ascending=False)
+
+    opt = opt[['srt_off', 'end_off', 'gene_name', 'high_counts',
+               'low_counts', 'log2_mi', 'p', 'score', 'norm_mi',
+               'norm_log10_p', 'norm_ins', 'norm_off']]
+
+    return opt
+
+
+def optimize_flagged_genes_loop(flagged, grouped_sweep, delta_mi_thr=0,
+                                p_thr=1e-5, weight_mi=2, weight_p=1,
+                                weight_ins=0, weight_off=0):
+    '''Per gene implementation previously used as 'optimize_flagged_genes'.
+    '''
+    opt_list = []
+    for gene in list(flagged.gene):
+
+        group = grouped_sweep.get_group(gene)
+        opt = sort_optimized_mi_loop(group, p_thr, weight_mi, weight_p,
+                                     weight_ins, weight_off)
+
+        gene_at_tx = flagged.set_index('gene').loc[gene]
+        gene_at_tx['p_fdr_at_tx'] = group.loc[0, 0]['p_fdr']
+        gene_at_tx['high_at_tx'] = group.loc[0, 0]['high_counts']
+        gene_at_tx['low_at_tx'] = group.loc[0, 0]['low_counts']
+        gene_at_tx['counts_at_tx'] = (gene_at_tx.high_at_tx
+                                      + gene_at_tx.low_at_tx)
+
+        gene_opt = gene_at_tx.append(opt.iloc[0][['gene_name', 'srt_off',
+                                                  'end_off', 'log2_mi', 'p',
+                                                  'low_counts',
+                                                  'high_counts']])
+        gene_opt['counts'] = gene_opt.high_counts + gene_opt.low_counts
+
+        if gene_opt.srt_off != 0 or gene_opt.end_off != 0:
+            if abs(gene_opt.mi_at_tx - gene_opt.log2_mi) > delta_mi_thr:
+                opt_list.append(gene_opt)
+
+    optimized_mi = pd.concat(opt_list, axis=1).T
+
+    return optimized_mi
+
+
+# %%
+if __name__ == '__main__':
+
+    grouped_sweep = synthetic_analyzed_sweep(n_genes).groupby('gene_name')
+    with contextlib.redirect_stdout(io.StringIO()):
+        flagged = flag_by_slope(grouped_sweep, p_thr, slope_thr)
+    # Flags as read back from the csv file written by 'flags-by-slope.py'
+    flagged = pd.read_csv(io.StringIO(flagged.to_csv(index=False)))
+    print(f'Synthetic sweep: {n_genes} genes - {len(flagged)} flagged')
+    sample = flagged.sample(n_looped, random_state=0).reset_index(drop=True)
+
+    for weight_mi, weight_p, weight_ins, weight_off in weights:
+        kwargs = dict(delta_mi_thr=0.5, p_thr=p_thr, weight_mi=weight_mi,
+                      weight_p=weight_p, weight_ins=weight_ins,
+                      weight_off=weight_off)
+        print(f'\nweights mi={weight_mi} p={weight_p} ins={weight_ins} '
+              f'off={weight_off}')
+
+        start_time = time.perf_counter()
+        optimize_flagged_genes(flagged, grouped_sweep, **kwargs)
+        vec_time = time.perf_counter() - start_time
+
+        vectorized = optimize_flagged_genes(sample, grouped_sweep, **kwargs)
+        start_time = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            looped = optimize_flagged_genes_loop(sample, grouped_sweep,
+                                                 **kwargs)
+        loop_time = (time.perf_counter() - start_time) * len(flagged)/n_looped
+
+        print(f'Vectorized: {vec_time:.2f} secs - per gene loop: '
+              f'{loop_time:.0f} secs (estimated from {n_looped} genes) - '
+              f'speedup: {loop_time/vec_time:.0f}x')
+
+        assert list(vectorized.columns) == list(looped.columns)
+        assert vectorized.index.equals(looped.index)
+        pd.testing.assert_frame_equal(vectorized, looped.infer_objects(),
+                                      check_dtype=False)
+        print(f'Outputs match ({len(vectorized)} optimized genes).')
@@ -0,0 +1,166 @@
+'''Checks that the compiled RefSeq annotation gives the same transcripts and
+exon regions as parsing the RefSeq file on every call, and compares the
+cost of loading the annotation and of looking up a gene. Uses a synthetic
+RefSeq file written to a temporary directory. Run from the repository root
+with:
+
+    python -m benchmarks.bench_refseq
+'''
+# %%
+import contextlib
+import io
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzeinsertions import (read_refseq, get_gene_positions,
+                                          get_exon_regions,
+                                          get_gene_exon_regions,
+                                          _gene_offsets, _refseq_index)
+
+assembly = 'hg38'
+n_genes = 20000
+n_lookups = 200
+
+refseq_cols = ['#bin', 'name', 'chrom', 'strand', 'txStart', 'txEnd',
+               'cdsStart', 'cdsEnd', 'exonCount', 'exonStarts', 'exonEnds',
+               'score', 'name2', 'cdsStartStat', 'cdsEndStat', 'exonFrames']
+
+
+def write_refseq_file(filename: str, n_genes: int, seed: int = 0) -> None:
+    '''Random RefSeq file with a few transcripts per gene, shuffled like
+    the UCSC table. Includes predicted, non-coding and incomplete
+    transcripts and alternative chromosomes.
+    '''
+    rng = np.random.default_rng(seed)
+    chroms = [f'chr{i}' for i in range(1, 23)] + ['chrX', 'chrY',
+                                                 'chr1_KI270706v1_random']
+    prefixes = ['NM_', 'NM_', 'NM_', 'NR_', 'XM_', 'XR_']
+    rows = []
+    for g in range(n_genes):
+        chrom = chroms[rng.integers(len(chroms))]
+        strand = '+-'[rng.integers(2)]
+        tx_start = int(rng.integers(1, 200000000))
+        for t in range(int(rng.integers(1, 6))):
+            n = int(rng.integers(1, 20))
+            starts = (tx_start + np.sort(rng.choice(200, n, replace=False))
+                      * 600)
+            ends = starts + rng.integers(50, 500, n)
+            prefix = prefixes[rng.integers(len(prefixes))]
+            if prefix[1] == 'R':
+                cds_start = cds_end = int(ends[-1])
+            else:
+                cds_start = int(rng.integers(starts[0], ends[n // 4]))
+                cds_end = int(rng.integers(starts[3 * n // 4], ends[-1]))
+            status = 'cmpl' if rng.random() < 0.9 else 'incmpl'
+            rows.append([0, f'{prefix}{g:06d}{t}.1', chrom, strand,
+                         int(starts[0]), int(ends[-1]), cds_start, cds_end,
+                         n, ','.join(map(str, starts)) + ',',
+                         ','.join(map(str, ends)) + ',', 0, f'G{g:05d}',
+                         status, 'cmpl', ','.join(['0'] * n) + ','])
+    rows = [rows[i] for i in rng.permutation(len(rows))]
+    pd.DataFrame(rows, columns=refseq_cols).to_csv(filename, sep='\t',
+                                                   index=False)
+
+
+def read_refseq_csv(data_dir: str, assembly: str,
+                    name_chrom: bool = False) -> pd.DataFrame:
+    '''Implementation previously used as 'read_refseq'.'''
+
+    filename = f'{data_dir}/ncbi-genes-{assembly}.txt'
+    refseq = pd.read_csv(filename, sep='\\t', engine='python')
+    refseq = refseq.query('name.str.startswith("N") '
+                          '& cdsStartStat == "cmpl"'
+                          '& cdsEndStat == "cmpl"')
+    refseq['coding'] = refseq.name.str.contains('^[NX]M_*')
+    refseq['known'] = refseq.name.str.contains('^[N][MR]_*')
+    refseq = refseq[~refseq['chrom'].str.contains('_')]
+    if name_chrom:
+        refseq['name_chr'] = refseq.apply(lambda x:
+                                          f'{x.name2}_{x.chrom}', axis=1)
+    return refseq
+
+
+def get_gene_positions_groupby(gene: str,
+                               refseq: pd.DataFrame) -> pd.DataFrame:
+    '''Implementation previously used as 'get_gene_positions'.'''
+    return refseq.groupby('name2').get_group(gene)
+
+
+def timed(fun, *args, **kwargs):
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        out = fun(*args, **kwargs)
+    return out, time.perf_counter() - start_time
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_refseq_file(f'{data_dir}/ncbi-genes-{assembly}.txt', n_genes)
+
+        old, old_time = timed(read_refseq_csv, data_dir, assembly,
+                              name_chrom=True)
+        _, compile_time = timed(read_refseq, data_dir, assembly,
+                                name_chrom=True)
+        new, new_time = timed(read_refseq, data_dir, assembly,
+                              name_chrom=True)
+        print(f'Load {len(old)} transcripts - csv: {old_time:.2f} secs - '
+              f'compile: {compile_time:.2f} secs - '
+              f'compiled: {new_time:.2f} secs')
+
+        pd.testing.assert_frame_equal(new, old)
+        print('Annotations match, in file order.')
+
+        # Gene index is read with the compiled annotation, not grouped again
+        index = _refseq_index(new)
+        (order, genes, offsets), index_time = timed(
+            _gene_offsets, new['name2'].to_numpy())
+        assert (index['order'] == order).all()
+        assert (index['genes'] == genes).all()
+        assert (index['offsets'] == offsets).all()
+        print(f'Gene index read with the annotation (grouping it: '
+              f'{index_time*1000:.0f} ms)')
+
+        # Touching the file without changing it keeps the compiled files
+        refseq_file = f'{data_dir}/ncbi-genes-{assembly}.txt'
+        os.utime(refseq_file)
+        _, touched_time = timed(read_refseq, data_dir, assembly)
+        n_compiled = sum(x.endswith('.exons.parquet')
+                         for x in os.listdir(data_dir))
+        assert n_compiled == 1
+        print(f'After touching refseq file: {touched_time:.2f} secs '
+              f'(hashed again, not compiled)')
+
+        rng = np.random.default_rng(1)
+        genes = rng.choice(old.name2.unique(), n_lookups, replace=False)
+
+        old_time = new_time = exon_old_time = exon_new_time = 0
+        for gene in genes:
+            old_pos, secs = timed(get_gene_positions_groupby, gene, old)
+            old_time += secs
+            new_pos, secs = timed(get_gene_positions, gene, new)
+            new_time += secs
+            pd.testing.assert_frame_equal(new_pos, old_pos)
+
+            old_exons, secs = timed(get_exon_regions, old_pos)
+            exon_old_time += secs
+            new_exons, secs = timed(get_gene_exon_regions, gene, new)
+            exon_new_time += secs
+            pd.testing.assert_frame_equal(new_exons, old_exons)
+
+        print(f'Gene positions ({n_lookups} genes) - groupby: '
+              f'{old_time/n_lookups*1000:.2f} ms - '
+              f'index: {new_time/n_lookups*1000:.3f} ms per gene')
+        print(f'Exon regions ({n_lookups} genes) - computed: '
+              f'{exon_old_time/n_lookups*1000:.2f} ms - '
+              f'compiled: {exon_new_time/n_lookups*1000:.2f} ms per gene')
+        print('Gene positions and exon regions match.')
+
+        try:
+            get_gene_positions('not_a_gene', new)
+        except KeyError:
+            print('Unknown genes raise KeyError.')
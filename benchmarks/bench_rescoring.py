@@ -0,0 +1,63 @@
+'''Checks that re-scoring precomputed 'OptimizationFeatures' under new
+weights gives the same optimized points as 'optimize_flagged_genes', and
+compares the time of a re-scoring with a full optimization on a synthetic
+analyzed screen. Run from the repository root with:
+
+    python -m benchmarks.bench_rescoring
+'''
+# %%
+import contextlib
+import io
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzesweep import (flag_by_slope, optimize_flagged_genes,
+                                     OptimizationFeatures)
+from benchmarks.synthetic import synthetic_analyzed_sweep
+
+n_genes = 20000
+p_thr = 1e-5
+slope_thr = 1
+n_weights = 20
+
+
+# %%
+if __name__ == '__main__':
+
+    grouped_sweep = synthetic_analyzed_sweep(n_genes).groupby('gene_name')
+    with contextlib.redirect_stdout(io.StringIO()):
+        flagged = flag_by_slope(grouped_sweep, p_thr, slope_thr)
+    flagged = pd.read_csv(io.StringIO(flagged.to_csv(index=False)))
+
+    start_time = time.perf_counter()
+    features = OptimizationFeatures(flagged, grouped_sweep, p_thr)
+    feat_time = time.perf_counter() - start_time
+    print(f'Synthetic sweep: {n_genes} genes - {len(flagged)} flagged - '
+          f'{len(features)} scored points - features in {feat_time:.2f} secs')
+
+    rng = np.random.default_rng(0)
+    weights = np.round(rng.random((n_weights, 4)) * 3, 1)
+
+    rescore_time, full_time = 0, 0
+    for weight_mi, weight_p, weight_ins, weight_off in weights:
+        kwargs = dict(delta_mi_thr=0.5, weight_mi=weight_mi,
+                      weight_p=weight_p, weight_ins=weight_ins,
+                      weight_off=weight_off)
+
+        start_time = time.perf_counter()
+        rescored = features.optimize(**kwargs)
+        rescore_time += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        full = optimize_flagged_genes(flagged, grouped_sweep, p_thr=p_thr,
+                                      **kwargs)
+        full_time += time.perf_counter() - start_time
+
+        pd.testing.assert_frame_equal(rescored, full)
+
+    print(f'{n_weights} weight sets - re-scoring: '
+          f'{rescore_time/n_weights*1000:.0f} ms - full optimization: '
+          f'{full_time/n_weights*1000:.0f} ms per set - speedup: '
+          f'{full_time/rescore_time:.1f}x')
+    print('Outputs match.')
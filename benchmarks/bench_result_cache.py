@@ -0,0 +1,138 @@
+'''Checks that 'ResultCache' returns the same flags and optimized genes as
+'flag_by_slope' and 'optimize_flagged_genes', recomputes only the screens
+whose analyzed sweep changed, and compares the time of a cold and a warm
+run over several synthetic analyzed screens. Run from the repository root
+with:
+
+    python -m benchmarks.bench_result_cache
+'''
+# %%
+import contextlib
+import io
+import tempfile
+import time
+from unittest import mock
+import pandas as pd
+
+from sweeptools.analyzesweep import (write_sweep_data, read_analyzed_sweep,
+                                     flag_by_slope, optimize_flagged_genes,
+                                     NoOptimizedGenes)
+from sweeptools.resultcache import ResultCache
+from benchmarks.synthetic import synthetic_sweep
+
+n_screens = 6
+n_genes = 5000
+slope_thr = 1
+p_thr = 1e-5
+params = {'screen_name': '',
+          'assembly': 'hg38',
+          'trim_length': '50',
+          'mode': 'collapse',
+          'start': 'tx',
+          'end': 'tx',
+          'overlap': 'both',
+          'direction': 'sense',
+          'step': 500}
+screens = [f'SYNTHETIC{i}' for i in range(n_screens)]
+
+
+def run_screens(cache: ResultCache) -> dict:
+    '''Flags and optimized genes of all screens, as in the scripts.'''
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for screen in screens:
+            screen_params = {**params, 'screen_name': screen}
+            flagged = cache.flag_by_slope(screen_params, p_thr, slope_thr)
+            optimized_mi = cache.optimize_flagged_genes(
+                screen_params, flagged.astype({'p_at_tx': float}),
+                delta_mi_thr=0.5)
+            results[screen] = (flagged, optimized_mi)
+    return results
+
+
+def check_results(sweep_dir: str, results: dict) -> None:
+    '''Compares cached results with the functions they cache.'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        for screen, (flagged, optimized_mi) in results.items():
+            grouped_sweep = read_analyzed_sweep(
+                sweep_dir, {**params, 'screen_name': screen})
+            expected = flag_by_slope(grouped_sweep, p_thr, slope_thr)
+            pd.testing.assert_frame_equal(flagged, expected)
+            pd.testing.assert_frame_equal(optimized_mi, optimize_flagged_genes(
+                expected.astype({'p_at_tx': float}), grouped_sweep,
+                delta_mi_thr=0.5))
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        sweep_dir, cache_dir = f'{data_dir}/sweeps', f'{data_dir}/cache'
+        with contextlib.redirect_stdout(io.StringIO()):
+            for seed, screen in enumerate(screens):
+                write_sweep_data(sweep_dir,
+                                 synthetic_sweep(n_genes, seed=seed),
+                                 {**params, 'screen_name': screen})
+        print(f'{n_screens} synthetic screens of {n_genes} genes')
+
+        for run in ['cold', 'warm']:
+            cache = ResultCache(cache_dir, sweep_dir)
+            start_time = time.perf_counter()
+            results = run_screens(cache)
+            print(f'{run} run: {time.perf_counter() - start_time:.2f} secs '
+                  f'- {cache.stats()}')
+            check_results(sweep_dir, results)
+        assert cache.stats()['misses'] == 0
+
+        # Only the rewritten screen is computed again: its stored flags are
+        # replaced, its new flags are optimized into a new file
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_sweep_data(sweep_dir, synthetic_sweep(n_genes, seed=99),
+                             {**params, 'screen_name': screens[0]})
+        cache = ResultCache(cache_dir, sweep_dir)
+        start_time = time.perf_counter()
+        results = run_screens(cache)
+        print(f'one screen rewritten: '
+              f'{time.perf_counter() - start_time:.2f} secs - '
+              f'{cache.stats()}')
+        assert cache.stats()['misses'] == 2 and cache.stats()['stale'] == 1
+        check_results(sweep_dir, results)
+        print('Outputs match.')
+
+        # Errors other than NoOptimizedGenes are raised and not cached
+        screen_params = {**params, 'screen_name': screens[1]}
+        flagged = results[screens[1]][0].astype({'p_at_tx': float})
+        with mock.patch('sweeptools.resultcache.optimize_flagged_genes',
+                        side_effect=ValueError('bad parameters')):
+            try:
+                cache.optimize_flagged_genes(screen_params, flagged,
+                                             delta_mi_thr=0.25)
+                raise AssertionError('ValueError was not raised')
+            except NoOptimizedGenes:
+                raise AssertionError('Error was taken for no genes left')
+            except ValueError:
+                pass
+        misses = cache.stats()['misses']
+        cache.optimize_flagged_genes(screen_params, flagged,
+                                     delta_mi_thr=0.25)
+        assert cache.stats()['misses'] == misses + 1
+
+        # No genes left is cached and raised again
+        for _ in range(2):
+            try:
+                cache.optimize_flagged_genes(screen_params, flagged,
+                                             delta_mi_thr=100)
+                raise AssertionError('NoOptimizedGenes was not raised')
+            except NoOptimizedGenes:
+                pass
+        assert cache.stats()['misses'] == misses + 2
+        print('Only NoOptimizedGenes is cached.')
+
+        # A sweep rewritten during a session is read again
+        with contextlib.redirect_stdout(io.StringIO()):
+            cache.grouped_sweep({**params, 'screen_name': screens[0]})
+            write_sweep_data(sweep_dir, synthetic_sweep(n_genes, seed=100),
+                             {**params, 'screen_name': screens[0]})
+        results = run_screens(cache)
+        check_results(sweep_dir, results)
+        print('Sweep rewritten in the same session is read again.')
@@ -0,0 +1,111 @@
+'''Checks 'run_sweep_cells' with a stub analyzer: sweep points that succeed,
+that exit with an error and that can't be run because the analyzer is
+missing. Failed points are retried after a delay and recorded in the
+manifest without stopping the other points. Also compares the wall time of
+the concurrent run with running the points one at a time. Run from the
+repository root with:
+
+    python -m benchmarks.bench_run_sweep
+'''
+# %%
+import contextlib
+import io
+import os
+import stat
+import sys
+import tempfile
+import time
+
+from sweeptools.analyzesweep import get_sweep_data, sweep_path
+from sweeptools.runsweep import sweep_grid, run_sweep_cells
+
+params = {'screen_name': 'stub',
+          'assembly': 'hg38',
+          'trim_length': '50',
+          'mode': 'collapse',
+          'overlap': 'both',
+          'direction': 'sense',
+          'step': 1000}
+cells = sweep_grid(params['step'], limit_into_gene=2000, limit_out_gene=2000)
+failing_cell = (-1000, 1000)
+retry_delay = 0.5
+
+# Writes three genes for every sweep point after DELAY secs, except for the
+# failing point, where it exits with code 1
+stub_analyzer = '''#!PYTHON
+import sys
+import time
+args = dict(zip(sys.argv[3::2], sys.argv[4::2]))
+time.sleep(DELAY)
+if (args['--start'], args['--end']) == ('FAIL_START', 'FAIL_END'):
+    sys.exit(1)
+with open(args['--output'], 'w') as f:
+    f.write('gene\\tlow\\thigh\\tp\\tfdr\\tmi\\n')
+    for gene in ['A1BG', 'A2M', 'AAAS']:
+        f.write(gene + '\\t1\\t2\\t0.5\\t0.9\\t0.41\\n')
+'''
+
+
+def write_stub(filename: str, delay: float) -> str:
+    with open(filename, 'w') as f:
+        f.write(stub_analyzer
+                .replace('PYTHON', sys.executable)
+                .replace('DELAY', str(delay))
+                .replace('FAIL_START', f'tx{failing_cell[0]:+}')
+                .replace('FAIL_END', f'tx{failing_cell[1]:+}'))
+    os.chmod(filename, os.stat(filename).st_mode | stat.S_IEXEC)
+    return filename
+
+
+def run(out_dir: str, analyzer: str, workers: int):
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        manifest = run_sweep_cells(cells, out_dir, params, analyzer=analyzer,
+                                   workers=workers, retries=1,
+                                   retry_delay=retry_delay)
+    return manifest.set_index(['srt_off', 'end_off']), \
+        time.perf_counter() - start_time
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+
+        analyzer = write_stub(f'{data_dir}/screen-analyzer', delay=0.2)
+
+        # Succeeding and failing points
+        manifest, concurrent_time = run(f'{data_dir}/ok', analyzer, 4)
+        done = manifest.drop(failing_cell)
+        assert (done.status == 'done').all() and (done.exit_code == 0).all()
+        failed = manifest.loc[failing_cell]
+        assert failed.status == 'failed' and failed.exit_code == 1
+        assert failed.attempts == 2 and failed.error == 'exit code 1'
+        # Two runs of the analyzer and the wait before the retry
+        assert failed.secs >= 2*0.2 + retry_delay
+        sweep = get_sweep_data(f'{data_dir}/ok', params)
+        assert len(sweep) == 3*(len(cells) - 1)
+        print(f'{len(done)} points done, 1 failed after 2 attempts')
+
+        # Rerun only retries the failed point
+        manifest, _ = run(f'{data_dir}/ok', analyzer, 4)
+        assert manifest.loc[failing_cell].attempts == 2
+        assert (manifest.status == 'done').sum() == len(cells) - 1
+
+        # Missing analyzer: every point fails but the run completes
+        manifest, _ = run(f'{data_dir}/missing',
+                          f'{data_dir}/missing-screen-analyzer', 4)
+        assert (manifest.status == 'failed').all()
+        assert manifest.exit_code.isna().all()
+        assert (manifest.attempts == 2).all()
+        assert manifest.error.str.contains('No such file').all()
+        assert (manifest.secs >= retry_delay).all()
+        assert not any(x.startswith('out') for x in
+                       os.listdir(sweep_path(f'{data_dir}/missing', params)))
+        print(f'Missing analyzer: {len(manifest)} points failed after 2 '
+              f'attempts ({manifest.error.iloc[0]})')
+
+        _, serial_time = run(f'{data_dir}/serial', analyzer, 1)
+
+    print(f'{len(cells)} points - 4 workers: {concurrent_time:.2f} secs - '
+          f'1 worker: {serial_time:.2f} secs')
@@ -0,0 +1,93 @@
+'''Checks the points picked by 'top_optimized_windows', with and without
+non-maximum suppression, against a per gene sort of all scored points, and
+compares its runtime with 'optimize_flagged_genes' on a synthetic analyzed
+screen. Run from the repository root with:
+
+    python -m benchmarks.bench_top_windows
+'''
+# %%
+import contextlib
+import io
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzesweep import (flag_by_slope, optimize_flagged_genes,
+                                     top_optimized_windows)
+from benchmarks.synthetic import synthetic_analyzed_sweep
+from benchmarks.bench_optimize_flagged import sort_optimized_mi_loop
+
+n_genes = 20000
+n_looped = 300
+p_thr = 1e-5
+slope_thr = 1
+step = 500
+
+
+def top_windows_loop(group: pd.DataFrame, k: int,
+                     min_distance: int) -> pd.DataFrame:
+    '''Best 'k' points of a gene from a full sort of its scored points,
+    skipping points near better ones one at a time.
+    '''
+
+    # Scored in double precision, float32 scores of close points may tie
+    group = group.astype({'log2_mi': np.float64})
+    opt = sort_optimized_mi_loop(group, p_thr, weight_mi=2, weight_p=1)
+    opt = opt.iloc[np.argsort(-opt.score.to_numpy(), kind='stable')]
+    kept = []
+    for row in opt.itertuples():
+        if len(kept) == k:
+            break
+        if not any(abs(row.srt_off - x.srt_off) <= min_distance
+                   and abs(row.end_off - x.end_off) <= min_distance
+                   for x in kept):
+            kept.append(row)
+
+    return pd.DataFrame(kept)[['srt_off', 'end_off']]
+
+
+# %%
+if __name__ == '__main__':
+
+    grouped_sweep = synthetic_analyzed_sweep(n_genes).groupby('gene_name')
+    with contextlib.redirect_stdout(io.StringIO()):
+        flagged = flag_by_slope(grouped_sweep, p_thr, slope_thr)
+    print(f'Synthetic sweep: {n_genes} genes - {len(flagged)} flagged')
+
+    # A single window per gene is the same as 'optimize_flagged_genes'
+    best = optimize_flagged_genes(flagged, grouped_sweep, delta_mi_thr=0.5)
+    top = top_optimized_windows(flagged, grouped_sweep, k=1,
+                                delta_mi_thr=0.5)
+    pd.testing.assert_frame_equal(top.drop(columns=['rank', 'score']), best)
+    print('k=1 matches optimize_flagged_genes.')
+
+    start_time = time.perf_counter()
+    optimize_flagged_genes(flagged, grouped_sweep)
+    print(f'optimize_flagged_genes: {time.perf_counter() - start_time:.2f} '
+          f'secs')
+
+    sample = flagged.gene.sample(n_looped, random_state=0)
+    for k, min_distance in [(3, None), (5, None), (3, step), (5, 2*step)]:
+        start_time = time.perf_counter()
+        top = top_optimized_windows(flagged, grouped_sweep, k=k,
+                                    min_distance=min_distance)
+        secs = time.perf_counter() - start_time
+        print(f'k={k} min_distance={min_distance}: {len(top)} windows of '
+              f'{top.gene_name.nunique()} genes in {secs:.2f} secs')
+
+        assert (top.groupby('gene_name')['rank'].max() <= k).all()
+        assert (top.groupby('gene_name')['score']
+                .apply(lambda x: x.is_monotonic_decreasing).all())
+
+        # Same points as the per gene sort, without the filter on tx
+        top = top_optimized_windows(flagged, grouped_sweep, k=k,
+                                    min_distance=min_distance,
+                                    delta_mi_thr=-np.inf)
+        top = top.set_index('gene_name')
+        for gene in sample:
+            looped = top_windows_loop(grouped_sweep.get_group(gene), k,
+                                      min_distance or 0)
+            looped = looped[(looped.srt_off != 0) | (looped.end_off != 0)]
+            found = top.loc[[gene], ['srt_off', 'end_off']]
+            assert np.array_equal(found.to_numpy(), looped.to_numpy()), gene
+        print(f'Windows match for {n_looped} genes.')
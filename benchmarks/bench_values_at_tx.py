@@ -0,0 +1,89 @@
+'''Checks that 'get_values_at_tx' returns the same values at tx start and
+end as the per gene lookups it replaced, for a grouped, lazy and dense
+(cube) sweep, and compares their runtime on a synthetic analyzed screen.
+Run from the repository root with:
+
+    python -m benchmarks.bench_values_at_tx
+'''
+# %%
+import contextlib
+import io
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzesweep import (write_sweep_data, write_sweep_cube,
+                                     read_analyzed_sweep, read_sweep_cube,
+                                     get_values_at_tx)
+from benchmarks.synthetic import synthetic_sweep
+
+n_genes = 20000
+columns = ['high_counts', 'low_counts', 'log2_mi', 'p']
+params = {'screen_name': 'SYNTHETIC',
+          'assembly': 'hg38',
+          'trim_length': '50',
+          'mode': 'collapse',
+          'start': 'tx',
+          'end': 'tx',
+          'overlap': 'both',
+          'direction': 'sense',
+          'step': 500}
+
+
+def background_genes_loop(grouped_sweep):
+    '''Per gene implementation previously used as 'background_genes' in
+    'optimized_mi_flagged_screen.py'.
+    '''
+    all_list = []
+    for gene, group in grouped_sweep:
+        all_at_tx = pd.Series(dtype=object, name=gene)
+        try:
+            all_at_tx['high_counts'] = group.loc[0, 0]['high_counts']
+            all_at_tx['low_counts'] = group.loc[0, 0]['low_counts']
+            all_at_tx['log2_mi'] = group.loc[0, 0]['log2_mi']
+            all_at_tx['p'] = group.loc[0, 0]['p']
+        except KeyError:
+            pass
+        all_list.append(all_at_tx)
+    background = pd.concat(all_list, axis=1).T
+
+    return background
+
+
+# %%
+if __name__ == '__main__':
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Some genes miss the point at tx
+        with contextlib.redirect_stdout(io.StringIO()):
+            all_info = write_sweep_data(data_dir,
+                                        synthetic_sweep(n_genes,
+                                                        missing=0.01),
+                                        params)
+            write_sweep_cube(data_dir, all_info, params)
+        print(f'Synthetic sweep: {n_genes} genes')
+
+        grouped_sweep = read_analyzed_sweep(data_dir, params)
+
+        start_time = time.perf_counter()
+        looped = background_genes_loop(grouped_sweep)
+        loop_time = time.perf_counter() - start_time
+        looped = looped.dropna().astype(float)
+
+        for name, sweep in [
+                ('grouped', lambda: grouped_sweep),
+                ('lazy', lambda: read_analyzed_sweep(data_dir, params,
+                                                     lazy=True)),
+                ('cube', lambda: read_sweep_cube(data_dir, params))]:
+            sweep = sweep()
+            start_time = time.perf_counter()
+            at_tx = get_values_at_tx(sweep, columns)
+            secs = time.perf_counter() - start_time
+            print(f'{name}: {secs:.3f} secs - per gene loop: '
+                  f'{loop_time:.1f} secs - speedup: {loop_time/secs:.0f}x')
+
+            np.testing.assert_array_equal(at_tx.index, looped.index)
+            np.testing.assert_allclose(at_tx.astype(float), looped,
+                                       rtol=1e-6)
+        print(f'Outputs match ({len(looped)} genes at tx).')
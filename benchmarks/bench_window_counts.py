@@ -0,0 +1,90 @@
+'''Checks that 'window_counts' gives the same insertion counts per channel
+and strand as filtering the insertions of a region and grouping them, as
+'get_ratios' in app-insertions-by-region.py did on every drag of the range
+tool, and compares their runtime per window on synthetic insertion files:
+with the index loaded once per screen, as on every drag after the first,
+and loaded again for every window. Run from the repository root with:
+
+    python -m benchmarks.bench_window_counts
+'''
+# %%
+import contextlib
+import io
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from sweeptools.analyzeinsertions import (read_insertions_region,
+                                          window_counts,
+                                          _insertion_index_cache)
+from benchmarks.bench_insertion_decoder import write_insertion_file
+
+n_insertions = 2000000
+n_windows = 200
+screen_name, assembly, trim_length = 'SYNTHETIC', 'hg38', 50
+chrom = '1'
+
+
+def count_insertions(insertions: pd.DataFrame, start: int,
+                     end: int) -> pd.Series:
+    '''Counting previously done by 'get_ratios'.'''
+    ins_sel = insertions[insertions.pos.between(start, end)]
+    return ins_sel.groupby(['chan', 'strand']).size()
+
+
+# %%
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        data_path = f'{data_dir}/{screen_name}/{assembly}/{trim_length}/'
+        os.makedirs(data_path)
+        write_insertion_file(f'{data_path}high', n_insertions, seed=1)
+        write_insertion_file(f'{data_path}low', n_insertions, seed=2)
+        print(f'Synthetic insertion files: {n_insertions} insertions each')
+
+        # Whole chromosome view, as after zooming out in the app
+        with contextlib.redirect_stdout(io.StringIO()):
+            insertions = read_insertions_region(data_dir, screen_name,
+                                                assembly, trim_length, chrom,
+                                                0, 250000000)
+        _insertion_index_cache.clear()
+        start_time = time.perf_counter()
+        window_counts(data_dir, screen_name, assembly, trim_length, chrom,
+                      0, 1)
+        first_time = time.perf_counter() - start_time
+
+        windows = np.sort(rng.integers(0, 250000000, (n_windows, 2)), axis=1)
+
+        track_time, load_time, group_time = 0, 0, 0
+        for start, end in windows:
+            start_time = time.perf_counter()
+            track = window_counts(data_dir, screen_name, assembly,
+                                  trim_length, chrom, start, end)
+            track_time += time.perf_counter() - start_time
+
+            _insertion_index_cache.clear()
+            start_time = time.perf_counter()
+            window_counts(data_dir, screen_name, assembly, trim_length,
+                          chrom, start, end)
+            load_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            grouped = count_insertions(insertions, start, end)
+            group_time += time.perf_counter() - start_time
+
+            pd.testing.assert_series_equal(track[track > 0], grouped,
+                                           check_names=False,
+                                           check_index_type=False)
+
+        print(f'First call (loads index): {first_time*1000:.2f} ms')
+        print(f'Per window ({len(insertions)} insertions in chr{chrom}) - '
+              f'count track: {track_time/n_windows*1000:.3f} ms - '
+              f'count track loading index: '
+              f'{load_time/n_windows*1000:.2f} ms - '
+              f'filter and groupby: {group_time/n_windows*1000:.1f} ms - '
+              f'speedup: {group_time/track_time:.0f}x')
+        print(f'Counts match ({n_windows} windows).')
@@ -0,0 +1,105 @@
+'''Compares 'get_sweep_slopes' (used by 'write_sweep_data') with the per
+gene pivot loop it replaced, on a synthetic screen. Run from the repository
+root with:
+
+    python -m benchmarks.bench_write_sweep
+'''
+# %%
+import time
+import pandas as pd
+
+from sweeptools.analyzesweep import get_sweep_slopes
+from benchmarks.synthetic import synthetic_sweep
+
+# Synthetic screen: 20k genes on a 25x25 grid (step 500)
+n_genes = 20000
+step = 500
+
+
+def sweep_slopes_loop(sweep_data: pd.DataFrame, step: int) -> pd.DataFrame:
+    '''Per gene implementation previously used in 'write_sweep_data'.'''
+
+    gene_info = dict()
+    grouped = sweep_data.groupby('gene_name')
+    for name, group in grouped:
+
+        gene_data = group.pivot(index='srt_off', columns='end_off',
+                                values=['gene_name', 'low_counts',
+                                        'high_counts', 'p', 'p_fdr',
+                                        'log2_mi'])
+
+        # Get slopes of log2 MI when changing parameters in both directions
+        # (delta log2 MI per 1,000 bp)
+        slope_sdir = (gene_data['log2_mi']
+                      - gene_data['log2_mi'].shift(1))/(step*0.001)
+        slope_edir = (gene_data['log2_mi']
+                      - gene_data['log2_mi'].shift(1, axis=1))/(step*0.001)
+
+        # Get minimum p-value between consecutive parameters in both start
+        # and end directions
+        shift_sdir = gene_data['p_fdr'].shift(1)
+        shift_sdir.columns = pd.MultiIndex.from_arrays(
+            [tuple('p_shift_sdir' for x in shift_sdir.columns),
+             tuple(x for x in shift_sdir.columns)])
+        gene_data = pd.concat([gene_data, shift_sdir], ignore_index=False,
+                              axis=1)
+
+        shift_edir = gene_data['p_fdr'].shift(1, axis=1)
+        shift_edir.columns = pd.MultiIndex.from_arrays(
+            [tuple('p_shift_edir' for x in shift_edir.columns),
+             tuple(x for x in shift_edir.columns)])
+        gene_data = pd.concat([gene_data, shift_edir], ignore_index=False,
+                              axis=1)
+
+        # Stack data and add columns
+        gene_data = gene_data.stack()
+
+        gene_data['p_min_sdir'] = gene_data[['p_fdr',
+                                             'p_shift_sdir']].min(axis=1)
+        gene_data['p_min_edir'] = gene_data[['p_fdr',
+                                             'p_shift_edir']].min(axis=1)
+        gene_data = gene_data.drop(columns=['p_shift_sdir', 'p_shift_edir'])
+
+        gene_data['sl_sdir'] = slope_sdir.stack()
+        gene_data['sl_edir'] = slope_edir.stack()
+
+        gene_data = gene_data[gene_data.gene_name.notnull()]
+
+        gene_info[name] = gene_data
+
+    all_info = pd.concat(gene_info.values(), ignore_index=False)
+
+    int_cols = ['low_counts', 'high_counts']
+    all_info[int_cols] = (all_info[int_cols]
+                          .apply(lambda x:
+                                 pd.to_numeric(x, downcast='integer')))
+    float_cols = ['p', 'p_fdr', 'log2_mi', 'sl_sdir', 'sl_edir']
+    all_info[float_cols] = (all_info[float_cols]
+                            .apply(lambda x:
+                                   pd.to_numeric(x, downcast='float')))
+
+    return all_info
+
+
+# %%
+if __name__ == '__main__':
+
+    sweep_data = synthetic_sweep(n_genes, step=step, missing=0.01)
+    print(f'Synthetic sweep: {n_genes} genes, {len(sweep_data)} rows')
+
+    start_time = time.perf_counter()
+    vectorized = get_sweep_slopes(sweep_data, step)
+    vec_time = time.perf_counter() - start_time
+    print(f'Vectorized: {vec_time:.2f} secs')
+
+    start_time = time.perf_counter()
+    looped = sweep_slopes_loop(sweep_data, step)
+    loop_time = time.perf_counter() - start_time
+    print(f'Per gene loop: {loop_time:.2f} secs')
+
+    # Index levels are object dtype in the pivoted frame; the parquet file
+    # stores them as integers in both cases
+    looped.index = looped.index.set_levels(
+        [lev.astype(int) for lev in looped.index.levels])
+    pd.testing.assert_frame_equal(vectorized, looped, check_index_type=False)
+    print(f'Outputs match. Speedup: {loop_time/vec_time:.0f}x')
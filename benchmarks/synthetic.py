@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+
+def synthetic_sweep(n_genes: int, step: Optional[int] = 500,
+                    limit_into_gene: Optional[int] = 10000,
+                    limit_out_gene: Optional[int] = 2000,
+                    missing: Optional[float] = 0.0,
+                    seed: Optional[int] = 0) -> pd.DataFrame:
+    '''Returns random sweep data with the same columns and dtypes as the
+    dataframe created by 'get_sweep_data'. A fraction 'missing' of grid
+    points is dropped at random to mimic genes absent from some output
+    files.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    srt_offs = np.arange(-limit_out_gene, limit_into_gene + 1, step)
+    end_offs = np.arange(-limit_into_gene, limit_out_gene + 1, step)
+    genes = np.array([f'GENE{i:05d}' for i in range(n_genes)])
+
+    gene_idx, srt_off, end_off = np.meshgrid(np.arange(n_genes), srt_offs,
+                                             end_offs, indexing='ij')
+    size = gene_idx.size
+
+    low = rng.integers(0, 300, size)
+    high = rng.integers(0, 300, size)
+    sweep_data = pd.DataFrame({'gene_name': genes[gene_idx.ravel()],
+                               'low_counts': low,
+                               'high_counts': high,
+                               'p': rng.random(size)**4,
+                               'p_fdr': rng.random(size)**3,
+                               'log2_mi': np.log2((high + 1)/(low + 1)),
+                               'srt_off': srt_off.ravel(),
+                               'end_off': end_off.ravel()})
+
+    if missing:
+        sweep_data = sweep_data[rng.random(size) >= missing]
+
+    int_cols = ['low_counts', 'high_counts', 'srt_off', 'end_off']
+    sweep_data[int_cols] = (sweep_data[int_cols]
+                            .apply(lambda x:
+                                   pd.to_numeric(x, downcast='integer')))
+    float_cols = ['p', 'p_fdr', 'log2_mi']
+    sweep_data[float_cols] = (sweep_data[float_cols]
+                              .apply(lambda x:
+                                     pd.to_numeric(x, downcast='float')))
+
+    return sweep_data.reset_index(drop=True)
+
+
+def synthetic_analyzed_sweep(n_genes: int, step: Optional[int] = 500,
+                             **kwargs) -> pd.DataFrame:
+    '''Returns random analyzed sweep data, as written by 'write_sweep_data'
+    and read by 'read_analyzed_sweep' (before grouping).
+    '''
+
+    from sweeptools.analyzesweep import get_sweep_slopes
+
+    sweep_data = synthetic_sweep(n_genes, step=step, **kwargs)
+    analyzed = get_sweep_slopes(sweep_data, step)
+
+    return analyzed
+
+
+def write_synthetic_analyzer_files(data_dir: str, params: dict,
+                                   n_genes: int, **kwargs) -> None:
+    '''Writes random output files of 'screen-analyzer analyze' for a double
+    sweep (one 'out_start=..._end=..._.txt' file per grid point), in the
+    directory layout read by 'get_sweep_data'.
+    '''
+
+    from sweeptools.analyzesweep import sweep_path
+
+    data_path = sweep_path(data_dir, params)
+    os.makedirs(data_path, exist_ok=True)
+
+    sweep_data = synthetic_sweep(n_genes, step=params['step'], **kwargs)
+    cols = ['gene_name', 'low_counts', 'high_counts', 'p', 'p_fdr', 'log2_mi']
+    for (srt_off, end_off), df in sweep_data.groupby(['srt_off', 'end_off']):
+        filename = f'out_start=tx{srt_off:+}_end=tx{end_off:+}_.txt'
+        df[cols].to_csv(f'{data_path}{filename}', sep='\t', index=False,
+                        header=['gene', 'low', 'high', 'p', 'fdr', 'log2mi'])
@@ -0,0 +1,32 @@
+# %%
+from sweeptools.sweepdataset import (consolidate_screens,
+                                     read_gene_across_screens, read_at_tx)
+
+# Define parameters of screens to consolidate
+params = {'screen_name': '',
+          'assembly': 'hg38',
+          'trim_length': '50',
+          'mode': 'collapse',
+          'start': 'tx',
+          'end': 'tx',
+          'overlap': 'both',
+          'direction': 'sense',
+          'step': 500}
+
+sweep_data_dir = '../data/sweeps/sweeps-analyzed_2020-09-21'
+dataset_dir = '../data/sweeps/sweep-dataset'
+
+# %%
+
+# Screens already present in dataset_dir are skipped
+summary = consolidate_screens(sweep_data_dir, dataset_dir, params)
+print(summary)
+
+# %% One gene across every screen
+gene_sweeps = read_gene_across_screens(dataset_dir, 'CD274', params,
+                                       columns=['log2_mi', 'p'])
+
+# %% Values at tx start and end of every gene in every screen
+at_tx = read_at_tx(dataset_dir, params)
+
+# %%
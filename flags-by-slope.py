@@ -1,6 +1,5 @@
 # %%
 import os
-from sweeptools.analyzesweep import read_analyzed_sweep
 import sweeptools as tls
 from importlib import reload
 reload(tls)
@@ -22,13 +21,14 @@ p_thr = 1e-5
 
 sweep_data_dir = '../data/sweeps/sweeps-analyzed_2020-09-21'
 flag_data_dir = '../data/sweeps/sweep-flags_2020-10-02'
+result_cache_dir = '../data/sweeps/sweep-results'
 
-in_files = set(os.listdir(sweep_data_dir))
-out_files = set(os.listdir(flag_data_dir))
-missing_screens = list(in_files.difference(out_files))
-missing_screens.sort()
+# Flags already computed for the same analyzed sweep, thresholds and code
+# are read from the cache, the rest are computed and stored
+cache = tls.resultcache.ResultCache(result_cache_dir, sweep_data_dir)
 
-screen_list = missing_screens[77+77:77+77+77]
+screen_list = sorted(x for x in os.listdir(sweep_data_dir)
+                     if os.path.isdir(f'{sweep_data_dir}/{x}'))
 
 # %%
 # reload(tls)
@@ -38,16 +38,9 @@ for idx, screen in enumerate(screen_list):
     print(f'\nFinding flagged genes for screen {idx+1} of {len(screen_list)}'
           f'\n{params["screen_name"]} - '
           f'{params["assembly"]} - sl_thr={slope_thr} - p_thr={p_thr}')
-    grouped_sweep = read_analyzed_sweep(sweep_data_dir, params)
-    flagged = tls.analyzesweep.flag_by_slope(grouped_sweep, p_thr, slope_thr,
-                                             #  mi_seen_thr,p_seen_thr
-                                             )
+    flagged = cache.flag_by_slope(params, p_thr, slope_thr)
 
-    out_path = (f'''{flag_data_dir}/{params['screen_name']}/'''
-                f'''{params['assembly']}/{params['trim_length']}/'''
-                f'''mode={params['mode']}_direction={params['direction']}'''
-                f'''_overlap={params['overlap']}/double-sweep'''
-                f'''_step={params['step']}/''')
+    out_path = tls.analyzesweep.sweep_path(flag_data_dir, params)
 
     if not os.path.exists(out_path):
         os.makedirs(out_path)
@@ -57,8 +50,11 @@ for idx, screen in enumerate(screen_list):
 
     # Prevent overwriting
     if os.path.exists(filename):
-        raise SystemExit('File already exists, delete or rename to continue.')
+        print('File already exists, delete or rename to write it again.')
+        continue
 
     flagged.to_csv(filename, index=False)
 
+print(cache.stats())
+
 # %%
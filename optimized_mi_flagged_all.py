@@ -13,7 +13,7 @@ from bokeh.plotting import output_file, show
 from bokeh.layouts import gridplot, column, row
 import numpy as np
 
-from sweeptools.analyzesweep import read_analyzed_sweep, optimize_flagged_genes
+from sweeptools.analyzesweep import OptimizationFeatures
 
 import sweeptools as tls
 from importlib import reload
@@ -34,32 +34,40 @@ params = {'screen_name': '',
 slope_thr = 1
 p_thr = 1e-5
 
+# Optimization weights, only the re-scoring cell has to be rerun when they
+# change
+weights = {'weight_mi': 2, 'weight_p': 1, 'weight_ins': 0, 'weight_off': 0}
+
 sweep_data_dir = '../data/sweeps/sweeps-analyzed_2020-09-21'
-flag_data_dir = '../data/sweeps/sweep-flags_2020-10-02'
+result_cache_dir = '../data/sweeps/sweep-results'
+
+# Flags are read from the cache if computed before for the same analyzed
+# sweep (see 'flags-by-slope.py')
+cache = tls.resultcache.ResultCache(result_cache_dir, sweep_data_dir)
 
-screens = [x for x in os.listdir(flag_data_dir) if 'readme' not in x
-           and 'DS_Store' not in x]
+screens = sorted(x for x in os.listdir(sweep_data_dir)
+                 if os.path.isdir(f'{sweep_data_dir}/{x}'))
 
 # screens = screens[0:5]
-opt_list = []
+# Normalized values of all candidate points of each screen, computed once
+features = {}
 for idx, screen in enumerate(screens):
-    print(f'Optimizing {screen}: {idx + 1} of {len(screens)}')
+    print(f'Reading {screen}: {idx + 1} of {len(screens)}')
 
     params['screen_name'] = screen
 
-    # Get sweep and flag data
-    grouped_sweep = read_analyzed_sweep(sweep_data_dir, params)
-    flag_path = (f'''{flag_data_dir}/{params['screen_name']}/'''
-                 f'''{params['assembly']}/{params['trim_length']}/'''
-                 f'''mode={params['mode']}_direction={params['direction']}'''
-                 f'''_overlap={params['overlap']}/double-sweep'''
-                 f'''_step={params['step']}/''')
-    flagged = pd.read_csv(f'{flag_path}flags_sl-thr={slope_thr}_'
-                          f'p-thr={p_thr}.csv')
+    # Get sweep and flag data, p-values at tx are saved formatted
+    grouped_sweep = cache.grouped_sweep(params)
+    flagged = cache.flag_by_slope(params, p_thr, slope_thr)
+    flagged = flagged.astype({'p_at_tx': float})
 
+    features[screen] = OptimizationFeatures(flagged, grouped_sweep, p_thr)
+
+# %% Re-score all screens with the current weights
+opt_list = []
+for screen, screen_features in features.items():
     try:
-        optimized_mi = optimize_flagged_genes(flagged, grouped_sweep,
-                                              delta_mi_thr=0)
+        optimized_mi = screen_features.optimize(delta_mi_thr=0, **weights)
         optimized_mi['screen'] = screen
         opt_list.append(optimized_mi)
     except ValueError:
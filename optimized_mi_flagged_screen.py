@@ -1,10 +1,9 @@
 # %%
 import os
-import pandas as pd
 from bokeh.plotting import output_file, show
 from bokeh.layouts import gridplot
 
-from sweeptools.analyzesweep import read_analyzed_sweep, optimize_flagged_genes
+from sweeptools.analyzesweep import read_analyzed_sweep, get_values_at_tx
 
 import sweeptools as tls
 from importlib import reload
@@ -28,10 +27,14 @@ slope_thr = 1
 p_thr = 1e-5
 
 sweep_data_dir = '../data/sweeps/sweeps-analyzed_2020-09-21'
-flag_data_dir = '../data/sweeps/sweep-flags_2020-10-02'
+result_cache_dir = '../data/sweeps/sweep-results'
 
-screens = [x for x in os.listdir(flag_data_dir) if 'readme' not in x
-           and 'DS_Store' not in x]
+# Flags and optimized genes are read from the cache if computed before for
+# the same analyzed sweep (see 'flags-by-slope.py')
+cache = tls.resultcache.ResultCache(result_cache_dir, sweep_data_dir)
+
+screens = sorted(x for x in os.listdir(sweep_data_dir)
+                 if os.path.isdir(f'{sweep_data_dir}/{x}'))
 
 # %%
 for screen in screens:
@@ -40,37 +43,18 @@ for screen in screens:
     print(f'Getting optimized MI for screen {screen}.')
     plot_filename = f'plots/2020-10-13/{params["screen_name"]}.html'
 
-    # Get sweep and flag data
-    grouped_sweep = read_analyzed_sweep(sweep_data_dir, params)
-    flag_path = (f'''{flag_data_dir}/{params['screen_name']}/'''
-                 f'''{params['assembly']}/{params['trim_length']}/'''
-                 f'''mode={params['mode']}_direction={params['direction']}'''
-                 f'''_overlap={params['overlap']}/double-sweep'''
-                 f'''_step={params['step']}/''')
-    flagged = pd.read_csv(f'{flag_path}flags_sl-thr={slope_thr}_'
-                          f'p-thr={p_thr}.csv')
-
-    def background_genes(grouped_sweep):
-        # Get background points (all values at tx start and end)
-        all_list = []
-        for gene, group in grouped_sweep:
-            all_at_tx = pd.Series()
-            try:
-                all_at_tx['high_counts'] = group.loc[0, 0]['high_counts']
-                all_at_tx['low_counts'] = group.loc[0, 0]['low_counts']
-                all_at_tx['log2_mi'] = group.loc[0, 0]['log2_mi']
-                all_at_tx['p'] = group.loc[0, 0]['p']
-            except KeyError:
-                pass
-            all_list.append(all_at_tx)
-        background = pd.concat(all_list, axis=1).T
-
-        return background
-
-    background = background_genes(grouped_sweep)
+    # Get sweep and flag data, p-values at tx are saved formatted
+    grouped_sweep = read_analyzed_sweep(sweep_data_dir, params, lazy=True)
+    flagged = cache.flag_by_slope(params, p_thr, slope_thr)
+    flagged = flagged.astype({'p_at_tx': float})
+
+    # Background points (all values at tx start and end)
+    background = get_values_at_tx(grouped_sweep, ['high_counts', 'low_counts',
+                                                  'log2_mi', 'p'])
+    background = background.reset_index(drop=True)
     try:
-        optimized_mi = optimize_flagged_genes(flagged, grouped_sweep,
-                                              delta_mi_thr=0.5)
+        optimized_mi = cache.optimize_flagged_genes(params, flagged,
+                                                    delta_mi_thr=0.5)
     except ValueError:
         print(f'No flags for {params["screen_name"]}')
         continue
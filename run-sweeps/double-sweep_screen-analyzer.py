@@ -1,10 +1,12 @@
 # %%
-from itertools import product
-import os
-# import time
-import subprocess
 from configparser import ConfigParser
 
+from sweeptools.runsweep import run_double_sweep
+from sweeptools.analyzesweep import write_sweep_data
+from sweeptools.analyzeinsertions import read_refseq
+from sweeptools.nativesweep import native_sweep_data
+from sweeptools.fishertest import screen_fisher_cache
+
 # Define parameters for config file and analyze command
 screen_name = 'Ac-beta-actin_WT'
 assembly = 'hg38'
@@ -18,19 +20,19 @@ step = 500
 limit_into_gene = 10000
 limit_out_gene = 2000
 
-# %%
-# Set sweep range
-sweep_range_start = range(-limit_out_gene, limit_into_gene + 1, step)
-sweep_range_end = range(limit_out_gene, -limit_into_gene - 1, -step)
+# Number of screen-analyzer processes running at the same time
+workers = 4
 
-# Output directory
-out_path = (f'analyzed-double-sweep/{screen_name}/{assembly}/{trim_length}/'
-            f'mode={mode}_direction={direction}_overlap={overlap}/double-sweep'
-            f'_step={step}/')
+# Native sweep: count insertions of all sweep points at once in python
+# instead of running screen-analyzer for each point (see
+# sweeptools.nativesweep.native_sweep_data). Needs the insertion files of
+# 'screen-analyzer map' and the refseq annotation
+native = False
+insertions_dir = '../data/screen-analyzer-data'
+refseq_dir = '../data/refseq'
+native_out_dir = '../data/sweeps/sweeps-analyzed-native'
 
-if not os.path.exists(out_path):
-    os.makedirs(out_path)
-    print('Creating analyzed directory.')
+# %%
 
 
 def get_config_data(config_file: str) -> dict:
@@ -66,49 +68,33 @@ write_config_file(config_data, 'screen-analyzer.conf')
 
 # %% run screen-analyzer
 
-
-for idx, (s, e) in enumerate(product(sweep_range_start, sweep_range_end)):
-
-    # sweep parameter setup
-    start = f'tx{s:+}'
-    end = f'tx{e:+}'
-
-    print(f'Running analysis {idx + 1} of '
-          f'{len(sweep_range_start) * len(sweep_range_end)}')
-    print(f'start tx{s:+} - end tx{e:+}')
-
-    out_file = (f'start={start}_end={end}_')
-
-    # write_config_file(config_data, f'{out_path}conf_{out_file}.conf')
-
-    # Command for earlier version
-    # cmd = (f'./screen-analyzer_2020-06-25/screen-analyzer analyze '
-    #        f'{screen_name} {assembly} '
-    #        f'--output {out_path}out_{out_file}.txt '
-    #        f'--mode {mode} '
-    #        f'--start {start} '
-    #        f'--end {end} '
-    #        f'--overlap {overlap} '
-    #        f'--direction {direction} '
-    #        f'2> {out_path}counts_{out_file}.txt '
-    #        )
-
-    cmd = (f'./screen-analyzer_2020-09-21/screen-analyzer analyze '
-           f'{screen_name} --assembly {assembly} '
-           f'--output {out_path}out_{out_file}.txt '
-           f'--mode {mode} '
-           f'--start {start} '
-           f'--end {end} '
-           f'--overlap {overlap} '
-           f'--direction {direction} '
-           f'2> {out_path}counts_{out_file}.txt '
-           )
-
-    # start_time = time.time()
-
-    subprocess.call([cmd], shell=True)
-
-# print(f'Completed sweep for screen {screen_name}')
-
-# print('--- %s seconds ---\n' % (time.time() - start_time))
+# Sweep points run 'workers' at a time. Points with existing output are
+# skipped and failed points are retried, so the sweep can be resumed by
+# running this cell again. Progress is kept in sweep-manifest.csv
+params = {'screen_name': screen_name,
+          'assembly': assembly,
+          'trim_length': trim_length,
+          'mode': mode,
+          'overlap': overlap,
+          'direction': direction,
+          'step': step}
+
+analyzer = './screen-analyzer_2020-09-21/screen-analyzer'
+
+if native:
+    refseq = read_refseq(refseq_dir, assembly)
+    sweep = native_sweep_data(insertions_dir, refseq, params,
+                              limit_into_gene=limit_into_gene,
+                              limit_out_gene=limit_out_gene,
+                              cache=screen_fisher_cache(insertions_dir,
+                                                        params))
+    write_sweep_data(native_out_dir, sweep, params)
+else:
+    manifest = run_double_sweep('analyzed-double-sweep', params,
+                                limit_into_gene=limit_into_gene,
+                                limit_out_gene=limit_out_gene,
+                                analyzer=analyzer, workers=workers,
+                                retries=2)
+
+print(f'Completed sweep for screen {screen_name}')
 # %%
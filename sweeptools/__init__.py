@@ -1,10 +1,20 @@
 from . import analyzesweep
 from . import analyzeinsertions
+from . import runsweep
+from . import sweepdataset
+from . import fishertest
+from . import nativesweep
+from . import resultcache
 from .plotting import sweepplots
 from .plotting import optimized_mi
 
 from importlib import reload
 reload(analyzesweep)
 reload(analyzeinsertions)
+reload(runsweep)
+reload(sweepdataset)
+reload(fishertest)
+reload(nativesweep)
+reload(resultcache)
 reload(sweepplots)
 reload(optimized_mi)
@@ -1,10 +1,13 @@
 import os
+import json
+import weakref
+import numpy as np
 import pandas as pd
 from ctypes import Structure, c_int8, c_char, c_int32, sizeof
-from typing import Optional
+from typing import Optional, Tuple, Union
 from itertools import groupby
 from operator import itemgetter
-from .utils import timer
+from .utils import timer, atomic_write, file_checksum
 
 pd.options.mode.chained_assignment = None
 
@@ -15,35 +18,109 @@ class CInsertion(Structure):
                 ('p', c_int32)]
 
 
+# Same memory layout as 'CInsertion', including the padding before 'p'
+_insertion_dtype = np.dtype({'names': ['c', 's', 'p'],
+                             'formats': [np.int8, 'S1', np.int32],
+                             'offsets': [CInsertion.c.offset,
+                                         CInsertion.s.offset,
+                                         CInsertion.p.offset],
+                             'itemsize': sizeof(CInsertion)})
+
+# Chromosome names by code in insertion files (code 23 is not used)
+_chr_codes = [x for x in list(range(0, 26)) if not x == 23]
+_chr_names = [f'chr{i}' for i in range(0, 23)] + ['chrX'] + ['chrY']
+_strand_names = ['+', '-']
+
+# Chromosome-partitioned, position-sorted index of insertion dataframes by
+# id, with the data it was computed from, see '_chr_sorted_index'
+_chr_sorted_cache = dict()
+
+# Gene index of refseq dataframes by id, see '_refseq_index'
+_refseq_cache = dict()
+
+# Version of the compiled refseq files, in their names (see 'compile_refseq')
+_refseq_format = 3
+
+# Arrays of the insertion index of a screen, see 'write_insertion_index'
+_insertion_index_arrays = ['chan', 'strand', 'pos', 'track_pos',
+                           'track_offsets', 'chr_offsets']
+
+# Loaded insertion indexes by path, with the modification times of the
+# insertion files and index they were loaded from, see '_insertion_index'
+_insertion_index_cache = dict()
+
+# Channels and strands of the insertion counts of 'window_counts', in the
+# order of the count tracks of the insertion index
+_window_counts_index = pd.MultiIndex.from_product(
+    [['high', 'low'], _strand_names], names=['chan', 'strand'])
+
+# Largest number of insertion and position pairs for which
+# 'insertion_density' sums kernels directly instead of using FFT
+_density_direct_max = 1 << 22
+
+
+def read_insertion_file(filename: str) -> pd.DataFrame:
+    '''Decodes a binary 'high' or 'low' insertion file created by
+    'screen-analyzer map' with a numpy structured dtype matching
+    'CInsertion'. Returns dataframe with categorical 'chr' and 'strand'
+    and int32 'pos' columns, eg.:
+    chr	    strand	pos
+    chr1	+	    16202
+    '''
+
+    n_records = os.path.getsize(filename) // _insertion_dtype.itemsize
+    records = np.fromfile(filename, dtype=_insertion_dtype, count=n_records)
+
+    chr_lookup = np.full(256, -1, dtype=np.int8)
+    chr_lookup[_chr_codes] = np.arange(len(_chr_codes))
+    chr_idx = chr_lookup[records['c'].view(np.uint8)]
+    if (chr_idx < 0).any():
+        bad = np.unique(records['c'][chr_idx < 0])
+        raise ValueError(f'Unknown chromosome codes in {filename}: {bad}')
+
+    strand_lookup = np.full(256, -1, dtype=np.int8)
+    strand_lookup[[ord(x) for x in _strand_names]] = \
+        np.arange(len(_strand_names))
+    strand_idx = strand_lookup[records['s'].view(np.uint8)]
+    if (strand_idx < 0).any():
+        bad = np.unique(records['s'][strand_idx < 0])
+        raise ValueError(f'Unknown strands in {filename}: {bad}')
+
+    insertions = pd.DataFrame({
+        'chr': pd.Categorical.from_codes(chr_idx, categories=_chr_names),
+        'strand': pd.Categorical.from_codes(strand_idx,
+                                            categories=_strand_names),
+        'pos': records['p'].astype(np.int32)})
+
+    return insertions
+
+
 @timer
 def write_insertions(data_dir: str, outdata_dir: str, screen_name: str,
                      assembly: str, trim_length: int) -> pd.DataFrame:
     '''Reads high and low insertion files created by 'screen-analyzer map'
     in C, returns them as pandas dataframe and saves this as parquet.snappy.
+    Columns 'chan', 'chr' and 'strand' are categorical and 'pos' is int32
+    (see 'read_insertion_file'). Insertions are sorted by chromosome and
+    position.
     '''
 
     data_path = (f'''{data_dir}/{screen_name}/'''
                  f'''{assembly}/{trim_length}/''')
 
-    keys = [x for x in list(range(0, 26)) if not x == 23]
-    values = [f'chr{i}' for i in range(0, 23)] + ['chrX'] + ['chrY']
-    chr_dict = dict(zip(keys, values))
-
     channels = ['high', 'low']
 
-    insertions = []
-    for c in channels:
-        filename = f'{data_path}{c}'
+    insertions = [read_insertion_file(f'{data_path}{c}') for c in channels]
+    chan = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(channels), dtype=np.int8),
+                  [len(x) for x in insertions]), categories=channels)
+    insertions = pd.concat(insertions, ignore_index=True)
+    insertions.insert(0, 'chan', chan)
 
-        with open(filename, 'rb') as file:
-            c_ins = CInsertion()
-            while file.readinto(c_ins) == sizeof(c_ins):
-                ins = [c, chr_dict[c_ins.c],
-                       str(c_ins.s, 'utf-8'), c_ins.p]
-                insertions.append(ins)
-
-    insertions = pd.DataFrame(insertions, columns=['chan', 'chr',
-                                                   'strand', 'pos'])
+    # Sorted by chromosome and position for 'read_gene_insertions'
+    order, _, _ = _chr_sorted_index(insertions)
+    if order is not None:
+        insertions = insertions.iloc[order].reset_index(drop=True)
 
     outdata_path = (f'''{outdata_dir}/{screen_name}/'''
                     f'''{assembly}/{trim_length}/''')
@@ -62,7 +139,7 @@ def write_insertions(data_dir: str, outdata_dir: str, screen_name: str,
 def read_insertions(data_dir: str, screen_name: str, assembly: str,
                     trim_length: int) -> pd.DataFrame:
     '''Reads parquet file generated by 'write_insertions' and returns
-    pandas dataframe with insertions. Eg,
+    pandas dataframe with insertions sorted by chromosome and position. Eg,
     chan	chr	    strand	pos
     high	chr1	+	    0
     high	chr1	-	    0
@@ -73,20 +150,111 @@ def read_insertions(data_dir: str, screen_name: str, assembly: str,
                  f'''{assembly}/{trim_length}/''')
     insertions = pd.read_parquet(f'{data_path}insertions.parquet.snappy')
 
+    # Sort by chromosome and position (files from 'write_insertions' are
+    # already sorted) and index for 'read_gene_insertions'
+    order, _, _ = _chr_sorted_index(insertions)
+    if order is not None:
+        insertions = insertions.iloc[order].reset_index(drop=True)
+        _chr_sorted_index(insertions)
+
     return insertions
 
 
+def _chr_sorted_key(insertions: pd.DataFrame) -> Tuple[np.ndarray,
+                                                       np.ndarray]:
+    '''Chromosome codes and positions of 'insertions', as views of their
+    data. Sorting, filtering or reassigning the 'chr' or 'pos' columns
+    gives views of other data (see '_same_data').
+    '''
+
+    chr_values = insertions['chr'].array
+    chr_values = getattr(chr_values, 'codes', chr_values)
+
+    return np.asarray(chr_values), insertions['pos'].to_numpy()
+
+
+def _same_data(a: Tuple[np.ndarray, ...], b: Tuple[np.ndarray, ...]) -> bool:
+    return all(x.shape == y.shape and x.__array_interface__['data'][0]
+               == y.__array_interface__['data'][0] for x, y in zip(a, b))
+
+
+def _chr_sorted_index(insertions: pd.DataFrame) -> Tuple[
+        Optional[np.ndarray], np.ndarray, np.ndarray]:
+    '''Returns order that sorts 'insertions' by chromosome and position
+    (None if already sorted), sorted positions and offsets of each
+    chromosome in them (in the order of '_chr_names'). Computed once per
+    dataframe and cached while the dataframe exists and its 'chr' and 'pos'
+    columns are not replaced. The cache keeps the data of these columns, so
+    it is not freed and reused while cached.
+    '''
+
+    key = _chr_sorted_key(insertions)
+    cached = _chr_sorted_cache.get(id(insertions))
+    if (cached is not None and cached[0]() is insertions
+            and _same_data(cached[1], key)):
+        return cached[2]
+
+    chr_idx = pd.Categorical(insertions['chr'], categories=_chr_names).codes
+    pos = insertions['pos'].to_numpy()
+
+    is_sorted = np.all((chr_idx[1:] > chr_idx[:-1])
+                       | ((chr_idx[1:] == chr_idx[:-1])
+                          & (pos[1:] >= pos[:-1])))
+    if is_sorted:
+        order = None
+    else:
+        order = np.lexsort((pos, chr_idx))
+        chr_idx, pos = chr_idx[order], pos[order]
+    chr_offsets = np.searchsorted(chr_idx, np.arange(len(_chr_names) + 1))
+
+    index = (order, pos, chr_offsets)
+    if cached is None:
+        weakref.finalize(insertions, _chr_sorted_cache.pop, id(insertions),
+                         None)
+    _chr_sorted_cache[id(insertions)] = (weakref.ref(insertions), key, index)
+
+    return index
+
+
+def _refseq_checksum(filename: str) -> str:
+    '''Returns checksum of refseq file 'filename'. It is kept with the size
+    and modification time of the file in '{filename}.checksum', so the file
+    is only hashed again after it changed.
+    '''
+
+    stat = os.stat(filename)
+    stamp = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    stamp_file = f'{filename}.checksum'
+    if os.path.exists(stamp_file):
+        with open(stamp_file) as f:
+            saved = json.load(f)
+        if {x: saved.get(x) for x in stamp} == stamp:
+            return saved['checksum']
+
+    stamp['checksum'] = file_checksum(filename)
+    with atomic_write(stamp_file) as tmp:
+        with open(tmp, 'w') as f:
+            json.dump(stamp, f)
+
+    return stamp['checksum']
+
+
 @timer
-def read_refseq(data_dir: str, assembly: str,
-                name_chrom: Optional[bool] = False) -> pd.DataFrame:
-    '''Returns data from refseq file as dataframe. (Only known protein
-    coding, complete status, and chromosomes without underscore).
-    If 'name_chrom' is True, adds column 'name_chr' with name2_chrom.
-    eg. C1orf141_chr1.
+def compile_refseq(data_dir: str, assembly: str) -> str:
+    '''Parses refseq file 'ncbi-genes-{assembly}.txt' once and saves the
+    filtered annotation (see 'read_refseq') together with the exon regions
+    of all genes (see 'get_gene_exon_regions') as parquet files named after
+    the checksum of the refseq file, and the index of the rows of each gene
+    in both as .npz file. Returns path prefix of the compiled files, eg.
+    'data/refseq/ncbi-genes-hg38.3f2a9c01d4e5b6a7-3'
     '''
 
     filename = f'{data_dir}/ncbi-genes-{assembly}.txt'
-    refseq = pd.read_csv(filename, sep='\\t', engine='python')
+    compiled = (f'{data_dir}/ncbi-genes-{assembly}.'
+                f'{_refseq_checksum(filename)}-{_refseq_format}')
+
+    refseq = pd.read_csv(filename, sep='\t')
 
     # Get only known coding entries (starting with NM) and complete status
     # refseq = refseq.query('name.str.startswith("NM") & cdsStartStat == "cmpl"'
@@ -105,22 +273,253 @@ def read_refseq(data_dir: str, assembly: str,
     # Remove alternative chromosomes
     refseq = refseq[~refseq['chrom'].str.contains('_')]
 
-    if name_chrom:
-        refseq['name_chr'] = refseq.apply(lambda x:
-                                          f'{x.name2}_{x.chrom}', axis=1)
+    refseq['name_chr'] = refseq['name2'] + '_' + refseq['chrom']
+
+    # Exon regions are computed with the transcripts of each gene
+    # contiguous, in their original order. The annotation keeps file order
+    by_gene = refseq.sort_values(by='name2', kind='mergesort')
+    gene_idx = pd.factorize(by_gene['name2'], sort=True)[0]
+    exon_regions = _exon_region_table(by_gene, gene_idx)
+
+    # Gene index of the annotation and of the exon regions, read with the
+    # annotation by 'read_refseq'
+    order, genes, offsets = _gene_offsets(refseq['name2'].to_numpy())
+    _, exon_genes, exon_offsets = _gene_offsets(
+        exon_regions['name2'].to_numpy())
+    gene_index = {'order': np.arange(len(refseq)) if order is None
+                  else order,
+                  'genes': genes.astype(str), 'offsets': offsets,
+                  'exon_genes': exon_genes.astype(str),
+                  'exon_offsets': exon_offsets}
+
+    with atomic_write(f'{compiled}.exons.parquet') as tmp:
+        exon_regions.to_parquet(tmp, engine='pyarrow', compression='snappy',
+                                index=False)
+    with atomic_write(f'{compiled}.genes.npz') as tmp:
+        with open(tmp, 'wb') as f:
+            np.savez(f, **gene_index)
+    # Annotation last, marks the compiled files as complete
+    with atomic_write(f'{compiled}.parquet') as tmp:
+        refseq.to_parquet(tmp, engine='pyarrow', compression='snappy')
+
+    return compiled
+
+
+@timer
+def read_refseq(data_dir: str, assembly: str,
+                name_chrom: Optional[bool] = False) -> pd.DataFrame:
+    '''Returns data from refseq file as dataframe. (Only known protein
+    coding, complete status, and chromosomes without underscore).
+    If 'name_chrom' is True, adds column 'name_chr' with name2_chrom.
+    eg. C1orf141_chr1.
+
+    The refseq file is parsed once by 'compile_refseq', later calls read
+    the compiled annotation until the refseq file changes. Transcripts are
+    in file order, 'get_gene_positions' and 'get_gene_exon_regions' look
+    genes up by binary search in the index sorted by gene compiled with
+    it.
+    '''
+
+    filename = f'{data_dir}/ncbi-genes-{assembly}.txt'
+    compiled = (f'{data_dir}/ncbi-genes-{assembly}.'
+                f'{_refseq_checksum(filename)}-{_refseq_format}')
+
+    if not all(os.path.exists(f'{compiled}{x}') for x in
+               ['.parquet', '.exons.parquet', '.genes.npz']):
+        print(f'Compiling refseq annotation for {assembly}.')
+        compiled = compile_refseq(data_dir, assembly)
+
+    refseq = pd.read_parquet(f'{compiled}.parquet', engine='pyarrow')
+    with np.load(f'{compiled}.genes.npz') as gene_index:
+        gene_index = dict(gene_index)
+
+    if not name_chrom:
+        refseq = refseq.drop(columns='name_chr')
+
+    _refseq_index(refseq, f'{compiled}.exons.parquet', gene_index)
 
     return refseq
 
 
+def _gene_offsets(names: np.ndarray) -> Tuple[Optional[np.ndarray],
+                                                np.ndarray, np.ndarray]:
+    '''Returns the order that sorts gene names 'names' (None if already
+    sorted), the sorted unique names and the offsets of each of them in
+    the sorted names.
+    '''
+
+    if len(names) > 1 and (names[1:] < names[:-1]).any():
+        order = np.argsort(names, kind='stable')
+        names = names[order]
+    else:
+        order = None
+    starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]]) \
+        if len(names) else np.array([], dtype=np.int64)
+
+    return order, names[starts], np.r_[starts, len(names)]
+
+
+def _refseq_index(refseq: pd.DataFrame,
+                  exons_file: Optional[str] = None,
+                  gene_index: Optional[dict] = None) -> dict:
+    '''Returns index of the transcripts of each gene in 'refseq': the order
+    that sorts it by gene (None if already sorted), sorted gene names and
+    their offsets, and the compiled exon regions file if any. Taken from
+    'gene_index' compiled by 'compile_refseq' if given, otherwise computed.
+    Kept once per dataframe while the dataframe exists.
+    '''
+
+    cached = _refseq_cache.get(id(refseq))
+    if cached is not None and cached[0]() is refseq:
+        return cached[1]
+
+    if gene_index is not None:
+        index = {'order': gene_index['order'], 'genes': gene_index['genes'],
+                 'offsets': gene_index['offsets'],
+                 'exon_genes': gene_index['exon_genes'],
+                 'exon_offsets': gene_index['exon_offsets']}
+    else:
+        order, genes, offsets = _gene_offsets(refseq['name2'].to_numpy())
+        index = {'order': order, 'genes': genes, 'offsets': offsets}
+    index.update({'exons_file': exons_file, 'exons': None})
+
+    _refseq_cache[id(refseq)] = (weakref.ref(refseq), index)
+    weakref.finalize(refseq, _refseq_cache.pop, id(refseq), None)
+
+    return index
+
+
 @timer
 def get_gene_positions(gene: str, refseq: pd.DataFrame) -> pd.DataFrame:
 
-    grouped_genes = refseq.groupby('name2')
-    gene_data = grouped_genes.get_group(gene)
+    index = _refseq_index(refseq)
+
+    g = np.searchsorted(index['genes'], gene)
+    if g == len(index['genes']) or index['genes'][g] != gene:
+        raise KeyError(gene)
+    lo, hi = index['offsets'][g:g + 2]
+    rows = slice(lo, hi) if index['order'] is None else index['order'][lo:hi]
+
+    gene_data = refseq.iloc[rows]
 
     return gene_data
 
 
+def get_gene_exon_regions(gene: str, refseq: pd.DataFrame) -> pd.DataFrame:
+    '''Returns the same dataframe as 'get_exon_regions' for the
+    transcripts of a gene, taken from the exon regions precomputed by
+    'compile_refseq' if 'refseq' was read by 'read_refseq'.
+    '''
+
+    index = _refseq_index(refseq)
+    if index['exons_file'] is None:
+        return get_exon_regions(get_gene_positions(gene, refseq))
+
+    if index['exons'] is None:
+        index['exons'] = pd.read_parquet(index['exons_file'],
+                                         engine='pyarrow')
+    exons = index['exons']
+    genes, offsets = index['exon_genes'], index['exon_offsets']
+
+    g = np.searchsorted(genes, gene)
+    if g == len(genes) or genes[g] != gene:
+        raise KeyError(gene)
+    exons = exons.iloc[offsets[g]:offsets[g + 1]]
+
+    return _exon_regions_from_table(exons)
+
+
+@timer
+def write_insertion_index(data_dir: str, screen_name: str, assembly: str,
+                          trim_length: int) -> str:
+    '''Sorts the high and low insertions of a screen created by
+    'screen-analyzer map' by chromosome and position and saves them as .npy
+    files in directory 'insertion-index' next to the insertion files,
+    together with the offsets of each chromosome (see
+    'read_insertions_region'). Returns path of the index.
+    '''
+
+    data_path = (f'''{data_dir}/{screen_name}/'''
+                 f'''{assembly}/{trim_length}/''')
+    index_path = f'{data_path}insertion-index/'
+    os.makedirs(index_path, exist_ok=True)
+
+    channels = ['high', 'low']
+
+    insertions = [read_insertion_file(f'{data_path}{c}') for c in channels]
+    chan = np.repeat(np.arange(len(channels), dtype=np.int8),
+                     [len(x) for x in insertions])
+    insertions = pd.concat(insertions, ignore_index=True)
+    chr_idx = insertions.chr.cat.codes.to_numpy()
+    pos = insertions.pos.to_numpy()
+
+    strand = insertions.strand.astype(str).to_numpy().astype('S1')
+
+    order = np.lexsort((pos, chr_idx))
+    chr_offsets = np.searchsorted(chr_idx[order],
+                                  np.arange(len(_chr_names) + 1))
+
+    # Count track: positions sorted within each chromosome, channel and
+    # strand (see 'window_counts')
+    track = (chr_idx.astype(np.int64) * len(channels) + chan) * 2 \
+        + (strand == b'-')
+    track_order = np.lexsort((pos, track))
+    track_offsets = np.searchsorted(track[track_order], np.arange(
+        len(_chr_names) * len(channels) * 2 + 1))
+
+    index = {'chan': chan[order],
+             'strand': strand[order],
+             'pos': pos[order],
+             'track_pos': pos[track_order],
+             'track_offsets': track_offsets.astype(np.int64),
+             # Offsets last, marks the index as complete
+             'chr_offsets': chr_offsets.astype(np.int64)}
+    for name, array in index.items():
+        with atomic_write(f'{index_path}{name}.npy') as tmp:
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+
+    return index_path
+
+
+def _insertion_index(data_dir: str, screen_name: str, assembly: str,
+                     trim_length: int) -> dict:
+    '''Returns memory-mapped arrays of the insertion index of a screen,
+    writing it first if missing or older than the insertion files. Arrays
+    are loaded once and kept until the index or the insertion files change.
+    '''
+
+    data_path = (f'''{data_dir}/{screen_name}/'''
+                 f'''{assembly}/{trim_length}/''')
+    index_path = f'{data_path}insertion-index/'
+
+    ins_time = max(os.stat(f'{data_path}{c}').st_mtime_ns
+                   for c in ['high', 'low'])
+    try:
+        index_time = os.stat(f'{index_path}chr_offsets.npy').st_mtime_ns
+    except FileNotFoundError:
+        index_time = None
+
+    cached = _insertion_index_cache.get(index_path)
+    if cached is not None and cached[0] == (ins_time, index_time):
+        return cached[1]
+
+    if (index_time is None or index_time < ins_time
+            or not all(os.path.exists(f'{index_path}{name}.npy')
+                       for name in _insertion_index_arrays)):
+        print('Writing insertion index.')
+        write_insertion_index(data_dir, screen_name, assembly, trim_length)
+        index_time = os.stat(f'{index_path}chr_offsets.npy').st_mtime_ns
+
+    # Plain views of the memory maps, slicing them is faster
+    index = {name: np.asarray(np.load(f'{index_path}{name}.npy',
+                                      mmap_mode='r'))
+             for name in _insertion_index_arrays}
+    _insertion_index_cache[index_path] = ((ins_time, index_time), index)
+
+    return index
+
+
 def read_insertions_region(data_dir: str, screen_name: str, assembly: str,
                            trim_length: int, chrom: str, start: int,
                            end: Optional[int] = None,
@@ -130,6 +529,9 @@ def read_insertions_region(data_dir: str, screen_name: str, assembly: str,
     chan	chr	    strand	    pos
     high	chr9	-	    	4983150
     high	chr9	+	    	4983164
+
+    Insertions are looked up in the index written by
+    'write_insertion_index', which is created on first use.
     '''
 
     end = end or start
@@ -137,34 +539,66 @@ def read_insertions_region(data_dir: str, screen_name: str, assembly: str,
     start = start - padd
     end = end + padd
 
-    data_path = (f'''{data_dir}/{screen_name}/'''
-                 f'''{assembly}/{trim_length}/''')
+    channels = np.array(['high', 'low'], dtype=object)
 
-    keys = [x for x in list(range(0, 26)) if not x == 23]
-    values = [f'chr{i}' for i in range(0, 23)] + ['chrX'] + ['chrY']
-    chr_dict = dict(zip(keys, values))
+    index = _insertion_index(data_dir, screen_name, assembly, trim_length)
 
-    channels = ['high', 'low']
+    chrom = f'chr{chrom}'
+    if chrom in _chr_names:
+        c = _chr_names.index(chrom)
+        chr_start, chr_end = index['chr_offsets'][c:c + 2]
+    else:
+        chr_start, chr_end = 0, 0
 
-    insertions = []
-    for c in channels:
-        filename = f'{data_path}{c}'
+    # Positions within start and end (both excluded)
+    chr_pos = index['pos'][chr_start:chr_end]
+    lo = chr_start + np.searchsorted(chr_pos, start, side='right')
+    hi = max(lo, chr_start + np.searchsorted(chr_pos, end, side='left'))
 
-        with open(filename, 'rb') as file:
-            c_ins = CInsertion()
-            while file.readinto(c_ins) == sizeof(c_ins):
-                if (chr_dict[c_ins.c] == f'chr{chrom}'
-                    and c_ins.p > start
-                        and c_ins.p < end):
+    # High insertions first, as in the insertion files
+    order = np.argsort(index['chan'][lo:hi], kind='stable')
+    insertions = pd.DataFrame({
+        'chan': channels[index['chan'][lo:hi][order]],
+        'chr': chrom,
+        'strand': index['strand'][lo:hi][order].astype(str).astype(object),
+        'pos': index['pos'][lo:hi][order]},
+        columns=['chan', 'chr', 'strand', 'pos'])
 
-                    ins = [c, chr_dict[c_ins.c],
-                           str(c_ins.s, 'utf-8'), c_ins.p]
-                    insertions.append(ins)
+    return insertions
 
-    insertions = pd.DataFrame(insertions, columns=['chan', 'chr',
-                                                   'strand', 'pos'])
 
-    return insertions
+def window_counts(data_dir: str, screen_name: str, assembly: str,
+                  trim_length: int, chrom: str, start: int,
+                  end: int) -> pd.Series:
+    '''Returns number of insertions of each channel and strand in the given
+    chromosome between start and end (both included), eg.:
+    chan    strand
+    high    +         12
+            -          3
+    low     +        140
+            -        151
+
+    Counts are found by binary search in the sorted positions of each
+    channel and strand of the insertion index (see 'write_insertion_index'),
+    so any window costs the same regardless of its size. The index is only
+    loaded on the first call for a screen (see '_insertion_index').
+    '''
+
+    index = _insertion_index(data_dir, screen_name, assembly, trim_length)
+
+    counts = np.zeros(len(_window_counts_index), dtype=np.int64)
+
+    chrom = f'chr{chrom}'
+    if chrom in _chr_names:
+        c = _chr_names.index(chrom) * len(counts)
+        track_offsets = index['track_offsets'][c:c + len(counts) + 1]
+        for k in range(len(counts)):
+            track_pos = index['track_pos'][track_offsets[k]:
+                                           track_offsets[k + 1]]
+            lo, hi = track_pos.searchsorted([start, end + 1])
+            counts[k] = hi - lo
+
+    return pd.Series(np.maximum(counts, 0), index=_window_counts_index)
 
 
 @timer
@@ -192,14 +626,77 @@ def read_gene_insertions(gene: str, insertions: pd.DataFrame,
     chrom = gene_pos['chrom'].iloc[0]
     gene_strand = gene_pos['strand'].iloc[0]
 
-    insertions = insertions.query(
-        'chr == @chrom & pos >= @min_pos & pos <= @max_pos')
-    insertions['dir'] = insertions['strand'].apply(
-        lambda x: 'sense' if x == gene_strand else 'antisense')
+    # Binary search of gene window within chromosome
+    order, pos, chr_offsets = _chr_sorted_index(insertions)
+    if chrom in _chr_names:
+        c = _chr_names.index(chrom)
+        chr_start, chr_end = chr_offsets[c:c + 2]
+    else:
+        chr_start, chr_end = 0, 0
+    chr_pos = pos[chr_start:chr_end]
+    lo = chr_start + np.searchsorted(chr_pos, min_pos, side='left')
+    hi = max(lo, chr_start + np.searchsorted(chr_pos, max_pos, side='right'))
+    rows = slice(lo, hi) if order is None else np.sort(order[lo:hi])
+
+    insertions = insertions.iloc[rows].copy()
+    insertions['dir'] = np.where(insertions['strand'] == gene_strand,
+                                 'sense', 'antisense')
 
     return insertions
 
 
+def insertion_density(pos: np.ndarray, x: np.ndarray,
+                      bandwidth: Optional[Union[str, float]] = None) -> \
+        np.ndarray:
+    '''Returns Gaussian kernel density estimate of insertion positions 'pos'
+    evaluated at positions 'x', the same as
+    scipy.stats.gaussian_kde(pos).evaluate(x) for the default bandwidth.
+    Positions are counted per base and convolved with the kernel by FFT, so
+    the cost depends on the span of 'pos' and 'x' rather than on the number
+    of insertions.
+
+    bandwidth: kernel standard deviation in bp, or 'scott' or 'silverman'
+               for the rules of gaussian_kde. Default: 'scott'
+    '''
+
+    pos = np.asarray(pos, dtype=np.int64)
+    x = np.asarray(x, dtype=np.int64)
+    n = len(pos)
+    if n == 0:
+        return np.zeros(len(x))
+
+    if bandwidth is None or isinstance(bandwidth, str):
+        factor = {None: n ** (-1 / 5), 'scott': n ** (-1 / 5),
+                  'silverman': (n * 3 / 4) ** (-1 / 5)}[bandwidth]
+        bandwidth = factor * pos.std(ddof=1) if n > 1 else 0
+    if not bandwidth > 0:
+        print('Warning! Insertion density bandwidth is zero. '
+              'Using a bandwidth of 1 bp')
+        bandwidth = 1
+
+    lo = min(pos.min(), x.min())
+    span = max(pos.max(), x.max()) - lo
+
+    if n * len(x) <= _density_direct_max:
+        # Few insertions: sum kernels directly
+        dens = np.zeros(len(x))
+        step = max(1, _density_direct_max // (8 * n))
+        for i in range(0, len(x), step):
+            dist = (x[i:i + step, None] - pos[None, :]) / bandwidth
+            dens[i:i + step] = np.exp(-0.5 * dist ** 2).sum(axis=1)
+    else:
+        counts = np.bincount(pos - lo, minlength=span + 1).astype(np.float64)
+        half = int(min(np.ceil(8 * bandwidth), span))
+        kernel = np.exp(-0.5 * (np.arange(-half, half + 1) / bandwidth) ** 2)
+
+        size = 1 << int(np.ceil(np.log2(len(counts) + len(kernel) - 1)))
+        dens = np.fft.irfft(np.fft.rfft(counts, size)
+                            * np.fft.rfft(kernel, size), size)
+        dens = dens[x - lo + half]
+
+    return np.maximum(dens, 0) / (n * bandwidth * np.sqrt(2 * np.pi))
+
+
 def contig_list_lims(lst):
     '''Divide a list into contiguous sublists and return the lower and
     upper limits of such sublists.
@@ -211,49 +708,104 @@ def contig_list_lims(lst):
     return lims
 
 
-def get_exon_regions(gene_pos: pd.DataFrame) -> pd.DataFrame:
-    '''Returns dataframe with start and end positions of all gene exons and
-    whether they are cds or utr. Eg.:
-    name2	name	        exon_id	tx_id	reg_type	reg_lims
-    JAK2	NM_001322195.1	2	    1	    exCds	    [5021987, 5022212]
-    JAK2	NM_001322195.1	3	    1	    exCds	    [5029782, 5029905]
-    JAK2	NM_004972.3	    126	    6	    exUtr	    [5021962, 5021986]
+def _exon_region_table(exon: pd.DataFrame,
+                       tx_gene: np.ndarray) -> pd.DataFrame:
+    '''Computes the cds and utr regions of the exons of transcripts in
+    'exon' (refseq format), where 'tx_gene' numbers the gene of each
+    transcript and transcripts of a gene are contiguous. Exons and
+    transcripts are numbered within each gene. Returns regions with
+    inclusive limits 'reg_start' and 'reg_end' and the 'label' used as
+    index by 'get_exon_regions', sorted by gene and label.
     '''
 
-    exon = gene_pos.copy(deep=True)
     exon = exon.reset_index(drop=True)
-    exon['tx_id'] = exon.index + 1
 
-    cols = ['exonStarts', 'exonEnds']
-    exon[cols] = exon[cols].applymap(lambda x: x.split(','))
+    # One entry per exon, numbered in transcript order
+    starts = exon['exonStarts'].str.split(',')
+    ends = exon['exonEnds'].str.split(',')
+    pairs = [[(x, y) for x, y in zip(s, e) if x != '' and y != '']
+             for s, e in zip(starts, ends)]
+    tx_idx = np.repeat(np.arange(len(exon)), [len(x) for x in pairs])
+    ex_lims = np.array([x for tx in pairs for x in tx],
+                       dtype=np.int64).reshape(-1, 2)
+    ex_start, ex_end = ex_lims[:, 0], ex_lims[:, 1]
+    n_exons = len(tx_idx)
+
+    # Exon and transcript numbers within gene
+    tx_gene = np.asarray(tx_gene)
+    ex_gene = tx_gene[tx_idx]
+    n_genes = tx_gene.max() + 1 if len(tx_gene) else 0
+    first_tx = np.searchsorted(tx_gene, np.arange(n_genes))
+    first_ex = np.searchsorted(ex_gene, np.arange(n_genes + 1))
+    ex_local = np.arange(n_exons) - first_ex[ex_gene]
+    gene_exons = np.diff(first_ex)[ex_gene]
+
+    cds_start = exon['cdsStart'].to_numpy(dtype=np.int64)[tx_idx]
+    cds_end = exon['cdsEnd'].to_numpy(dtype=np.int64)[tx_idx]
+    has_cds = cds_start < cds_end
+
+    # Half-open intervals [start, end) of each region type. Without cds,
+    # the whole exon is utr
+    cds = (np.maximum(ex_start, cds_start), np.minimum(ex_end, cds_end))
+    utr_5 = (ex_start, np.where(has_cds, np.minimum(ex_end, cds_start),
+                                ex_end))
+    utr_3 = (np.maximum(ex_start, cds_end), np.where(has_cds, ex_end,
+                                                     ex_start))
+
+    # Regions ordered as cds of all exons of a gene first, then utr by exon
+    # and position, labeled as in the exploded melt of the original
+    exon_all = np.tile(np.arange(n_exons), 3)
+    reg_start = np.concatenate([cds[0], utr_5[0], utr_3[0]])
+    reg_end = np.concatenate([cds[1], utr_5[1], utr_3[1]])
+    reg_part = np.repeat([0, 1, 2], n_exons)
+    reg_label = ex_local[exon_all] + np.where(reg_part > 0,
+                                              gene_exons[exon_all], 0)
+    keep = np.flatnonzero(reg_start < reg_end)
+    keep = keep[np.lexsort((reg_part[keep], reg_label[keep],
+                            ex_gene[exon_all[keep]]))]
+
+    reg_exon = exon_all[keep]
+    reg_tx = tx_idx[reg_exon]
+    exon_regions = pd.DataFrame(
+        {'name2': exon['name2'].to_numpy()[reg_tx],
+         'name': exon['name'].to_numpy()[reg_tx],
+         'exon_id': ex_local[reg_exon] + 1,
+         'tx_id': reg_tx - first_tx[ex_gene[reg_exon]] + 1,
+         'reg_type': np.where(reg_part[keep] == 0, 'exCds', 'exUtr')
+         .astype(object),
+         'reg_start': reg_start[keep],
+         'reg_end': reg_end[keep] - 1,
+         'label': reg_label[keep]})
+
+    return exon_regions
 
-    exon['cdsRange'] = exon.apply(lambda x: range(x.cdsStart, x.cdsEnd),
-                                  axis=1)
-    exon['exonRange'] = (exon
-                         .apply(lambda t:
-                                [range(int(x), int(y)) for i, x
-                                 in enumerate(t['exonStarts']) for j, y
-                                 in enumerate(t['exonEnds']) if i == j
-                                 and x != '' and y != ''], axis=1))
 
-    exon = exon.explode('exonRange')
-    exon = exon.reset_index(drop=True)
-    exon['exon_id'] = exon.index + 1
-    exon = exon.drop(columns=['#bin', 'exonStarts', 'exonEnds', 'score',
-                              'cdsStartStat', 'cdsEndStat', 'exonFrames',
-                              'cdsStart', 'cdsEnd'])
+def _exon_regions_from_table(exon_regions: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame(
+        {'name2': exon_regions['name2'].to_numpy(),
+         'name': exon_regions['name'].to_numpy(),
+         'exon_id': exon_regions['exon_id'].to_numpy(dtype=np.int64),
+         'tx_id': exon_regions['tx_id'].to_numpy(dtype=np.int64),
+         'reg_type': exon_regions['reg_type'].to_numpy(),
+         'reg_lims': list(map(list, zip(exon_regions['reg_start'].tolist(),
+                                        exon_regions['reg_end'].tolist())))},
+        index=exon_regions['label'].to_numpy(dtype=np.int64))
 
-    exon['exCds_lst'] = exon.apply(lambda t: [x for x in t.exonRange
-                                              if x in t.cdsRange], axis=1)
-    exon['exUtr_lst'] = exon.apply(lambda t: [x for x in t.exonRange
-                                              if x not in t.cdsRange], axis=1)
 
-    exon['exCds'] = exon.apply(lambda t: contig_list_lims(t.exCds_lst), axis=1)
-    exon['exUtr'] = exon.apply(lambda t: contig_list_lims(t.exUtr_lst), axis=1)
+def get_exon_regions(gene_pos: pd.DataFrame) -> pd.DataFrame:
+    '''Returns dataframe with start and end positions of all gene exons and
+    whether they are cds or utr. Eg.:
+    name2	name	        exon_id	tx_id	reg_type	reg_lims
+    JAK2	NM_001322195.1	2	    1	    exCds	    [5021987, 5022212]
+    JAK2	NM_001322195.1	3	    1	    exCds	    [5029782, 5029905]
+    JAK2	NM_004972.3	    126	    6	    exUtr	    [5021962, 5021986]
+
+    Limits are inclusive. Each exon is clipped against [cdsStart, cdsEnd)
+    with interval arithmetic, giving at most one cds region and two utr
+    regions (before and after the cds) per exon.
+    '''
 
-    exon_regions = exon.melt(id_vars=['name2', 'name', 'exon_id', 'tx_id'],
-                             value_vars=['exCds', 'exUtr'],
-                             var_name='reg_type', value_name='reg_lims')
-    exon_regions = exon_regions.explode('reg_lims').dropna()
+    exon_regions = _exon_region_table(gene_pos,
+                                      np.zeros(len(gene_pos), dtype=np.int64))
 
-    return exon_regions
+    return _exon_regions_from_table(exon_regions)
@@ -1,17 +1,112 @@
 import re
 import os
+import time
 import pandas as pd
 import numpy as np
-from math import log10
-from typing import Tuple, Optional
-
-from .utils import timer
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from typing import Tuple, Optional, List, Iterator
+
+from .utils import timer, atomic_write
 
 pd.options.mode.chained_assignment = None
 
+# Columns of the output files of 'screen-analyzer analyze'
+_analyzer_columns = ['gene_name', 'low_counts', 'high_counts', 'p', 'p_fdr',
+                     'log2_mi']
+_analyzer_types = {'gene_name': pa.string(), 'low_counts': pa.int64(),
+                   'high_counts': pa.int64(), 'p': pa.float64(),
+                   'p_fdr': pa.float64(), 'log2_mi': pa.float64()}
+
+# Whole genes per row group of analyzed sweep files (see 'write_sweep_data')
+_genes_per_row_group = 32
+
+# Columns of 'get_sweep_data' as read from all files, before downcasting.
+# Gene names are read as codes and rows keep the number of their file
+_sweep_data_types = {'gene_name': np.int32, 'low_counts': np.int64,
+                     'high_counts': np.int64, 'p': np.float64,
+                     'p_fdr': np.float64, 'log2_mi': np.float64,
+                     'file': np.int32}
+
+# Normalized values scored by 'sort_optimized_mi'
+_optimization_columns = ['norm_mi', 'norm_log10_p', 'norm_ins', 'norm_off']
+
+# Metrics of dense sweep cubes (see 'write_sweep_cube'), in the column order
+# of analyzed sweep files
+_cube_metrics = {'high_counts': np.int32, 'log2_mi': np.float32,
+                 'low_counts': np.int32, 'p': np.float32,
+                 'p_fdr': np.float32, 'p_min_sdir': np.float32,
+                 'p_min_edir': np.float32, 'sl_sdir': np.float32,
+                 'sl_edir': np.float32}
+
+
+def sweep_path(data_dir: str, params: dict) -> str:
+    '''Returns path of the directory holding the double sweep data of a
+    screen, eg. 'data/PDL1_IFNg/hg38/50/mode=collapse_direction=sense_
+    overlap=both/double-sweep_step=500/'
+    '''
+
+    data_path = (f'''{data_dir}/{params['screen_name']}/'''
+                 f'''{params['assembly']}/{params['trim_length']}/'''
+                 f'''mode={params['mode']}_direction={params['direction']}'''
+                 f'''_overlap={params['overlap']}/double-sweep'''
+                 f'''_step={params['step']}/''')
+
+    return data_path
+
+
+def _param_offset(param: str) -> int:
+    '''Returns offset of a screen-analyzer position parameter as int, eg.
+    'tx-2000' -> -2000 and 'tx+500' -> 500.
+    '''
+
+    return int(''.join(re.split('(-|\\+)', param)[1:3]))
+
+
+def _read_analyzer_output(filename: str) -> pa.Table:
+    '''Reads a single output file of 'screen-analyzer analyze' (with or
+    without header line) into a table with fixed column types.
+    '''
+
+    with open(filename, 'rb') as file:
+        has_header = file.readline().startswith(b'gene\t')
+
+    table = pa_csv.read_csv(
+        filename,
+        read_options=pa_csv.ReadOptions(column_names=_analyzer_columns,
+                                        skip_rows=int(has_header),
+                                        use_threads=False),
+        parse_options=pa_csv.ParseOptions(delimiter='\t'),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=_analyzer_types))
+
+    return table
+
+
+def _read_tables(filenames: List[str], workers: int) -> Iterator[pa.Table]:
+    '''Yields tables of output files of 'screen-analyzer analyze' in the
+    order of 'filenames', reading at most 'workers' files ahead.
+    '''
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for filename in filenames:
+            in_flight.append(executor.submit(_read_analyzer_output, filename))
+            if len(in_flight) > workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
 
 @timer
-def get_sweep_data(data_dir: str, params: dict) -> pd.DataFrame:
+def get_sweep_data(data_dir: str, params: dict,
+                   workers: Optional[int] = 4) -> pd.DataFrame:
     '''Get dataframe with all data resulting from a double parameter sweep of
     'screen-analyzer analyze'.
 
@@ -35,90 +130,290 @@ def get_sweep_data(data_dir: str, params: dict) -> pd.DataFrame:
                      'overlap': 'both',
                      'direction': 'sense',
                      'step': 500}
-    '''
 
-    data_path = (f'''{data_dir}/{params['screen_name']}/'''
-                 f'''{params['assembly']}/{params['trim_length']}/'''
-                 f'''mode={params['mode']}_direction={params['direction']}'''
-                 f'''_overlap={params['overlap']}/double-sweep'''
-                 f'''_step={params['step']}/''')
-
-    files = os.listdir(data_path)
-    df_list = []  # Initialize list to append data
-    repeated_genes = set()
-    for idx, filename in enumerate(files):
+    workers: int, number of files read ahead concurrently
+    '''
 
-        if filename.startswith('out'):
+    data_path = sweep_path(data_dir, params)
+
+    files = sorted(x for x in os.listdir(data_path) if x.startswith('out'))
+
+    # Transform parameters into numbers once per file, eg. 'tx-100' is
+    # changed to column 'srt_off' with value -100
+    srt_offs = np.array([_param_offset(re.search(r'_start=(.*?)_', x)
+                                       .group(1)) for x in files])
+    end_offs = np.array([_param_offset(re.search(r'_end=(.*?)_', x)
+                                       .group(1)) for x in files])
+
+    # Values of all files are copied into preallocated arrays as soon as each
+    # file is parsed, so only the files in flight are held as tables. Rows
+    # keep the number of their file, and gene names are kept as codes into
+    # 'genes', shared by all files
+    genes = pd.Index([], dtype=object)
+    dictionary = gene_map = None
+    columns = {}
+    n_rows = 0
+    for file_idx, table in enumerate(_read_tables(
+            [f'{data_path}{x}' for x in files], workers)):
+
+        if not columns:
+            capacity = table.num_rows*len(files)
+            columns = {x: np.empty(capacity, dtype=_sweep_data_types[x])
+                       for x in _sweep_data_types}
+        if n_rows + table.num_rows > capacity:
+            capacity = max(2*capacity, n_rows + table.num_rows)
+            columns = {x: np.resize(y, capacity) for x, y in columns.items()}
+
+        rows = slice(n_rows, n_rows + table.num_rows)
+        gene_codes = pc.dictionary_encode(
+            table.column('gene_name').combine_chunks())
+        if dictionary is None or not gene_codes.dictionary.equals(dictionary):
+            dictionary = gene_codes.dictionary
+            names = pd.Index(dictionary.to_pandas())
+            genes = genes.append(names[~names.isin(genes)])
+            gene_map = genes.get_indexer(names)
+        columns['gene_name'][rows] = gene_map[gene_codes.indices.to_numpy()]
+        for name in _analyzer_columns[1:]:
+            columns[name][rows] = table.column(name).to_numpy()
+        columns['file'][rows] = file_idx
+        n_rows += table.num_rows
+        del table
+
+    columns = {x: y[:n_rows] for x, y in columns.items()}
+
+    # Sort rows by gene, start and end offset through a single integer key.
+    # The sort is stable, so the first instance of a repeated gene comes
+    # first, as in file order
+    gene_order = np.argsort(genes.to_numpy())
+    gene_rank = np.empty(len(genes), dtype=np.int64)
+    gene_rank[gene_order] = np.arange(len(genes))
+    srt_values, srt_rank = np.unique(srt_offs, return_inverse=True)
+    end_values, end_rank = np.unique(end_offs, return_inverse=True)
+    key = ((gene_rank[columns['gene_name']]*len(srt_values)
+            + srt_rank[columns['file']])*len(end_values)
+           + end_rank[columns['file']])
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+
+    repeated = np.r_[False, key[1:] == key[:-1]]
+    del key
+    if repeated.any():
+        repeated_genes = pd.unique(genes.to_numpy()[
+            columns['gene_name'][order[repeated]]])
+        print('-- Warning! The following genes were repeated, so only first '
+              'instance was considered:')
+        print('\n'.join(repeated_genes))
+        order = order[~repeated]
+
+    # Create single dataframe from all files, changing data types one column
+    # at a time
+    file_idx = columns.pop('file')[order]
+    sweep_data = {'gene_name': genes.to_numpy()[columns.pop('gene_name')
+                                                [order]]}
+    for name in _analyzer_columns[1:]:
+        downcast = 'integer' if name.endswith('counts') else 'float'
+        sweep_data[name] = pd.to_numeric(columns.pop(name)[order],
+                                         downcast=downcast)
+    sweep_data['srt_off'] = pd.to_numeric(srt_offs[file_idx],
+                                          downcast='integer')
+    sweep_data['end_off'] = pd.to_numeric(end_offs[file_idx],
+                                          downcast='integer')
+    sweep_data = pd.DataFrame(sweep_data, index=order)
 
-            # print(f'Reading file: {idx + 1} of {len(files)}')
+    return sweep_data
 
-            # Get param values from filename
-            match = re.search(r'_start=(.*?)_', filename)
-            start = match.group(1)
-            match = re.search(r'_end=(.*?)_', filename)
-            end = match.group(1)
 
-            # File to df, add columns for each param value and add to list
-            df = pd.read_csv(data_path + filename, sep='\t',
-                             index_col=None, header=None)
-            df[6] = start
-            df[7] = end
+def _get_column(df: pd.DataFrame, name: str) -> np.ndarray:
+    '''Returns values of column or index level 'name' of 'df'.'''
 
-            # Remove header line if included
-            if df.iloc[0][0] == 'gene':
-                df = df.drop([0])
+    if name in df.columns:
+        return df[name].to_numpy()
+    return df.index.get_level_values(name).to_numpy()
 
-            df = df.rename(columns={0: 'gene_name', 1: 'low_counts',
-                                    2: 'high_counts', 3: 'p',
-                                    4: 'p_fdr', 5: 'log2_mi',
-                                    6: 'start', 7: 'end'})
 
-            repeated = df.groupby('gene_name').apply(lambda x: len(x))
-            repeated_genes.update(repeated[repeated > 1].index)
+def sweep_grid_index(sweep_data: pd.DataFrame) -> Tuple[
+        np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+        np.ndarray]:
+    '''Returns the position of every row of 'sweep_data' in a dense
+    (genes x start offsets x end offsets) grid spanning the whole screen.
 
-            df = df.groupby('gene_name').first()
-            df = df.reset_index()
+    Returns tuple (genes, srt_offs, end_offs, gene_idx, srt_idx, end_idx),
+    where the first three arrays hold the sorted unique values of each axis
+    and the last three the grid coordinates of each row. 'srt_off' and
+    'end_off' can be columns or index levels (as in analyzed sweeps).
+    '''
 
-            df_list.append(df)
+    gene_idx, genes = pd.factorize(sweep_data['gene_name'], sort=True)
+    srt_idx, srt_offs = pd.factorize(_get_column(sweep_data, 'srt_off'),
+                                     sort=True)
+    end_idx, end_offs = pd.factorize(_get_column(sweep_data, 'end_off'),
+                                     sort=True)
 
-    if repeated_genes:
-        print('-- Warning! The following genes were repeated, so only first '
-              'instance was considered:')
-        print('\n'.join(repeated_genes))
+    return (np.asarray(genes), np.asarray(srt_offs), np.asarray(end_offs),
+            gene_idx, srt_idx, end_idx)
 
-    # Create single dataframe from list
-    sweep_data = pd.concat(df_list, axis=0, ignore_index=True)
 
-    # sweep_data = sweep_data.rename(columns={0: 'gene_name', 1: 'low_counts',
-    #                                         2: 'high_counts', 3: 'p',
-    #                                         4: 'p_fdr', 5: 'log2_mi',
-    #                                         6: 'start', 7: 'end'})
+def _interpolate_axis(cube: np.ndarray, fill: np.ndarray,
+                      axis: int) -> None:
+    '''Fills NaN values of 'cube' where 'fill' is True by linear
+    interpolation between the nearest values along 'axis' (in place).
+    Values with no value on one side are left NaN.
+    '''
 
-    # Trandform parameter into numbers, eg. 'tx-100' is changed to column
-    # 'offset' with value -100:int
-    sweep_data[['srt_off', 'end_off']] = sweep_data[['start', 'end']].applymap(
-        lambda x: ''.join(re.split('(-|\\+)', x)[1:3])).astype(np.int16)
+    n = cube.shape[axis]
+    shape = [1] * cube.ndim
+    shape[axis] = n
+    idx = np.arange(n).reshape(shape)
+
+    valid = ~np.isnan(cube)
+    prev = np.maximum.accumulate(np.where(valid, idx, -1), axis=axis)
+    next = np.flip(np.minimum.accumulate(
+        np.flip(np.where(valid, idx, n), axis=axis), axis=axis), axis=axis)
+
+    missing = ~valid & fill & (prev >= 0) & (next < n)
+    prev, next = np.maximum(prev, 0), np.minimum(next, n - 1)
+    weight = (idx - prev) / np.maximum(next - prev, 1)
+    values = (np.take_along_axis(cube, prev, axis=axis) * (1 - weight)
+              + np.take_along_axis(cube, next, axis=axis) * weight)
+    cube[missing] = values[missing]
+
+
+def get_sweep_slopes(sweep_data: pd.DataFrame, step: int,
+                     fill_grid: Optional[bool] = False) -> pd.DataFrame:
+    '''Computes columns 'sl_sdir', 'sl_edir', 'p_min_sdir' and 'p_min_edir'
+    (see 'write_sweep_data') for all genes at once. Data is sorted by gene,
+    start and end offset and placed in a dense (genes x start x end) grid, so
+    the values of the previous start/end parameter are simple array shifts.
+
+    If 'fill_grid' is True, the grid has step 'step' and log2_mi of grid
+    points missing for all genes (eg. left out by 'run_adaptive_sweep') is
+    interpolated from the nearest points run, first along end offsets, then
+    along start offsets. Interpolated values are only used for the slopes
+    of the points next to them and are not returned. p_min_sdir/p_min_edir
+    next to them are the p_fdr of the point itself.
+
+    Returns dataframe indexed by (srt_off, end_off) with the same columns and
+    row order as the parquet file written by 'write_sweep_data'.
+    '''
 
-    # Rearrange and change data types
-    sweep_data = sweep_data.sort_values(by=['gene_name', 'srt_off', 'end_off'])
-    sweep_data = sweep_data.drop(['start', 'end'], axis=1)
+    if fill_grid:
+        gene_idx, genes = pd.factorize(sweep_data['gene_name'], sort=True)
+        srt_off = sweep_data['srt_off'].to_numpy().astype(np.int64)
+        end_off = sweep_data['end_off'].to_numpy().astype(np.int64)
+        srt_offs = np.arange(srt_off.min(), srt_off.max() + 1, step)
+        end_offs = np.arange(end_off.min(), end_off.max() + 1, step)
+        srt_idx = (srt_off - srt_offs[0]) // step
+        end_idx = (end_off - end_offs[0]) // step
+    else:
+        (genes, srt_offs, end_offs,
+         gene_idx, srt_idx, end_idx) = sweep_grid_index(sweep_data)
+    shape = (len(genes), len(srt_offs), len(end_offs))
+
+    # Sort once by gene, start and end offset. Each row has a unique position
+    # in the flattened grid, so rows are sorted by filling in the grid
+    grid_rows = np.full(np.prod(shape), -1, dtype=np.int64)
+    grid_rows[np.ravel_multi_index((gene_idx, srt_idx, end_idx),
+                                   shape)] = np.arange(len(sweep_data))
+    grid_pos = np.flatnonzero(grid_rows >= 0)
+    order = grid_rows[grid_pos]
+    del grid_rows
+
+    sweep = {col: sweep_data[col].to_numpy()[order]
+             for col in ['gene_name', 'low_counts', 'high_counts', 'p',
+                         'p_fdr', 'log2_mi', 'srt_off', 'end_off']}
+
+    # Values at previous start (sdir) or end (edir) parameter. Missing grid
+    # points stay NaN, same as in a per gene pivot table
+    prev = dict()
+    for col in ['log2_mi', 'p_fdr']:
+        cube = np.full(shape, np.nan)
+        cube.ravel()[grid_pos] = sweep[col]
+        if fill_grid and col == 'log2_mi':
+            run = np.zeros(shape[1:], dtype=bool)
+            run[srt_idx, end_idx] = True
+            _interpolate_axis(cube, ~run[None, :, :], axis=2)
+            _interpolate_axis(cube, ~run[None, :, :], axis=1)
+
+        shifted = np.full(shape, np.nan)
+        shifted[:, 1:, :] = cube[:, :-1, :]
+        prev_sdir = shifted.ravel()[grid_pos]
+        shifted[:, :, 1:] = cube[:, :, :-1]
+        shifted[:, :, 0] = np.nan
+        prev_edir = shifted.ravel()[grid_pos]
+
+        prev[col] = (prev_sdir, prev_edir)
+        del cube, shifted
+
+    log2_mi = sweep['log2_mi'].astype(np.float64)
+    p_fdr = sweep['p_fdr'].astype(np.float64)
+
+    all_info = pd.DataFrame({
+        'gene_name': sweep['gene_name'],
+        'high_counts': sweep['high_counts'],
+        'log2_mi': sweep['log2_mi'],
+        'low_counts': sweep['low_counts'],
+        'p': sweep['p'],
+        'p_fdr': sweep['p_fdr'],
+        'p_min_sdir': np.fmin(p_fdr, prev['p_fdr'][0]),
+        'p_min_edir': np.fmin(p_fdr, prev['p_fdr'][1]),
+        'sl_sdir': (log2_mi - prev['log2_mi'][0])/(step*0.001),
+        'sl_edir': (log2_mi - prev['log2_mi'][1])/(step*0.001)},
+        index=pd.MultiIndex.from_arrays(
+            [sweep['srt_off'].astype(np.int64),
+             sweep['end_off'].astype(np.int64)],
+            names=['srt_off', 'end_off']))
 
-    int_cols = ['low_counts', 'high_counts', 'srt_off', 'end_off']
-    sweep_data[int_cols] = (sweep_data[int_cols]
+    int_cols = ['low_counts', 'high_counts']
+    all_info[int_cols] = (all_info[int_cols]
+                          .apply(lambda x:
+                                 pd.to_numeric(x, downcast='integer')))
+    float_cols = ['p', 'p_fdr', 'log2_mi', 'sl_sdir', 'sl_edir']
+    all_info[float_cols] = (all_info[float_cols]
                             .apply(lambda x:
-                                   pd.to_numeric(x, downcast='integer')))
+                                   pd.to_numeric(x, downcast='float')))
 
-    float_cols = ['p', 'p_fdr', 'log2_mi']
-    sweep_data[float_cols] = (sweep_data[float_cols]
-                              .apply(lambda x:
-                                     pd.to_numeric(x, downcast='float')))
+    return all_info
 
-    return sweep_data
+
+def write_gene_sorted_parquet(sweep: pd.DataFrame, filename: str,
+                              genes_per_row_group: Optional[int] = None,
+                              metadata: Optional[dict] = None) -> None:
+    '''Writes analyzed sweep dataframe sorted by gene to parquet file
+    'filename', with 'genes_per_row_group' whole genes in every row group.
+    The gene_name statistics of each row group then point to the only row
+    group holding a gene (see 'LazyGroupedSweep'). 'metadata' (str keys and
+    values) is added to the schema metadata of the file.
+    '''
+    genes_per_row_group = genes_per_row_group or _genes_per_row_group
+
+    gene = _get_column(sweep, 'gene_name')
+    if len(gene) > 1 and (gene[1:] < gene[:-1]).any():
+        order = np.argsort(gene, kind='stable')
+        sweep = sweep.iloc[order]
+        gene = gene[order]
+
+    gene_starts = np.flatnonzero(np.r_[True, gene[1:] != gene[:-1]])
+    bounds = np.r_[gene_starts[::genes_per_row_group], len(sweep)]
+
+    # Dictionary pages of float columns are rewritten in every row group
+    table = pa.Table.from_pandas(sweep)
+    if metadata:
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            **{x.encode(): y.encode() for x, y in metadata.items()}})
+    with pq.ParquetWriter(filename, table.schema, compression='snappy',
+                          use_dictionary=['gene_name', 'srt_off', 'end_off',
+                                          'low_counts', 'high_counts']) \
+            as writer:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            writer.write_table(table.slice(start, stop - start),
+                               row_group_size=stop - start)
 
 
 @ timer
 def write_sweep_data(data_dir: str, sweep_data: pd.DataFrame,
-                     params: dict) -> pd.DataFrame:
+                     params: dict,
+                     fill_grid: Optional[bool] = False) -> pd.DataFrame:
     '''Writes compressed file containing all data from dataframe
     'sweep_data' generated by 'get_sweep_data' plus 4 additional columns that
     include data on how log2_mi and p_fdr change as parameters 'start' and
@@ -133,97 +428,231 @@ def write_sweep_data(data_dir: str, sweep_data: pd.DataFrame,
 
     'p_min_sdir' and 'p_min_edir' contain the minimum pfdr-value between
     consecutive parameters in both start and end directions.
-    '''
 
-    gene_info = dict()
-    grouped = sweep_data.groupby('gene_name')
-    for name, group in grouped:
+    Rows are sorted by gene and written in row groups of whole genes, so
+    single genes can be read without loading the whole file (see
+    'read_analyzed_sweep').
 
-        print(name)
+    If 'fill_grid' is True, slopes next to grid points that were not run
+    (eg. by 'run_adaptive_sweep') are computed from interpolated log2_mi
+    (see 'get_sweep_slopes'), otherwise they are NaN. Only points that were
+    run are written.
+    '''
 
-        gene_data = group.pivot(index='srt_off', columns='end_off',
-                                values=['gene_name', 'low_counts',
-                                        'high_counts', 'p', 'p_fdr',
-                                        'log2_mi'])
+    all_info = get_sweep_slopes(sweep_data, params['step'], fill_grid)
 
-        # Get slopes of log2 MI when changing parameters in both directions
-        # (delta log2 MI per 1,000 bp)
-        slope_sdir = (gene_data['log2_mi']
-                      - gene_data['log2_mi'].shift(1))/(params['step']*0.001)
-        slope_edir = (gene_data['log2_mi']
-                      - gene_data['log2_mi'].shift(1,
-                                                   axis=1))/(params['step']
-                                                             * 0.001)
+    # all_info.to_csv(f'{data_path}all_gene_info_csv.gz',
+    #                 compression='gzip')
+    data_path = sweep_path(data_dir, params)
 
-        # Get minimum p-value between consecutive parameters in both start
-        # and end directions
-        shift_sdir = gene_data['p_fdr'].shift(1)
-        shift_sdir.columns = pd.MultiIndex.from_arrays(
-            [tuple('p_shift_sdir' for x in shift_sdir.columns),
-             tuple(x for x in shift_sdir.columns)])
-        gene_data = pd.concat([gene_data, shift_sdir], ignore_index=False,
-                              axis=1)
+    if not os.path.exists(data_path):
+        os.makedirs(data_path, exist_ok=True)
+        print('Creating analyzed directory.')
 
-        shift_edir = gene_data['p_fdr'].shift(1, axis=1)
-        shift_edir.columns = pd.MultiIndex.from_arrays(
-            [tuple('p_shift_edir' for x in shift_edir.columns),
-             tuple(x for x in shift_edir.columns)])
-        gene_data = pd.concat([gene_data, shift_edir], ignore_index=False,
-                              axis=1)
+    print(f'Writing sweep data for screen {params["screen_name"]}')
+    with atomic_write(f'{data_path}all_gene_info.parquet.snappy') as tmp:
+        write_gene_sorted_parquet(all_info, tmp)
 
-        # Stack data and add columns
-        gene_data = gene_data.stack()
+    return all_info
 
-        gene_data['p_min_sdir'] = gene_data[['p_fdr',
-                                             'p_shift_sdir']].min(axis=1)
-        gene_data['p_min_edir'] = gene_data[['p_fdr',
-                                             'p_shift_edir']].min(axis=1)
-        gene_data = gene_data.drop(columns=['p_shift_sdir', 'p_shift_edir'])
 
-        gene_data['sl_sdir'] = slope_sdir.stack()
-        gene_data['sl_edir'] = slope_edir.stack()
+def _save_array(filename: str, array: np.ndarray) -> None:
+    with atomic_write(filename) as tmp:
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
 
-        gene_data = gene_data[gene_data.gene_name.notnull()]
 
-        gene_info[name] = gene_data
+def write_sweep_cube(data_dir: str, all_info: pd.DataFrame,
+                     params: dict) -> None:
+    '''Writes analyzed sweep dataframe 'all_info' created by
+    'write_sweep_data' in a dense format: one (genes x start offsets x end
+    offsets) array per metric, saved as float32 or int32 .npy files in
+    directory 'all_gene_info.cube' together with the gene names and
+    offsets. Points missing in the sweep are NaN (-1 for counts).
+    Read with 'read_sweep_cube'.
+    '''
+    cube_path = f'{sweep_path(data_dir, params)}all_gene_info.cube/'
+    os.makedirs(cube_path, exist_ok=True)
+    # Remove gene names of a previous cube first, so an interrupted rewrite is
+    # not taken as complete
+    if os.path.exists(f'{cube_path}gene_name.npy'):
+        os.remove(f'{cube_path}gene_name.npy')
+
+    (genes, srt_offs, end_offs,
+     gene_idx, srt_idx, end_idx) = sweep_grid_index(all_info)
+    shape = (len(genes), len(srt_offs), len(end_offs))
+    grid_pos = np.ravel_multi_index((gene_idx, srt_idx, end_idx), shape)
+
+    print(f'Writing sweep cube for screen {params["screen_name"]}')
+    for metric, dtype in _cube_metrics.items():
+        fill = -1 if np.issubdtype(dtype, np.integer) else np.nan
+        cube = np.full(np.prod(shape), fill, dtype=dtype)
+        cube[grid_pos] = _get_column(all_info, metric)
+        _save_array(f'{cube_path}{metric}.npy', cube.reshape(shape))
+
+    _save_array(f'{cube_path}srt_off.npy', srt_offs.astype(np.int32))
+    _save_array(f'{cube_path}end_off.npy', end_offs.astype(np.int32))
+    # Gene names last, marks the cube as complete
+    _save_array(f'{cube_path}gene_name.npy', genes.astype(str))
+
+
+def _ingest_screen(indata_dir: str, outdata_dir: str, params: dict) -> dict:
+    '''Reads and writes the sweep of a single screen. Runs in a worker
+    process of 'ingest_screens'.
+    '''
 
-    all_info = pd.concat(gene_info.values(), ignore_index=False)
+    start_time = time.perf_counter()
+    try:
+        sweep = get_sweep_data(indata_dir, params)
+        write_sweep_data(outdata_dir, sweep, params)
+        status, error = 'done', None
+    except Exception as err:
+        status, error = 'failed', f'{type(err).__name__}: {err}'
 
-    int_cols = ['low_counts', 'high_counts']
-    all_info[int_cols] = (all_info[int_cols]
-                          .apply(lambda x:
-                                 pd.to_numeric(x, downcast='integer')))
-    float_cols = ['p', 'p_fdr', 'log2_mi', 'sl_sdir', 'sl_edir']
-    all_info[float_cols] = (all_info[float_cols]
-                            .apply(lambda x:
-                                   pd.to_numeric(x, downcast='float')))
+    return {'screen_name': params['screen_name'], 'status': status,
+            'secs': time.perf_counter() - start_time, 'error': error}
 
-    # all_info.to_csv(f'{data_path}all_gene_info_csv.gz',
-    #                 compression='gzip')
-    data_path = (f'''{data_dir}/{params['screen_name']}/'''
-                 f'''{params['assembly']}/{params['trim_length']}/'''
-                 f'''mode={params['mode']}_direction={params['direction']}'''
-                 f'''_overlap={params['overlap']}/double-sweep'''
-                 f'''_step={params['step']}/''')
 
-    if not os.path.exists(data_path):
-        os.makedirs(data_path)
-        print('Creating analyzed directory.')
+@timer
+def ingest_screens(indata_dir: str, outdata_dir: str, params: dict,
+                   workers: Optional[int] = None,
+                   screens: Optional[List[str]] = None) -> pd.DataFrame:
+    '''Runs 'get_sweep_data' and 'write_sweep_data' for many screens in
+    parallel using a pool of 'workers' processes (default: number of CPUs).
+    Each worker holds a whole screen in memory, so lower 'workers' if memory
+    is limited.
+
+    'screens' defaults to all screens in 'indata_dir'. Screens whose
+    analyzed file already exists in 'outdata_dir' are skipped. Since output
+    files are written atomically, screens from an interrupted run are
+    simply processed again.
+
+    Returns dataframe with one row per screen, eg.:
+    screen_name     status      secs    error
+    PDL1_IFNg       done        81.3    None
+    p-RPA           skipped     0.0     None
+    WT_pS6          failed      0.2     FileNotFoundError: ...
+    '''
 
-    print(f'Writing sweep data for screen {params["screen_name"]}')
-    all_info.to_parquet(f'{data_path}all_gene_info.parquet.snappy',
-                        engine='pyarrow', compression='snappy')
+    if screens is None:
+        screens = sorted(x for x in os.listdir(indata_dir)
+                         if os.path.isdir(f'{indata_dir}/{x}'))
+
+    summary = []
+    pending = []
+    for screen in screens:
+        screen_params = {**params, 'screen_name': screen}
+        out_file = (f'{sweep_path(outdata_dir, screen_params)}'
+                    f'all_gene_info.parquet.snappy')
+        if os.path.exists(out_file):
+            summary.append({'screen_name': screen, 'status': 'skipped',
+                            'secs': 0.0, 'error': None})
+        else:
+            pending.append(screen_params)
+
+    print(f'Ingesting {len(pending)} screens, skipping {len(summary)} '
+          f'already analyzed.')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_ingest_screen, indata_dir, outdata_dir,
+                                   screen_params): screen_params
+                   for screen_params in pending}
+        for idx, future in enumerate(as_completed(futures)):
+            screen = futures[future]['screen_name']
+            try:
+                result = future.result()
+            except Exception as err:
+                # Worker process died (eg. out of memory)
+                result = {'screen_name': screen, 'status': 'failed',
+                          'secs': np.nan,
+                          'error': f'{type(err).__name__}: {err}'}
+            print(f'{result["status"].capitalize()} screen {screen} - '
+                  f'{idx + 1} of {len(pending)}')
+            summary.append(result)
+
+    summary = pd.DataFrame(summary, columns=['screen_name', 'status', 'secs',
+                                             'error'])
+    summary = summary.sort_values(by='screen_name').reset_index(drop=True)
+
+    failed = summary.query('status == "failed"')
+    if not failed.empty:
+        print('-- Warning! The following screens failed:')
+        print('\n'.join(failed.screen_name))
+
+    return summary
+
+
+class LazyGroupedSweep:
+    '''Stand-in for the grouped_sweep created by 'read_analyzed_sweep' that
+    only reads the rows of the genes it is asked for from the analyzed sweep
+    file. Row groups are selected with their gene_name statistics, so files
+    written by 'write_sweep_data' read a single row group per gene.
+
+    Supports 'get_group', 'groups' (gene names as keys) and iteration.
+    'obj' reads the whole sweep for functions that process all genes.
+    '''
 
-    return all_info
+    def __init__(self, filename: str, cached_row_groups: int = 8):
+        self.filename = filename
+        self._file = pq.ParquetFile(filename)
+
+        meta = self._file.metadata
+        col = meta.schema.to_arrow_schema().get_field_index('gene_name')
+        stats = [meta.row_group(i).column(col).statistics
+                 for i in range(meta.num_row_groups)]
+        self._rg_min = np.array([s.min if s is not None and s.has_min_max
+                                 else None for s in stats], dtype=object)
+        self._rg_max = np.array([s.max if s is not None and s.has_min_max
+                                 else None for s in stats], dtype=object)
+        self._read_row_group = lru_cache(maxsize=cached_row_groups)(
+            self._file.read_row_group)
+        self._obj = None
+        self._groups = None
+
+    def _row_groups(self, gene: str) -> List[int]:
+        return [i for i, (lo, hi) in enumerate(zip(self._rg_min,
+                                                    self._rg_max))
+                if lo is None or lo <= gene <= hi]
+
+    def get_group(self, gene: str) -> pd.DataFrame:
+        tables = [self._read_row_group(i) for i in self._row_groups(gene)]
+        tables = [t.filter(pc.equal(t['gene_name'], gene)) for t in tables]
+        tables = [t for t in tables if t.num_rows]
+        if not tables:
+            raise KeyError(gene)
+
+        return pa.concat_tables(tables).to_pandas()
+
+    @property
+    def groups(self) -> dict:
+        if self._groups is None:
+            genes = self._file.read(columns=['gene_name'])['gene_name']
+            self._groups = dict.fromkeys(pc.unique(genes).to_pylist())
+        return self._groups
+
+    @property
+    def obj(self) -> pd.DataFrame:
+        if self._obj is None:
+            self._obj = self._file.read().to_pandas()
+        return self._obj
+
+    def __iter__(self):
+        return iter(self.obj.groupby('gene_name'))
+
+    def __len__(self) -> int:
+        return len(self.groups)
 
 
 # @timer
 def read_analyzed_sweep(data_dir: str,
-                        params: dict) -> \
+                        params: dict,
+                        lazy: Optional[bool] = False) -> \
         pd.core.groupby.generic.DataFrameGroupBy:
     '''Reads compressed file created by 'write_sweep_data' containing
     the all data from sweeping the start and end paramenters with the
     screen-analyzer. Returns pandas dataframe grouped by gene name.
+    If 'lazy', returns a 'LazyGroupedSweep' instead, which only reads the
+    genes it is asked for (eg. by 'get_gene_info').
 
     data_dir: str eg. 'data/analyzed-data'
     params: dict eg {'screen_name': 'PDL1_IFNg',
@@ -237,11 +666,10 @@ def read_analyzed_sweep(data_dir: str,
                      'step': 500}
     '''
 
-    data_file = (f'''{data_dir}/{params['screen_name']}/'''
-                 f'''{params['assembly']}/{params['trim_length']}/'''
-                 f'''mode={params['mode']}_direction={params['direction']}'''
-                 f'''_overlap={params['overlap']}/double-sweep'''
-                 f'''_step={params['step']}/all_gene_info''')
+    data_file = f'{sweep_path(data_dir, params)}all_gene_info'
+
+    if lazy:
+        return LazyGroupedSweep(f'{data_file}.parquet.snappy')
 
     # sweep = pd.read_csv(f'{data_file}_csv.gz', compression='gzip')
     sweep = pd.read_parquet(f'{data_file}.parquet.snappy',
@@ -253,6 +681,77 @@ def read_analyzed_sweep(data_dir: str,
     return grouped_sweep
 
 
+class SweepCube:
+    '''Dense sweep data of a screen written by 'write_sweep_cube'. Each
+    metric is a (genes x start offsets x end offsets) array memory-mapped
+    on first access, eg. log2 MI at tx start and end for all genes:
+    cube['log2_mi'][:, cube.srt_index(0), cube.end_index(0)]
+
+    Also supports 'get_group' and 'groups' like a grouped_sweep, so it can
+    be used with 'get_gene_info'.
+    '''
+
+    def __init__(self, cube_path: str):
+        self.path = cube_path
+        self.genes = np.load(f'{cube_path}gene_name.npy')
+        self.srt_offs = np.load(f'{cube_path}srt_off.npy')
+        self.end_offs = np.load(f'{cube_path}end_off.npy')
+        self._metrics = {}
+
+    def __getitem__(self, metric: str) -> np.ndarray:
+        if metric not in self._metrics:
+            if metric not in _cube_metrics:
+                raise KeyError(metric)
+            self._metrics[metric] = np.load(f'{self.path}{metric}.npy',
+                                            mmap_mode='r')
+        return self._metrics[metric]
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    @staticmethod
+    def _index(values: np.ndarray, value) -> int:
+        i = np.searchsorted(values, value)
+        if i == len(values) or values[i] != value:
+            raise KeyError(value)
+        return int(i)
+
+    def gene_index(self, gene: str) -> int:
+        return self._index(self.genes, gene)
+
+    def srt_index(self, srt_off: int) -> int:
+        return self._index(self.srt_offs, srt_off)
+
+    def end_index(self, end_off: int) -> int:
+        return self._index(self.end_offs, end_off)
+
+    @property
+    def groups(self) -> dict:
+        return dict.fromkeys(self.genes.tolist())
+
+    def get_group(self, gene: str) -> pd.DataFrame:
+        i = self.gene_index(gene)
+        srt_idx, end_idx = np.nonzero(self['low_counts'][i] >= 0)
+
+        gene_info = pd.DataFrame(
+            {'gene_name': gene},
+            index=pd.MultiIndex.from_arrays([self.srt_offs[srt_idx],
+                                             self.end_offs[end_idx]],
+                                            names=['srt_off', 'end_off']))
+        for metric in _cube_metrics:
+            gene_info[metric] = self[metric][i, srt_idx, end_idx]
+
+        return gene_info
+
+
+def read_sweep_cube(data_dir: str, params: dict) -> SweepCube:
+    '''Opens dense sweep data written by 'write_sweep_cube' for a given
+    screen (see 'read_analyzed_sweep' for 'data_dir' and 'params'). Metric
+    arrays are only read from disk as they are accessed.
+    '''
+    return SweepCube(f'{sweep_path(data_dir, params)}all_gene_info.cube/')
+
+
 def get_gene_info(gene: str,
                   grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy) -> \
         pd.DataFrame:
@@ -265,79 +764,169 @@ def get_gene_info(gene: str,
     return gene_info.unstack()
 
 
+def tx_mask(sweep_data: pd.DataFrame) -> np.ndarray:
+    '''Boolean mask of the rows of 'sweep_data' at tx start and end
+    (srt_off == 0 and end_off == 0). 'srt_off' and 'end_off' can be columns
+    or index levels, levels are compared by their codes without building
+    the offsets of every row.
+    '''
+
+    mask = np.ones(len(sweep_data), dtype=bool)
+    index = sweep_data.index
+    for name in ['srt_off', 'end_off']:
+        if name in sweep_data.columns:
+            mask &= sweep_data[name].to_numpy() == 0
+        elif isinstance(index, pd.MultiIndex):
+            level = index.names.index(name)
+            code = index.levels[level].get_indexer([0])[0]
+            mask &= (index.codes[level] == code) & (code >= 0)
+        else:
+            mask &= _get_column(sweep_data, name) == 0
+
+    return mask
+
+
+def get_values_at_tx(grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy,
+                     columns: Optional[List[str]] = None) -> pd.DataFrame:
+    '''Returns the values of all genes at tx start and end, selected with a
+    single mask over the whole screen (see 'tx_mask'). 'grouped_sweep' can
+    be created by 'read_analyzed_sweep' (also with 'lazy', then the file is
+    read filtered by offset and the whole sweep is never loaded), by
+    'read_sweep_cube' or be an ungrouped sweep dataframe. Genes without a
+    point at tx are left out.
+
+    Returns dataframe indexed by gene name with all metrics or only
+    'columns'. Eg.:
+    gene_name   high_counts   log2_mi   low_counts   p   p_fdr ...
+    A1BG        52            -0.41     74           0.11   0.83
+    '''
+
+    if isinstance(grouped_sweep, SweepCube):
+        srt_idx = grouped_sweep.srt_index(0)
+        end_idx = grouped_sweep.end_index(0)
+        at_tx = pd.DataFrame({metric: grouped_sweep[metric][:, srt_idx,
+                                                            end_idx]
+                              for metric in _cube_metrics},
+                             index=pd.Index(grouped_sweep.genes,
+                                            name='gene_name'))
+        at_tx = at_tx[at_tx.low_counts >= 0]
+
+    else:
+        if (isinstance(grouped_sweep, LazyGroupedSweep)
+                and grouped_sweep._obj is None):
+            read_columns = (None if columns is None else
+                            ['gene_name', 'srt_off', 'end_off'] + columns)
+            sweep = pq.read_table(grouped_sweep.filename,
+                                  columns=read_columns,
+                                  filters=[('srt_off', '=', 0),
+                                           ('end_off', '=', 0)]).to_pandas()
+        elif isinstance(grouped_sweep, pd.DataFrame):
+            sweep = grouped_sweep
+        else:
+            sweep = grouped_sweep.obj
+
+        at_tx = sweep[tx_mask(sweep)]
+        at_tx = at_tx.set_index('gene_name')
+        at_tx = at_tx.drop(columns=[x for x in ['srt_off', 'end_off']
+                                    if x in at_tx.columns])
+
+    if columns is not None:
+        at_tx = at_tx[columns]
+
+    return at_tx
+
+
+def _slope_flag_rows(sweep: pd.DataFrame) -> Tuple:
+    '''Collects the rows of an analyzed sweep that can flag a gene when
+    changing either the start or the end parameter (see 'flag_by_slope').
+    A row flags a gene for (slope_thr, p_thr) if its absolute slope is
+    higher than slope_thr and both its p-values are lower than p_thr.
+
+    Returns gene names, the minimum p-value of each gene and a tuple with,
+    per candidate flag, the gene index, absolute slope, minimum p-value in
+    the direction of the slope and the p-value of the point itself (start
+    flags) or of the point one end offset before it (end flags).
+    '''
+    (genes, srt_offs, end_offs,
+     gene_idx, srt_idx, end_idx) = sweep_grid_index(sweep)
+    srt_off = srt_offs[srt_idx]
+    end_off = end_offs[end_idx]
+    p = sweep['p'].to_numpy()
+
+    shape = (len(genes), len(srt_offs), len(end_offs))
+    grid_pos = np.ravel_multi_index((gene_idx, srt_idx, end_idx), shape)
+    p_grid = np.full(np.prod(shape), np.nan, dtype=p.dtype)
+    p_grid[grid_pos] = p
+    min_p = np.nanmin(p_grid.reshape(len(genes), -1), axis=1)
+
+    # Remove flags that fall in regions outside of genes (see 'flags_query')
+    sdir = np.flatnonzero((srt_off > 0) & (end_off <= 0))
+    edir = np.flatnonzero((srt_off >= 0) & (end_off <= 0))
+
+    # For start flags, a smaller part of the gene must result in a p-value
+    # lower than p_thr. For end flags, going into the gene must result in a
+    # p-value lower than p_thr, looked up in the (genes x start x end) grid
+    # shifted by one end offset
+    step = np.diff(end_offs).min() if len(end_offs) > 1 else 0
+    has_prev = ((end_idx[edir] > 0)
+                & (end_offs[end_idx[edir] - 1] == end_off[edir] - step))
+    prev_p = np.where(has_prev, p_grid[grid_pos[edir] - 1], np.nan)
+    del p_grid
+
+    flags = (np.concatenate([gene_idx[sdir], gene_idx[edir]]),
+             np.abs(np.concatenate([sweep['sl_sdir'].to_numpy()[sdir],
+                                    sweep['sl_edir'].to_numpy()[edir]])),
+             np.concatenate([sweep['p_min_sdir'].to_numpy()[sdir],
+                             sweep['p_min_edir'].to_numpy()[edir]]),
+             np.concatenate([p[sdir], prev_p.astype(p.dtype)]))
+
+    return genes, min_p, flags
+
+
 # @ timer
 def flag_by_slope(grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy,
                   p_thr: float,
                   slope_thr: float,
                   ) -> pd.DataFrame:
-    ''' need to update
-    Given a grouped_sweep created by 'read_analyzed_sweep', finds genes
-    that have a higher slope and p ratio than the thresholds given by
-    'slope_thr' and 'p_thr'.
+    '''Given a grouped_sweep created by 'read_analyzed_sweep', finds genes
+    that have a higher slope and lower p-value than the thresholds given by
+    'slope_thr' and 'p_thr' when changing either the start or the end
+    parameter within the gene (see 'flags_query').
     Slope refers to the change in the log2 mutation index per 1,000 bp.
-    Returns tuple with two dictionaries, where keys are gene names and values
-    are subsets of dataframe where both thresholds are passed when changing
-    either the start or the end parameter, respectively.
+    All genes are processed at once with boolean masks over the whole screen.
+
+    Returns dataframe with flagged genes and their values at tx start and
+    end, sorted by absolute log2 MI. Eg.:
+    gene	mi_at_tx	p_at_tx	    p_fdr_at_tx
+    CD274	0.12	    3.41e-01	0.84
     '''
 
-    flagged_df_list = []
-    ct = 0
-
-    for name, group in grouped_sweep:
-
-        # Continue if at least one point in sweep is highly significant
-        if not group.query('p < @p_thr').empty:
-
-            flags_sdir = group.query(flags_query('start'))
-            flags_edir = group.query(flags_query('end'))
-
-            # Remove flags that fall in regions outside of genes and those
-            # where a smaller part of the gene results in a p-value lower
-            # than p_thr
-            if not flags_sdir.empty:
-                flags_sdir = flags_sdir.reset_index().query('srt_off > 0 '
-                                                            '& end_off <= 0'
-                                                            '& p < @p_thr')
-            if not flags_edir.empty:
-                flags_edir = flags_edir.reset_index().query('srt_off >= 0 '
-                                                            '& end_off <= 0')
-
-                # Remove flags where going into the gene results in a p-value
-                # lower than p_thr (trickier than for sdir since the previous
-                # p-value is not saved in flags_edir, so you have to look it
-                # up in the group)
-                step = abs(group.reset_index()['end_off'].iloc[1]
-                           - group.reset_index()['end_off'].iloc[0])
-                flags_edir['prev_end_off'] = flags_edir['end_off'] - step
-                flags_edir = flags_edir.set_index(['srt_off', 'prev_end_off'])
-                flags_edir = flags_edir[group.loc[flags_edir.index].p
-                                        < p_thr]
-
-            if not flags_sdir.empty or not flags_edir.empty:
-                ct += 1
-                # print(f'Flagged: {name}')
-
-                try:
-                    mi_at_tx = group.loc[0, 0].log2_mi
-                    p_at_tx = group.loc[0, 0].p
-                    p_fdr_at_tx = group.loc[0, 0].p_fdr
-                except KeyError:
-                    mi_at_tx = np.nan
-                    p_at_tx = np.nan
-                    p_fdr_at_tx = np.nan
-
-                df = pd.Series({'gene': name,
-                                'mi_at_tx': mi_at_tx,
-                                'p_at_tx': p_at_tx,
-                                'p_fdr_at_tx': p_fdr_at_tx})
-
-                flagged_df_list.append(df)
+    sweep = grouped_sweep.obj
+
+    (genes, min_p,
+     (flag_gene, flag_slope, flag_p_min, flag_p)) = _slope_flag_rows(sweep)
+
+    # Keep flags with a steep enough slope and low enough p-values, in genes
+    # with at least one highly significant point in sweep
+    flags = (flag_slope > slope_thr) & (flag_p_min < p_thr) & (flag_p < p_thr)
+    flagged_genes = np.unique(flag_gene[flags])
+    flagged_genes = flagged_genes[min_p[flagged_genes] < p_thr]
+    ct = len(flagged_genes)
+
+    # Values at tx start and tx end (NaN if not in sweep)
+    at_tx = get_values_at_tx(sweep, ['log2_mi', 'p', 'p_fdr'])
+    at_tx = at_tx.reindex(genes[flagged_genes])
+
+    flagged = pd.DataFrame({'gene': genes[flagged_genes]})
+    for col, name in [('log2_mi', 'mi_at_tx'), ('p', 'p_at_tx'),
+                      ('p_fdr', 'p_fdr_at_tx')]:
+        flagged[name] = at_tx[col].to_numpy().astype(sweep[col].dtype)
 
     print(f'# flagged genes: {ct}')
 
-    if flagged_df_list:
-        flagged = pd.concat(flagged_df_list, axis=1).T
-        flagged = flagged.iloc[abs(flagged.mi_at_tx).sort_values().index]
+    if ct:
+        flagged = flagged.iloc[abs(flagged.mi_at_tx)
+                               .sort_values(kind='mergesort').index]
         flagged.mi_at_tx = flagged.mi_at_tx.astype(float).round(2)
         flagged.p_at_tx = flagged.p_at_tx.astype(float).apply(lambda x:
                                                               f'{x:.2e}')
@@ -351,6 +940,59 @@ def flag_by_slope(grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy,
     return flagged
 
 
+def flag_by_slope_scan(grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy,
+                       thresholds: List[Tuple[float, float]]) -> pd.DataFrame:
+    '''Given a grouped_sweep created by 'read_analyzed_sweep', finds the
+    genes flagged by 'flag_by_slope' for every (slope_thr, p_thr) pair in
+    'thresholds' in a single pass over the sweep.
+    The maximum absolute slope of each gene is precomputed for every p_thr,
+    restricted to the points whose p-values fall below it, so each pair only
+    compares one value per gene.
+
+    Returns long dataframe with one row per flagged gene and pair. Eg.:
+    slope_thr   p_thr   gene
+    1           1e-05   CD274
+    Number of flagged genes per pair:
+    flag_by_slope_scan(grouped_sweep, [(1, 1e-5), (2, 1e-3)])
+        .groupby(['slope_thr', 'p_thr']).size()
+    '''
+    sweep = grouped_sweep.obj
+
+    (genes, min_p,
+     (flag_gene, flag_slope, flag_p_min, flag_p)) = _slope_flag_rows(sweep)
+
+    # Index of the lowest p_thr each flag qualifies for. Float32 p-values
+    # are compared against float32 thresholds, as in 'flag_by_slope'
+    p_thrs = np.unique([p_thr for _, p_thr in thresholds])
+    p_thrs32 = p_thrs.astype(flag_p.dtype)
+    level = np.maximum(np.searchsorted(p_thrs, flag_p_min, side='right'),
+                       np.searchsorted(p_thrs32, flag_p, side='right'))
+    signif_level = np.searchsorted(p_thrs32, min_p, side='right')
+
+    # Maximum absolute slope per gene among flags qualifying for each p_thr
+    keep = (level < len(p_thrs)) & ~np.isnan(flag_slope)
+    max_slope = np.full(len(genes) * len(p_thrs), -np.inf,
+                        dtype=flag_slope.dtype)
+    np.maximum.at(max_slope, flag_gene[keep] * len(p_thrs) + level[keep],
+                  flag_slope[keep])
+    max_slope = np.maximum.accumulate(max_slope.reshape(len(genes), -1),
+                                      axis=1)
+
+    flagged = []
+    for slope_thr, p_thr in thresholds:
+        k = np.searchsorted(p_thrs, p_thr)
+        flagged_genes = genes[(signif_level <= k)
+                              & (max_slope[:, k] > slope_thr)]
+        flagged.append(pd.DataFrame({'slope_thr': slope_thr,
+                                     'p_thr': p_thr,
+                                     'gene': flagged_genes}))
+
+    flagged = pd.concat(flagged, ignore_index=True) if flagged else \
+        pd.DataFrame(columns=['slope_thr', 'p_thr', 'gene'])
+
+    return flagged
+
+
 def get_flags_for_gene(gene: str,
                        grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy,
                        p_thr: Optional[float] = None,
@@ -383,30 +1025,77 @@ def flags_query(param: str) -> str:
     return q
 
 
-def sort_optimized_mi(group, p_thr=1e-5, weight_mi=1, weight_p=1,
-                      weight_ins=0, weight_off=0):
+def _optimization_features(sweep: pd.DataFrame, p_thr: float,
+                           genes: Optional[np.ndarray] = None) -> \
+        pd.DataFrame:
+    '''Returns the points of 'sweep' within genes (srt_off >= 0 and
+    end_off <= 0) with a p-value lower than 'p_thr', only for 'genes' if
+    given, together with their log2 MI, p-value, number of insertions and
+    offset from tx start and end normalized as used by 'sort_optimized_mi'.
+    Insertions and offsets are normalized by their maximum in each gene,
+    computed for all genes at once. Rows are labelled by their position in
+    'sweep'.
+    '''
 
-    opt = group.copy(deep=True)
-    opt = opt.reset_index()
+    # Significant rows first, they are few, then in gene rows and genes
+    rows = np.flatnonzero(sweep['p'].to_numpy() < p_thr)
+    sig = sweep.iloc[rows]
+    srt_off = _get_column(sig, 'srt_off')
+    end_off = _get_column(sig, 'end_off')
+    in_gene = (srt_off >= 0) & (end_off <= 0)
+    if genes is not None:
+        in_gene &= sig['gene_name'].isin(genes).to_numpy()
+    sig = sig[in_gene]
+
+    opt = pd.DataFrame({'srt_off': srt_off[in_gene],
+                        'end_off': end_off[in_gene],
+                        'gene_name': sig['gene_name'].to_numpy(),
+                        'high_counts': sig['high_counts'].to_numpy(),
+                        'low_counts': sig['low_counts'].to_numpy(),
+                        'log2_mi': sig['log2_mi'].to_numpy(),
+                        'p': sig['p'].to_numpy()},
+                       index=rows[in_gene])
+
+    ins = (opt.high_counts.to_numpy().astype(np.int64)
+           + opt.low_counts.to_numpy())
+    off = (np.abs(opt.srt_off.to_numpy().astype(np.int64))
+           + np.abs(opt.end_off.to_numpy()))
+    gene_idx, gene_names = pd.factorize(opt.gene_name)
+    max_ins = np.zeros(len(gene_names), dtype=np.int64)
+    np.maximum.at(max_ins, gene_idx, ins)
+    max_off = np.zeros(len(gene_names), dtype=np.int64)
+    np.maximum.at(max_off, gene_idx, off)
+
+    p = opt.p.to_numpy().astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        opt['norm_mi'] = opt.log2_mi.to_numpy().astype(np.float64)/10
+        opt['norm_log10_p'] = np.where(p > 0, np.abs(np.log10(p))/50, 1)
+        opt['norm_ins'] = ins/max_ins[gene_idx]
+        opt['norm_off'] = 1 - off/max_off[gene_idx]
+
+    return opt
 
-    # Remove out of gene and non significant regions
-    opt = opt.query('srt_off >=0 & end_off <= 0 & p < @p_thr')
 
-    # Get normalized values for log2_mi, p, ins number and offset
-    opt['norm_mi'] = opt.log2_mi/10
-    opt['norm_log10_p'] = opt.p.apply(
-        lambda x: abs(-log10(x))/50 if x > 0 else 1)
-    max_ins = max(opt.high_counts + opt.low_counts)
-    opt['norm_ins'] = (opt.high_counts + opt.low_counts)/max_ins
+def _optimization_score(squared: np.ndarray, weights: Tuple) -> np.ndarray:
+    '''Score of points from their squared normalized values (columns in
+    the order of '_optimization_columns') and the weights of each value.
+    The sum of (weight*value)**2 is a single matrix-vector product.
+    '''
 
-    max_off = max(abs(opt.srt_off) + abs(opt.end_off))
-    opt['norm_off'] = 1 - (abs(opt.srt_off) + abs(opt.end_off))/max_off
+    return squared @ np.square(np.asarray(weights, dtype=np.float64))
+
+
+def sort_optimized_mi(group, p_thr=1e-5, weight_mi=1, weight_p=1,
+                      weight_ins=0, weight_off=0):
+
+    # Keep in gene and significant regions and get normalized values for
+    # log2_mi, p, ins number and offset
+    opt = _optimization_features(group, p_thr)
 
     # Get score based on normalized values and weighs
-    opt['score'] = ((weight_mi*opt.norm_mi)**2
-                    + (weight_p*opt.norm_log10_p)**2
-                    + (weight_ins*opt.norm_ins)**2
-                    + (weight_off*opt.norm_off)**2)
+    opt['score'] = _optimization_score(
+        opt[_optimization_columns].to_numpy()**2,
+        (weight_mi, weight_p, weight_ins, weight_off))
 
     # Sort by score
     opt = opt.sort_values(by=['score'], ascending=False)
@@ -418,33 +1107,237 @@ def sort_optimized_mi(group, p_thr=1e-5, weight_mi=1, weight_p=1,
     return opt
 
 
-def optimize_flagged_genes(flagged, grouped_sweep, delta_mi_thr=0,
-                           p_thr=1e-5, weight_mi=2, weight_p=1,
-                           weight_ins=0, weight_off=0):
-    opt_list = []
-    for gene in list(flagged.gene):
+def _flags_at_tx(flagged: pd.DataFrame, sweep: pd.DataFrame) -> pd.DataFrame:
+    '''Returns the flags indexed by gene, with the p_fdr and counts of each
+    gene at tx start and end.
+    '''
 
-        group = grouped_sweep.get_group(gene)
-        opt = sort_optimized_mi(group, p_thr, weight_mi, weight_p,
-                                weight_ins, weight_off)
+    at_tx = get_values_at_tx(sweep, ['p_fdr', 'high_counts', 'low_counts'])
 
-        gene_at_tx = flagged.set_index('gene').loc[gene]
-        gene_at_tx['p_fdr_at_tx'] = group.loc[0, 0]['p_fdr']
-        gene_at_tx['high_at_tx'] = group.loc[0, 0]['high_counts']
-        gene_at_tx['low_at_tx'] = group.loc[0, 0]['low_counts']
-        gene_at_tx['counts_at_tx'] = (gene_at_tx.high_at_tx
-                                      + gene_at_tx.low_at_tx)
+    flags = flagged.set_index('gene')
+    flags['p_fdr_at_tx'] = at_tx.p_fdr
+    flags['high_at_tx'] = at_tx.high_counts
+    flags['low_at_tx'] = at_tx.low_counts
+    flags['counts_at_tx'] = flags.high_at_tx + flags.low_at_tx
 
-        gene_opt = gene_at_tx.append(opt.iloc[0][['gene_name', 'srt_off',
-                                                  'end_off', 'log2_mi', 'p',
-                                                  'low_counts',
-                                                  'high_counts']])
-        gene_opt['counts'] = gene_opt.high_counts + gene_opt.low_counts
+    return flags
 
-        if gene_opt.srt_off != 0 or gene_opt.end_off != 0:
-            if abs(gene_opt.mi_at_tx - gene_opt.log2_mi) > delta_mi_thr:
-                opt_list.append(gene_opt)
 
-    optimized_mi = pd.concat(opt_list, axis=1).T
+def _optimized_windows(flags: pd.DataFrame, opt: pd.DataFrame,
+                       delta_mi_thr: float) -> pd.DataFrame:
+    '''Joins the flags created by '_flags_at_tx' with the optimized points
+    in 'opt' (one or more per gene) in the order of the flags. Keeps points
+    not at tx whose log2 MI differs more than 'delta_mi_thr' from the one at
+    tx. Returns dataframe indexed by gene name.
+    '''
+
+    # Flags repeated for every point of their gene, in the order of the flags
+    # and of the points within each gene
+    flag_order = pd.Series(np.arange(len(flags)),
+                           index=flags.index)[opt.gene_name]
+    order = np.argsort(flag_order.to_numpy(), kind='stable')
+    opt = opt.iloc[order].reset_index(drop=True)
+    optimized_mi = pd.concat([flags.loc[opt.gene_name]
+                              .reset_index(drop=True), opt], axis=1)
+    optimized_mi.index = opt.gene_name.to_numpy()
+    optimized_mi['counts'] = (optimized_mi.high_counts.astype(np.int64)
+                              + optimized_mi.low_counts)
+
+    keep = (((optimized_mi.srt_off != 0) | (optimized_mi.end_off != 0))
+            & (abs(optimized_mi.mi_at_tx - optimized_mi.log2_mi)
+               > delta_mi_thr))
+
+    return optimized_mi[keep]
+
+
+class NoOptimizedGenes(ValueError):
+    '''Raised when no flagged gene has an optimized point left.'''
+
+
+class OptimizationFeatures:
+    '''Normalized log2 MI, p-value, insertions and offset (see
+    'sort_optimized_mi') of all in gene points with a p-value lower than
+    'p_thr' of the flagged genes of a screen. They are computed once, so
+    scoring all points under new weights is a single matrix-vector product
+    followed by a per gene argmax, eg. for weight sliders:
+
+    features = OptimizationFeatures(flagged, grouped_sweep)
+    optimized_mi = features.optimize(weight_mi=2, weight_p=1)
+    optimized_mi = features.optimize(weight_mi=1, weight_p=2, weight_ins=1)
+    '''
+
+    _point_columns = ['gene_name', 'srt_off', 'end_off', 'log2_mi', 'p',
+                      'low_counts', 'high_counts']
+
+    def __init__(self, flagged: pd.DataFrame,
+                 grouped_sweep: pd.core.groupby.generic.DataFrameGroupBy,
+                 p_thr: Optional[float] = 1e-5) -> None:
+
+        sweep = grouped_sweep.obj
+        opt = _optimization_features(sweep, p_thr, flagged.gene.to_numpy())
+
+        self.p_thr = p_thr
+        self.flags = _flags_at_tx(flagged, sweep)
+        self.points = opt[self._point_columns]
+        self.squared = opt[_optimization_columns].to_numpy()**2
+
+        # Position of each point in a dense (genes x points) grid, points of
+        # a gene in sweep order
+        gene_idx = pd.factorize(opt.gene_name)[0]
+        order = np.argsort(gene_idx, kind='stable')
+        n_points = np.bincount(gene_idx)
+        col = (np.arange(len(order))
+               - np.repeat(np.cumsum(n_points) - n_points, n_points))
+        self._grid = (gene_idx[order], col)
+        self._order = order
+        self._grid_points = np.zeros((len(n_points), n_points.max(initial=0)),
+                                     dtype=np.int64)
+        self._grid_points[self._grid] = order
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def scores(self, weight_mi: Optional[float] = 2,
+               weight_p: Optional[float] = 1,
+               weight_ins: Optional[float] = 0,
+               weight_off: Optional[float] = 0) -> np.ndarray:
+        '''Score of every point for the given weights.'''
+
+        return _optimization_score(self.squared, (weight_mi, weight_p,
+                                                  weight_ins, weight_off))
+
+    def _score_grid(self, weights: Tuple) -> np.ndarray:
+        '''Dense (genes x points) scores, padded with -inf. NaN scores are
+        ranked below all others but above padding.
+        '''
+
+        scores = np.full(self._grid_points.shape, -np.inf)
+        scores[self._grid] = np.nan_to_num(self.scores(*weights)[self._order],
+                                           nan=-np.finfo(np.float64).max)
+
+        return scores
+
+    def top_windows(self, k: Optional[int] = 3,
+                    min_distance: Optional[int] = None,
+                    delta_mi_thr: Optional[float] = 0,
+                    weight_mi: Optional[float] = 2,
+                    weight_p: Optional[float] = 1,
+                    weight_ins: Optional[float] = 0,
+                    weight_off: Optional[float] = 0) -> pd.DataFrame:
+        '''See 'top_optimized_windows'.'''
+
+        scores = self._score_grid((weight_mi, weight_p, weight_ins,
+                                   weight_off))
+
+        k = min(k, scores.shape[1])
+        if not k:
+            top = np.zeros((len(scores), 0), dtype=np.int64)
+            top_scores = np.zeros((len(scores), 0))
+        elif not min_distance:
+            # Partial selection of the k best points, then only those are
+            # sorted (earlier points first if tied)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(
+                top, np.lexsort((top,
+                                 -np.take_along_axis(scores, top, axis=1))),
+                axis=1)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+        else:
+            # Non-maximum suppression: take the best point left in each gene
+            # and remove the points around it, k times
+            srt_off = np.take(self.points.srt_off.to_numpy(),
+                              self._grid_points)
+            end_off = np.take(self.points.end_off.to_numpy(),
+                              self._grid_points)
+            genes = np.arange(len(scores))
+            top = np.zeros((len(scores), k), dtype=np.int64)
+            top_scores = np.zeros((len(scores), k))
+            for rank in range(k):
+                best = np.argmax(scores, axis=1)
+                top[:, rank] = best
+                top_scores[:, rank] = scores[genes, best]
+                near = ((np.abs(srt_off - srt_off[genes, best][:, None])
+                         <= min_distance)
+                        & (np.abs(end_off - end_off[genes, best][:, None])
+                           <= min_distance))
+                scores[near] = -np.inf
+
+        # Points in gene order and by rank, without padding
+        found = top_scores > -np.inf
+        selected = np.take_along_axis(self._grid_points, top, axis=1)[found]
+        windows = self.points.iloc[selected]
+        windows['rank'] = np.nonzero(found)[1] + 1
+        windows['score'] = self.scores(weight_mi, weight_p, weight_ins,
+                                       weight_off)[selected]
+
+        optimized_mi = _optimized_windows(self.flags, windows, delta_mi_thr)
+        if optimized_mi.empty:
+            raise NoOptimizedGenes('No optimized genes left.')
+        optimized_mi = optimized_mi[[x for x in optimized_mi.columns
+                                     if x not in ['rank', 'score']]
+                                    + ['rank', 'score']]
+        optimized_mi.index = pd.factorize(optimized_mi.index)[0]
+
+        return optimized_mi
+
+    def optimize(self, delta_mi_thr: Optional[float] = 0,
+                 weight_mi: Optional[float] = 2,
+                 weight_p: Optional[float] = 1,
+                 weight_ins: Optional[float] = 0,
+                 weight_off: Optional[float] = 0) -> pd.DataFrame:
+        '''See 'optimize_flagged_genes'.'''
+
+        # Best point of each gene: first point reaching its maximum score
+        optimized_mi = self.top_windows(1, None, delta_mi_thr, weight_mi,
+                                        weight_p, weight_ins, weight_off)
+
+        return optimized_mi.drop(columns=['rank', 'score']).reset_index(
+            drop=True)
+
+
+def optimize_flagged_genes(flagged, grouped_sweep, delta_mi_thr=0,
+                           p_thr=1e-5, weight_mi=2, weight_p=1,
+                           weight_ins=0, weight_off=0):
+    '''Given flagged genes (see 'flag_by_slope') and the grouped_sweep they
+    were flagged in, finds the point of each gene with the highest score
+    (see 'sort_optimized_mi'). All in gene, significant points of all
+    flagged genes are scored at once and the best one of each gene is
+    picked without sorting. Use 'OptimizationFeatures' to score the same
+    flags under several weights.
+
+    Returns dataframe with the flags, the counts at tx start and end and
+    the optimized point of genes where it is not at tx and its log2 MI
+    differs more than 'delta_mi_thr' from the one at tx. Raises
+    NoOptimizedGenes (a ValueError) if no gene is left. See
+    'top_optimized_windows' for more than one point per gene.
+    '''
+
+    features = OptimizationFeatures(flagged, grouped_sweep, p_thr)
+
+    return features.optimize(delta_mi_thr, weight_mi, weight_p, weight_ins,
+                             weight_off)
+
+
+def top_optimized_windows(flagged, grouped_sweep, k=3, min_distance=None,
+                          delta_mi_thr=0, p_thr=1e-5, weight_mi=2,
+                          weight_p=1, weight_ins=0, weight_off=0):
+    '''Same as 'optimize_flagged_genes', but keeps the 'k' points (start and
+    end offsets) of each gene with the highest score instead of only the
+    best one. If 'min_distance' is given, points whose start and end offsets
+    are both within 'min_distance' bp of a better point of the same gene
+    are skipped, so neighboring grid points are not reported as separate
+    optima, eg. min_distance=500 with a 500 bp sweep step.
+
+    Returns long dataframe with one row per gene and point, ranked by
+    'rank' (1 is the best) and with their 'score'. Rows are indexed by gene
+    number, so 'OptimizedPlot' draws all points of a gene at the same
+    position. Eg.:
+        gene_name   srt_off   end_off   log2_mi   ...   rank   score
+    0   CD274       1500      -500      -3.2      ...   1      0.51
+    0   CD274       0         -6000     -2.9      ...   2      0.44
+    '''
+
+    features = OptimizationFeatures(flagged, grouped_sweep, p_thr)
 
-    return optimized_mi
+    return features.top_windows(k, min_distance, delta_mi_thr, weight_mi,
+                                weight_p, weight_ins, weight_off)
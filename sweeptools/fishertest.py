@@ -0,0 +1,419 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
+from scipy.stats import fisher_exact
+from typing import Optional, Tuple
+
+from .utils import atomic_write
+
+# Log factorials are looked up in a table grown up to this size, larger
+# values are computed with gammaln
+_log_factorial_max = 1 << 23
+_log_factorial_table = np.zeros(1)
+
+# Tables whose hypergeometric support is larger than this are tested with
+# scipy.stats.fisher_exact
+_support_max = 1 << 20
+
+# Tables further than this many standard deviations of the hypergeometric
+# distribution beyond the observed table (or its mirror image around the
+# mode) are left out of the sums, their probabilities are below 1e-20 of it
+_support_sd = 10
+
+# Number of support points summed at a time
+_chunk_size = 1 << 22
+
+# Columns of the on-disk tier of 'FisherCache'
+_cache_columns = ['low', 'high', 'low_total', 'high_total']
+
+# Probabilities within this distance in log space of the probability of the
+# observed table count as equally likely (scipy uses a relative tolerance of
+# 1e-14 on probabilities, log factorials carry errors around 1e-8)
+_log_tolerance = 1e-7
+
+
+def log_factorial(n: np.ndarray) -> np.ndarray:
+    '''Returns log(n!) for an array of non-negative integers, from a table
+    of log factorials extended as needed.
+    '''
+    global _log_factorial_table
+
+    n = np.asarray(n, dtype=np.int64)
+    n_max = n.max(initial=0)
+    if n_max >= _log_factorial_max:
+        return gammaln(n + 1.)
+
+    if n_max >= len(_log_factorial_table):
+        size = min(max(2 * len(_log_factorial_table), n_max + 1),
+                   _log_factorial_max)
+        _log_factorial_table = gammaln(np.arange(size) + 1.)
+
+    return _log_factorial_table[n]
+
+
+def _unique_tables(a: np.ndarray, b: np.ndarray, c: np.ndarray,
+                   d: np.ndarray):
+    '''Returns distinct tables as (m x 4) array and the index of the
+    distinct table of every input table.
+    '''
+
+    cols = [a.ravel(), b.ravel(), c.ravel(), d.ravel()]
+    mins = [int(x.min()) for x in cols]
+    ranges = [int(x.max()) - x_min + 1 for x, x_min in zip(cols, mins)]
+
+    if np.prod([float(x) for x in ranges]) < 2.0**62:
+        # Encode each table as a single integer
+        key = np.zeros(len(cols[0]), dtype=np.int64)
+        for col, x_min, size in zip(cols, mins, ranges):
+            key = key * size + (col - x_min)
+        key, first, inverse = np.unique(key, return_index=True,
+                                        return_inverse=True)
+        tables = np.stack([x[first] for x in cols], axis=1)
+    else:
+        tables, inverse = np.unique(np.stack(cols, axis=1), axis=0,
+                                    return_inverse=True)
+
+    return tables, inverse.ravel()
+
+
+def _fisher_tables(tables: np.ndarray) -> np.ndarray:
+    '''Two-sided p-values of distinct tables [[a, b], [c, d]] given as rows
+    (a, b, c, d).
+    '''
+
+    a, b, c, d = tables.T
+    n = a + b
+    k = a + c
+    total = n + c + d
+
+    # Tables with the same margins, x being the top left count. Far from
+    # the observed table and the mode their probabilities are negligible
+    mode = (n + 1) * (k + 1) // (total + 2)
+    n_f, k_f, total_f = n.astype(float), k.astype(float), total.astype(float)
+    sd = np.sqrt(n_f * k_f * (total_f - k_f) * (total_f - n_f)
+                 / np.maximum(total_f ** 2 * (total_f - 1), 1))
+    half = np.abs(a - mode) + np.ceil(_support_sd * sd).astype(np.int64) + 10
+    lo = np.maximum(np.maximum(0, n + k - total), mode - half)
+    hi = np.minimum(np.minimum(n, k), mode + half)
+    support = hi - lo + 1
+
+    # Probability of the observed table
+    log_obs = (log_factorial(a) + log_factorial(b) + log_factorial(c)
+               + log_factorial(d))
+    log_p_obs = (log_factorial(k) + log_factorial(total - k)
+                 + log_factorial(n) + log_factorial(total - n)
+                 - log_factorial(total) - log_obs)
+
+    p = np.ones(len(tables))
+
+    large = np.flatnonzero(support > _support_max)
+    for i in large:
+        p[i] = fisher_exact(tables[i].reshape(2, 2),
+                            alternative='two-sided')[1]
+
+    small = np.flatnonzero(support <= _support_max)
+    chunk = (np.cumsum(support[small]) - 1) // _chunk_size
+    for rows in np.split(small, np.flatnonzero(np.diff(chunk)) + 1):
+        if not len(rows):
+            continue
+
+        # Log of the probability of every table relative to the observed one
+        rep = np.repeat(np.arange(len(rows)), support[rows])
+        offsets = np.cumsum(support[rows]) - support[rows]
+        x = lo[rows][rep] + np.arange(len(rep)) - offsets[rep]
+        log_ratio = log_obs[rows][rep] - (
+            log_factorial(x) + log_factorial(n[rows][rep] - x)
+            + log_factorial(k[rows][rep] - x)
+            + log_factorial((d - a)[rows][rep] + x))
+
+        ratio = np.where(log_ratio <= _log_tolerance,
+                         np.exp(np.minimum(log_ratio, 0)), 0)
+        p[rows] = (np.exp(log_p_obs[rows])
+                   * np.bincount(rep, weights=ratio, minlength=len(rows)))
+
+    return np.minimum(p, 1)
+
+
+def _key_hash(keys: np.ndarray) -> np.ndarray:
+    '''Returns 64 bit hash of each row of an (m x 4) array of keys.'''
+
+    h = np.full(len(keys), 0xcbf29ce484222325, dtype=np.uint64)
+    for col in keys.T.astype(np.uint64):
+        h = (h ^ col) * np.uint64(0x100000001b3)
+        h ^= h >> np.uint64(29)
+
+    return h.view(np.int64)
+
+
+class _KeyTable:
+    '''P-values of (m x 4) keys, looked up by the hash of each key (see
+    '_key_hash'). Keys whose hash is already in the table are not added, so
+    a hash collision only causes a miss.
+    '''
+
+    def __init__(self, keys: Optional[np.ndarray] = None,
+                 p: Optional[np.ndarray] = None):
+        self.keys = (np.empty((0, len(_cache_columns)), dtype=np.int64)
+                     if keys is None else keys)
+        self.p = np.empty(0) if p is None else p
+        hashes = _key_hash(self.keys)
+        first = np.unique(hashes, return_index=True)[1]
+        if len(first) < len(hashes):
+            self.keys, self.p, hashes = (self.keys[first], self.p[first],
+                                         hashes[first])
+        self._index = pd.Index(hashes)
+
+    def __len__(self) -> int:
+        return len(self.p)
+
+    def find(self, keys: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+        '''Returns position of each key in the table, -1 if missing.'''
+
+        pos = self._index.get_indexer(hashes)
+        found = np.flatnonzero(pos >= 0)
+        same = (self.keys[pos[found]] == keys[found]).all(axis=1)
+        pos[found[~same]] = -1
+
+        return pos
+
+    def add(self, keys: np.ndarray, p: np.ndarray,
+            hashes: np.ndarray) -> np.ndarray:
+        '''Appends keys not in the table, returns their positions.'''
+
+        first = np.unique(hashes, return_index=True)[1]
+        new = first[~pd.Index(hashes[first]).isin(self._index)]
+        self.keys = np.concatenate([self.keys, keys[new]])
+        self.p = np.concatenate([self.p, p[new]])
+        self._index = self._index.append(pd.Index(hashes[new]))
+
+        return np.arange(len(self.p) - len(new), len(self.p))
+
+    def take(self, rows: np.ndarray) -> None:
+        '''Keeps only the entries at positions 'rows'.'''
+        self.keys, self.p = self.keys[rows], self.p[rows]
+        self._index = self._index[rows]
+
+
+class FisherCache:
+    '''Cache of two-sided Fisher p-values keyed by the content of each table
+    [[low, high], [low_total - low, high_total - high]], ie. by (low, high,
+    low_total, high_total). Passed to 'fisher_exact_batch', so tables
+    already tested with the same cache (or stored on disk) are not tested
+    again.
+
+    Keeps up to 'maxsize' p-values in memory, evicting the least recently
+    used. If 'path' is given (eg. one file per screen, see
+    'screen_fisher_cache'), p-values saved there by 'save' are used as a
+    second tier. Keys are looked up as arrays, by hash.
+
+    'stats' returns the number of hits in memory and on disk and of misses.
+    '''
+
+    def __init__(self, maxsize: int = 200000, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self._memory = _KeyTable()
+        self._used = np.empty(0, dtype=np.int64)
+        self._tick = 0
+        self._disk = None
+        self._new = []
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _read_disk(self) -> _KeyTable:
+        if self._disk is None:
+            if self.path is not None and os.path.exists(self.path):
+                disk = pd.read_parquet(self.path, engine='pyarrow')
+                self._disk = _KeyTable(
+                    disk[_cache_columns].to_numpy(dtype=np.int64),
+                    disk['p'].to_numpy(dtype=np.float64))
+            else:
+                self._disk = _KeyTable()
+        return self._disk
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''Returns cached p-values of (m x 4) array of (low, high, low_total,
+        high_total) keys (NaN if missing) and boolean array of the missing
+        keys.
+        '''
+
+        keys = np.asarray(keys, dtype=np.int64)
+        hashes = _key_hash(keys)
+        self._tick += 1
+
+        p = np.full(len(keys), np.nan)
+        pos = self._memory.find(keys, hashes)
+        in_memory = pos >= 0
+        p[in_memory] = self._memory.p[pos[in_memory]]
+        self._used[pos[in_memory]] = self._tick
+        self.hits += int(in_memory.sum())
+
+        if self.path is not None and not in_memory.all():
+            idx = np.flatnonzero(~in_memory)
+            disk = self._read_disk()
+            if len(disk):
+                pos = disk.find(keys[idx], hashes[idx])
+                on_disk = idx[pos >= 0]
+                p[on_disk] = disk.p[pos[pos >= 0]]
+                self.disk_hits += len(on_disk)
+                self._remember(keys[on_disk], p[on_disk], hashes[on_disk])
+
+        missing = np.isnan(p)
+        self.misses += int(missing.sum())
+
+        return p, missing
+
+    def _remember(self, keys: np.ndarray, p: np.ndarray,
+                  hashes: np.ndarray) -> None:
+        added = self._memory.add(keys, p, hashes)
+        self._used = np.concatenate([self._used,
+                                     np.full(len(added), self._tick)])
+        if len(self._memory) > self.maxsize:
+            # Keep the most recently used, in the order they were added
+            keep = np.sort(np.argsort(-self._used, kind='stable')
+                           [:self.maxsize])
+            self._memory.take(keep)
+            self._used = self._used[keep]
+
+    def store(self, keys: np.ndarray, p: np.ndarray) -> None:
+        '''Adds p-values of newly tested (low, high, low_total, high_total)
+        keys.
+        '''
+        keys = np.asarray(keys, dtype=np.int64)
+        self._remember(keys, p, _key_hash(keys))
+        if self.path is not None:
+            self._new.append((keys, p))
+
+    def save(self) -> None:
+        '''Adds the p-values tested since the cache was created or last
+        saved to the file at 'path'.
+        '''
+
+        if self.path is None or not self._new:
+            return
+
+        disk = self._read_disk()
+        disk = _KeyTable(
+            np.concatenate([disk.keys] + [x[0] for x in self._new]),
+            np.concatenate([disk.p] + [x[1] for x in self._new]))
+        table = pd.DataFrame(disk.keys, columns=_cache_columns)
+        table['p'] = disk.p
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        with atomic_write(self.path) as tmp:
+            table.to_parquet(tmp, engine='pyarrow', compression='snappy',
+                             index=False)
+        self._disk = disk
+        self._new = []
+
+    def stats(self) -> dict:
+        '''Returns cache statistics, eg.:
+        {'hits': 240112, 'disk_hits': 0, 'misses': 8814, 'size': 200000,
+         'hit_rate': 0.965}
+        '''
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'size': len(self._memory),
+                'hit_rate': ((self.hits + self.disk_hits) / lookups
+                             if lookups else None)}
+
+    def clear(self) -> None:
+        '''Empties the memory tier and resets the statistics.'''
+        self._memory = _KeyTable()
+        self._used = np.empty(0, dtype=np.int64)
+        self.hits = self.disk_hits = self.misses = 0
+
+
+def screen_fisher_cache(data_dir: str, params: dict,
+                        maxsize: Optional[int] = 200000) -> FisherCache:
+    '''Returns Fisher p-value cache with an on-disk tier stored next to the
+    insertion files of a screen, eg. 'data/PDL1_IFNg/hg38/50/
+    fisher-cache.parquet'. Call 'save' on it to keep new p-values.
+    '''
+
+    path = (f'''{data_dir}/{params['screen_name']}/'''
+            f'''{params['assembly']}/{params['trim_length']}/'''
+            f'''fisher-cache.parquet''')
+
+    return FisherCache(maxsize=maxsize, path=path)
+
+
+def fisher_exact_batch(a: np.ndarray, b: np.ndarray, c: np.ndarray,
+                       d: np.ndarray,
+                       cache: Optional[FisherCache] = None) -> \
+        np.ndarray:
+    '''Returns two-sided p-values of Fisher's exact test for the 2x2 tables
+    [[a, b], [c, d]], as scipy.stats.fisher_exact does for each of them.
+    Arguments are arrays (or scalars) of non-negative counts of the same
+    shape. Each distinct table is tested once, by summing the probabilities
+    of all tables with the same margins that are no more likely, computed
+    from a table of log factorials.
+
+    If a 'cache' is given (see 'FisherCache'), tables found in it are not
+    tested again and new ones are added to it.
+
+    Eg. p-values of genes against the totals of each channel:
+    fisher_exact_batch(low, high, low_total - low, high_total - high)
+    '''
+
+    a, b, c, d = np.broadcast_arrays(*(np.asarray(x, dtype=np.int64)
+                                       for x in (a, b, c, d)))
+    if (a < 0).any() or (b < 0).any() or (c < 0).any() or (d < 0).any():
+        raise ValueError('All values of the tables must be nonnegative.')
+    if not a.size:
+        return np.zeros(a.shape)
+
+    tables, inverse = _unique_tables(a, b, c, d)
+
+    if cache is None:
+        p = _fisher_tables(tables)
+    else:
+        ta, tb, tc, td = tables.T
+        keys = np.stack([ta, tb, ta + tc, tb + td], axis=1)
+        p, missing = cache.lookup(keys)
+        if missing.any():
+            p[missing] = _fisher_tables(tables[missing])
+            cache.store(keys[missing], p[missing])
+
+    return p[inverse].reshape(a.shape)
+
+
+def bh_fdr(p: np.ndarray, group: Optional[np.ndarray] = None,
+           monotone: Optional[bool] = False) -> np.ndarray:
+    '''Returns Benjamini-Hochberg adjusted p-values, computed separately
+    for each value of 'group' (eg. each sweep point). NaNs are ignored.
+
+    By default returns p * n / rank of p, as 'screen-analyzer' does, which
+    may exceed 1. Ties are ranked in the order they appear. With
+    'monotone', takes the cumulative minimum from the largest p-value down
+    and caps the result at 1, as in the usual definition.
+    '''
+
+    p = np.asarray(p, dtype=np.float64)
+    group = (np.zeros(p.shape, dtype=np.int64) if group is None
+             else np.asarray(group))
+
+    idx = np.flatnonzero(~np.isnan(p.ravel()))
+    p_valid = p.ravel()[idx]
+    group_valid = group.ravel()[idx]
+    order = np.lexsort((p_valid, group_valid))
+
+    sorted_group = group_valid[order]
+    starts = np.flatnonzero(np.r_[True, sorted_group[1:]
+                                  != sorted_group[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, sizes) + 1
+    p_fdr = p_valid[order] * np.repeat(sizes, sizes) / rank
+
+    if monotone:
+        p_fdr = (pd.Series(p_fdr[::-1]).groupby(sorted_group[::-1])
+                 .cummin().to_numpy()[::-1])
+        p_fdr = np.minimum(p_fdr, 1)
+
+    out = np.full(p.size, np.nan)
+    out[idx[order]] = p_fdr
+
+    return out.reshape(p.shape)
@@ -0,0 +1,300 @@
+import numpy as np
+import pandas as pd
+from typing import Optional, Tuple
+
+from .analyzeinsertions import _insertion_index, _chr_names
+from .fishertest import fisher_exact_batch, bh_fdr, FisherCache
+from .runsweep import sweep_grid
+from .utils import timer
+
+# Channels and strands of the count tracks of the insertion index, see
+# 'write_insertion_index'
+_channels = ['high', 'low']
+_strands = ['+', '-']
+
+
+def gene_regions(refseq: pd.DataFrame,
+                 mode: Optional[str] = 'collapse') -> pd.DataFrame:
+    '''Returns transcribed region of every gene in 'refseq' (see
+    'read_refseq') as used by 'screen-analyzer analyze', sorted by gene:
+    gene_name	chrom	strand	tx_start	tx_end
+    A1BG	    chr19	-	    58345182	58353492
+
+    mode: 'collapse' spans all transcripts of a gene, 'longest' takes its
+          longest transcript. Genes with transcripts in more than one
+          chromosome or strand keep those of their first transcript.
+    '''
+
+    if mode not in ('collapse', 'longest'):
+        raise ValueError(f'Mode {mode!r} is not supported, use "collapse" '
+                         f'or "longest"')
+
+    tx = refseq[['name2', 'chrom', 'strand', 'txStart', 'txEnd']]
+    tx = tx.sort_values(by='name2', kind='mergesort')
+
+    first = tx.groupby('name2', sort=False)[['chrom', 'strand']] \
+        .transform('first')
+    tx = tx[(tx['chrom'] == first['chrom'])
+            & (tx['strand'] == first['strand'])]
+
+    if mode == 'collapse':
+        regions = tx.groupby('name2', sort=True).agg(
+            chrom=('chrom', 'first'), strand=('strand', 'first'),
+            tx_start=('txStart', 'min'), tx_end=('txEnd', 'max'))
+    else:
+        longest = (tx['txEnd'] - tx['txStart']).groupby(tx['name2']) \
+            .idxmax()
+        regions = tx.loc[longest.to_numpy()].set_index('name2').rename(
+            columns={'txStart': 'tx_start', 'txEnd': 'tx_end'})
+
+    regions = regions.rename_axis('gene_name').reset_index()
+
+    return regions[['gene_name', 'chrom', 'strand', 'tx_start', 'tx_end']]
+
+
+def _genome_tracks(index: dict) -> dict:
+    '''Returns sorted positions of the insertions of each channel and strand
+    of the insertion index, keyed by (channel, strand) index. Positions are
+    made unique across the genome as chromosome index * 2**32 + position.
+    '''
+
+    n_tracks = len(_channels) * len(_strands)
+    offsets = np.asarray(index['track_offsets'])
+    track_pos = np.asarray(index['track_pos'], dtype=np.int64)
+
+    tracks = dict()
+    for k in range(n_tracks):
+        starts = offsets[k:-1:n_tracks]
+        ends = offsets[k + 1::n_tracks]
+        chr_idx = np.repeat(np.arange(len(starts), dtype=np.int64),
+                            ends - starts)
+        pos = np.concatenate([track_pos[s:e] for s, e in zip(starts, ends)])
+        tracks[divmod(k, len(_strands))] = (chr_idx << 32) + pos
+
+    return tracks
+
+
+def _gene_cumcounts(tracks: dict, strand_idx: np.ndarray, key: np.ndarray,
+                    direction: str) -> np.ndarray:
+    '''Returns number of insertions of each channel (first axis) before
+    genome positions 'key' of genes on strands 'strand_idx' (first axis of
+    'key'), counting insertions in the given direction relative to the gene.
+    '''
+
+    if direction not in ('sense', 'antisense', 'both'):
+        raise ValueError(f'Direction {direction!r} is not supported, use '
+                         f'"sense", "antisense" or "both"')
+
+    cum = np.zeros((len(_channels),) + key.shape, dtype=np.int64)
+    for c in range(len(_channels)):
+        for s in range(len(_strands)):
+            for gene_strand in range(len(_strands)):
+                sense = s == gene_strand
+                if ((direction == 'sense' and not sense)
+                        or (direction == 'antisense' and sense)):
+                    continue
+                genes = strand_idx == gene_strand
+                cum[c, genes] += np.searchsorted(tracks[(c, s)], key[genes])
+
+    return cum
+
+
+def _region_bounds(regions: pd.DataFrame, srt_offs: np.ndarray,
+                   end_offs: np.ndarray) -> Tuple[np.ndarray, np.ndarray,
+                                                  np.ndarray]:
+    '''Returns genome position of the start (5') boundary of every gene at
+    every start offset and of the end (3') boundary at every end offset,
+    and whether each gene is on the minus strand. Regions are half-open,
+    from tx start + start offset to tx end + end offset, in the direction
+    of transcription.
+    '''
+
+    chr_idx = regions['chrom'].map({x: i for i, x in enumerate(_chr_names)})
+    chr_key = chr_idx.to_numpy(dtype=np.int64) << 32
+    minus = (regions['strand'] == '-').to_numpy()
+    tx_start = regions['tx_start'].to_numpy(dtype=np.int64)
+    tx_end = regions['tx_end'].to_numpy(dtype=np.int64)
+
+    five = np.where(minus, tx_end, tx_start)
+    three = np.where(minus, tx_start, tx_end)
+    sign = np.where(minus, -1, 1)
+
+    srt_bound = chr_key[:, None] + five[:, None] + sign[:, None] * srt_offs
+    end_bound = chr_key[:, None] + three[:, None] + sign[:, None] * end_offs
+
+    return srt_bound, end_bound, minus
+
+
+def sweep_counts(data_dir: str, params: dict, regions: pd.DataFrame,
+                 srt_offs: np.ndarray, end_offs: np.ndarray) -> \
+        Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Counts the low and high insertions of every gene in 'regions' (see
+    'gene_regions') at every combination of start and end offsets, using the
+    sorted insertion positions of the insertion index of the screen (see
+    'write_insertion_index'). Honors 'params['direction']' and
+    'params['overlap']': with 'both' insertions in regions shared by genes
+    count for all of them, with 'neither' for none of them.
+
+    Returns low counts, high counts and whether the region is not empty,
+    as (genes x start offsets x end offsets) arrays.
+    '''
+
+    index = _insertion_index(data_dir, params['screen_name'],
+                             params['assembly'], params['trim_length'])
+    tracks = _genome_tracks(index)
+
+    known_chr = regions['chrom'].isin(_chr_names).to_numpy()
+    regions = regions[known_chr]
+
+    srt_bound, end_bound, minus = _region_bounds(regions, srt_offs, end_offs)
+    strand_idx = minus.astype(np.int8)
+
+    # Positions covered: [5', 3') on plus and [3', 5') on minus strand
+    sign = np.where(minus, -1, 1)[:, None, None]
+    valid = sign * (end_bound[:, None, :] - srt_bound[:, :, None]) > 0
+
+    shape = (len(known_chr), len(srt_offs), len(end_offs))
+    counts = np.zeros((len(_channels),) + shape, dtype=np.int64)
+
+    if params['overlap'] == 'both':
+        # Counts are differences of cumulative counts at both boundaries
+        srt_cum = _gene_cumcounts(tracks, strand_idx, srt_bound,
+                                  params['direction'])
+        end_cum = _gene_cumcounts(tracks, strand_idx, end_bound,
+                                  params['direction'])
+        gene_counts = sign * (end_cum[:, :, None, :] - srt_cum[:, :, :, None])
+        counts[:, known_chr] = np.where(valid, gene_counts, 0)
+    elif params['overlap'] == 'neither':
+        gene_idx = np.arange(len(regions))
+        for i in range(len(srt_offs)):
+            for j in range(len(end_offs)):
+                counts[:, known_chr, i, j] = _exclusive_counts(
+                    tracks, strand_idx, gene_idx[valid[:, i, j]],
+                    srt_bound[:, i], end_bound[:, j], minus,
+                    params['direction'])
+    else:
+        raise ValueError(f'Overlap {params["overlap"]!r} is not supported, '
+                         f'use "both" or "neither"')
+
+    low = counts[_channels.index('low')]
+    high = counts[_channels.index('high')]
+    valid_all = np.zeros(shape, dtype=bool)
+    valid_all[known_chr] = valid
+
+    return low, high, valid_all
+
+
+def _exclusive_counts(tracks: dict, strand_idx: np.ndarray,
+                      genes: np.ndarray, srt_bound: np.ndarray,
+                      end_bound: np.ndarray, minus: np.ndarray,
+                      direction: str) -> np.ndarray:
+    '''Counts insertions of each channel in the parts of the regions of
+    'genes' not covered by the region of any other gene, for a single
+    sweep point.
+    '''
+
+    lo = np.where(minus, end_bound, srt_bound)[genes]
+    hi = np.where(minus, srt_bound, end_bound)[genes]
+
+    # Sweep over region boundaries: depth and sum of (gene + 1) of the
+    # regions covering each segment between consecutive boundaries
+    bounds = np.concatenate([lo, hi])
+    order = np.argsort(bounds, kind='stable')
+    bounds = bounds[order]
+    depth = np.cumsum(np.repeat([1, -1], len(genes))[order])
+    owner = np.cumsum(np.concatenate([genes + 1, -genes - 1])[order])
+
+    last = np.flatnonzero(bounds[1:] > bounds[:-1])
+    single = last[depth[last] == 1]
+    seg_owner = owner[single] - 1
+
+    seg_start = _gene_cumcounts(tracks, strand_idx[seg_owner],
+                                bounds[single], direction)
+    seg_end = _gene_cumcounts(tracks, strand_idx[seg_owner],
+                              bounds[single + 1], direction)
+
+    counts = np.zeros((len(_channels), len(minus)), dtype=np.int64)
+    for c in range(len(_channels)):
+        counts[c] = np.bincount(seg_owner, weights=seg_end[c] - seg_start[c],
+                                minlength=len(minus))
+
+    return counts
+
+
+@timer
+def native_sweep_data(data_dir: str, refseq: pd.DataFrame, params: dict,
+                      limit_into_gene: Optional[int] = 10000,
+                      limit_out_gene: Optional[int] = 2000,
+                      cache: Optional[FisherCache] = None) -> \
+        pd.DataFrame:
+    '''Computes the double sweep of start and end parameters with step
+    'params['step']' without running 'screen-analyzer analyze': insertions
+    of all genes at all sweep points are counted at once from the insertion
+    index of the screen, followed by the Fisher test, FDR and log2 MI.
+    Returns the same dataframe as 'get_sweep_data' (can be saved with
+    'write_sweep_data').
+
+    data_dir: directory with the insertion files of 'screen-analyzer map',
+              eg. 'data/screen-analyzer-data'
+    refseq: annotation from 'read_refseq'
+    params: as in 'get_sweep_data'. Supports modes 'collapse' and 'longest',
+            directions 'sense', 'antisense' and 'both' and overlaps 'both'
+            and 'neither'.
+    cache: optional Fisher p-values cache (see 'FisherCache'). Caches with
+           an on-disk tier (see 'screen_fisher_cache') are saved at the end
+
+    The mutational index is ((high + 1) / high total) / ((low + 1) / low
+    total), with the totals of all insertions in each channel. Sweep points
+    where the region of a gene is empty are left out.
+    '''
+
+    cells = sweep_grid(params['step'], limit_into_gene, limit_out_gene)
+    srt_offs = np.array(sorted({x[0] for x in cells}), dtype=np.int64)
+    end_offs = np.array(sorted({x[1] for x in cells}), dtype=np.int64)
+
+    regions = gene_regions(refseq, params['mode'])
+    low, high, valid = sweep_counts(data_dir, params, regions, srt_offs,
+                                    end_offs)
+
+    index = _insertion_index(data_dir, params['screen_name'],
+                             params['assembly'], params['trim_length'])
+    high_total = int((np.asarray(index['chan'])
+                      == _channels.index('high')).sum())
+    low_total = len(index['chan']) - high_total
+
+    gene_idx, srt_idx, end_idx = np.nonzero(valid)
+    low = low[valid]
+    high = high[valid]
+
+    # FDR over the genes of each sweep point
+    p = fisher_exact_batch(low, high, low_total - low, high_total - high,
+                           cache=cache)
+    if cache is not None:
+        cache.save()
+        stats = cache.stats()
+        print(f'Fisher p-value cache: {stats["hits"]} hits, '
+              f'{stats["disk_hits"]} on disk, {stats["misses"]} misses')
+    p_fdr = bh_fdr(p, group=srt_idx * len(end_offs) + end_idx)
+    log2_mi = np.log2(((high + 1) / high_total) / ((low + 1) / low_total))
+
+    sweep_data = pd.DataFrame({
+        'gene_name': regions['gene_name'].to_numpy()[gene_idx],
+        'low_counts': low,
+        'high_counts': high,
+        'p': p,
+        'p_fdr': p_fdr,
+        'log2_mi': log2_mi,
+        'srt_off': srt_offs[srt_idx],
+        'end_off': end_offs[end_idx]})
+
+    int_cols = ['low_counts', 'high_counts', 'srt_off', 'end_off']
+    sweep_data[int_cols] = (sweep_data[int_cols]
+                            .apply(lambda x:
+                                   pd.to_numeric(x, downcast='integer')))
+
+    float_cols = ['p', 'p_fdr', 'log2_mi']
+    sweep_data[float_cols] = (sweep_data[float_cols]
+                              .apply(lambda x:
+                                     pd.to_numeric(x, downcast='float')))
+
+    return sweep_data
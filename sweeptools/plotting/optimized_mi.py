@@ -24,7 +24,9 @@ class OptimizedPlot():
         self.mode = mode
 
         if not x_range:
-            self.genes = optimized_mi.gene_name
+            # Genes may have more than one optimized point (see
+            # 'top_optimized_windows')
+            self.genes = optimized_mi.gene_name.unique()
             max_x = min(len(self.genes) - 1, 30)
             x_range = Range1d(-0.5, max_x + 0.5,
                               bounds=(-0.5, len(self.genes) - 0.5),
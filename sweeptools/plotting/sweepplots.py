@@ -2,7 +2,6 @@ import pandas as pd
 
 from math import pi, ceil
 from numpy import interp
-from scipy import stats
 from matplotlib import cm, colors
 
 from bokeh.plotting import figure
@@ -14,9 +13,11 @@ from bokeh.layouts import row, column
 from bokeh.models.annotations import Title
 
 from ..analyzesweep import (read_analyzed_sweep, get_gene_info,
-                            get_flags_for_gene)
+                            get_flags_for_gene, LazyGroupedSweep,
+                            SweepCube)
 from ..analyzeinsertions import (get_exon_regions, read_gene_insertions,
-                                 get_gene_positions)
+                                 get_gene_positions, get_gene_exon_regions,
+                                 insertion_density)
 
 
 def remove_grid_and_ticks(plot):
@@ -33,7 +34,8 @@ def remove_grid_and_ticks(plot):
     plot.outline_line_color = None
 
 
-def plot_transcripts(gene, params, insertions, gene_pos=None):
+def plot_transcripts(gene, params, insertions, gene_pos=None,
+                     exon_regions=None, dens_bw=None):
 
     # if not isinstance(gene_pos, pd.DataFrame):
     #     print('Loading gene positions.')
@@ -42,7 +44,9 @@ def plot_transcripts(gene, params, insertions, gene_pos=None):
     padd = 2000
     insertions = read_gene_insertions(gene, insertions,
                                       gene_pos=gene_pos, padding=padd)
-    exons = get_exon_regions(gene_pos)
+    if exon_regions is None:
+        exon_regions = get_exon_regions(gene_pos)
+    exons = exon_regions
 
     # Plot setup --------------------------------------------------------------
     # region ------------------------------------------------------------------
@@ -196,8 +200,7 @@ def plot_transcripts(gene, params, insertions, gene_pos=None):
     factor = 3
     for name, group in insertions.groupby(['chan', 'dir']):
         if name[1] == 'sense':
-            dens = stats.gaussian_kde(group.xpos)
-            dens = dens.evaluate(x)
+            dens = insertion_density(group.xpos, x, bandwidth=dens_bw)
             dens_dict[name[0]] = factor*dens/max(dens)
             ins_count[name[0]] = group.shape[0]
 
@@ -230,7 +233,8 @@ def plot_sweep(gene, params, data_dir, grouped_sweep=None,
     if plot_flags is None:
         plot_flags = 1
 
-    if not isinstance(grouped_sweep, pd.core.groupby.generic.DataFrameGroupBy):
+    if not isinstance(grouped_sweep, (pd.core.groupby.generic.DataFrameGroupBy,
+                                      LazyGroupedSweep, SweepCube)):
         print('Loading sweep data.')
         grouped_sweep = read_analyzed_sweep(data_dir, params)
 
@@ -471,7 +475,8 @@ def link_sweep_and_ins(gene, grouped_sweep, params, data_dir, insertions,
     sweep_layout, sweep_src, sweep_plt = plot_sweep(gene, params,
                                                     data_dir, grouped_sweep,
                                                     plot_flags=1)
-    ins = plot_transcripts(gene, params, insertions, gene_pos)
+    ins = plot_transcripts(gene, params, insertions, gene_pos,
+                           get_gene_exon_regions(gene, refseq))
 
     t = Title()
     t.text = ''
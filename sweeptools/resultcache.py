@@ -0,0 +1,183 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Optional, Tuple
+
+from .analyzesweep import (sweep_path, read_analyzed_sweep, flag_by_slope,
+                           optimize_flagged_genes, NoOptimizedGenes)
+from .utils import atomic_write, parquet_fingerprint
+
+
+def code_checksum() -> str:
+    '''Returns a checksum of the source of all modules of sweeptools (not of
+    its plotting subpackage), so it changes with any code the cached
+    results may depend on.
+    '''
+
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sha1 = hashlib.sha1()
+    for name in sorted(x for x in os.listdir(package_dir)
+                       if x.endswith('.py')):
+        with open(f'{package_dir}/{name}', 'rb') as file:
+            sha1.update(name.encode() + b'\0' + file.read())
+
+    return sha1.hexdigest()[:16]
+
+
+def _hash(values: dict) -> str:
+    return hashlib.sha1(json.dumps(values, sort_keys=True,
+                                   default=str).encode()).hexdigest()[:16]
+
+
+def _frame_hash(df: pd.DataFrame) -> str:
+    '''Checksum of the content and column names of a dataframe.'''
+    sha1 = hashlib.sha1(json.dumps(list(map(str, df.columns))).encode())
+    sha1.update(pd.util.hash_pandas_object(df, index=False).to_numpy()
+                .tobytes())
+    return sha1.hexdigest()[:16]
+
+
+class ResultCache:
+    '''Results of 'flag_by_slope' and 'optimize_flagged_genes' for the
+    screens analyzed in 'sweep_data_dir' (see 'read_analyzed_sweep'), stored
+    as parquet files in 'cache_dir' with the same directory layout, eg.
+    'cache/PDL1_IFNg/hg38/50/mode=collapse_direction=sense_overlap=both/
+    double-sweep_step=500/flag_by_slope-3f2a9c01d4e5b6a7.parquet'.
+
+    Files are named after the arguments of each call (thresholds, weights
+    and flagged genes) and keyed on these together with the fingerprint of
+    the analyzed sweep file (see 'parquet_fingerprint') and the checksum of
+    the sweeptools modules (see 'code_checksum'). A stored result is
+    recomputed and replaced if the analyzed sweep or the code changed, so
+    reruns over many screens only compute what changed. Sweeps are only
+    read on a miss.
+
+    'stats' returns the number of hits, misses and replaced stale results.
+    '''
+
+    def __init__(self, cache_dir: str, sweep_data_dir: str):
+        self.cache_dir = cache_dir
+        self.sweep_data_dir = sweep_data_dir
+        self.code_version = code_checksum()
+        self._sweep = (None, None)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _sweep_file(self, params: dict) -> str:
+        return (f'{sweep_path(self.sweep_data_dir, params)}'
+                f'all_gene_info.parquet.snappy')
+
+    def grouped_sweep(self, params: dict) -> \
+            pd.core.groupby.generic.DataFrameGroupBy:
+        '''Returns grouped_sweep of a screen. The last one read is kept
+        until its file is rewritten (see 'parquet_fingerprint').
+        '''
+        sweep_file = self._sweep_file(params)
+        key = (sweep_file, parquet_fingerprint(sweep_file))
+        if self._sweep[0] != key:
+            self._sweep = (key, read_analyzed_sweep(self.sweep_data_dir,
+                                                    params))
+        return self._sweep[1]
+
+    def _entry(self, kind: str, params: dict, args: dict) -> Tuple[str, str,
+                                                                     dict]:
+        '''Returns file name, key and provenance of a result.'''
+
+        name = _hash({'kind': kind, 'params': params, 'args': args})
+        provenance = {'kind': kind, 'params': params, 'args': args,
+                      'sweep': parquet_fingerprint(self._sweep_file(params)),
+                      'code': self.code_version}
+        filename = f'{sweep_path(self.cache_dir, params)}{kind}-{name}.parquet'
+
+        return filename, _hash(provenance), provenance
+
+    def _read(self, filename: str, key: str) -> Optional[pd.DataFrame]:
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+
+        metadata = pq.read_schema(filename).metadata or {}
+        if metadata.get(b'result_key') != key.encode():
+            self.stale += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return pd.read_parquet(filename, engine='pyarrow')
+
+    def _write(self, filename: str, key: str, provenance: dict,
+               result: pd.DataFrame) -> None:
+        table = pa.Table.from_pandas(result, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b'result_key': key.encode(),
+            b'provenance': json.dumps(provenance, default=str).encode()})
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with atomic_write(filename) as tmp:
+            pq.write_table(table, tmp, compression='snappy')
+
+    def flag_by_slope(self, params: dict, p_thr: float,
+                      slope_thr: float) -> pd.DataFrame:
+        '''Cached 'flag_by_slope' of a screen.'''
+
+        filename, key, provenance = self._entry(
+            'flag_by_slope', params, {'p_thr': p_thr, 'slope_thr': slope_thr})
+
+        flagged = self._read(filename, key)
+        if flagged is not None:
+            print(f'Cached flags for screen {params["screen_name"]}: '
+                  f'{len(flagged)} flagged genes')
+            return flagged
+
+        flagged = flag_by_slope(self.grouped_sweep(params), p_thr, slope_thr)
+        self._write(filename, key, provenance, flagged)
+
+        return flagged
+
+    def optimize_flagged_genes(self, params: dict, flagged: pd.DataFrame,
+                               delta_mi_thr: Optional[float] = 0,
+                               p_thr: Optional[float] = 1e-5,
+                               weight_mi: Optional[float] = 2,
+                               weight_p: Optional[float] = 1,
+                               weight_ins: Optional[float] = 0,
+                               weight_off: Optional[float] = 0) -> \
+            pd.DataFrame:
+        '''Cached 'optimize_flagged_genes' of a screen. Raises
+        NoOptimizedGenes if no gene is left, also when the result is cached.
+        Other errors are raised without caching anything.
+        '''
+
+        filename, key, provenance = self._entry(
+            'optimize_flagged_genes', params,
+            {'flagged': _frame_hash(flagged), 'delta_mi_thr': delta_mi_thr,
+             'p_thr': p_thr, 'weight_mi': weight_mi, 'weight_p': weight_p,
+             'weight_ins': weight_ins, 'weight_off': weight_off})
+
+        optimized_mi = self._read(filename, key)
+        if optimized_mi is None:
+            try:
+                optimized_mi = optimize_flagged_genes(
+                    flagged, self.grouped_sweep(params), delta_mi_thr, p_thr,
+                    weight_mi, weight_p, weight_ins, weight_off)
+            except NoOptimizedGenes:
+                optimized_mi = pd.DataFrame()
+            self._write(filename, key, provenance, optimized_mi)
+
+        if optimized_mi.empty:
+            raise NoOptimizedGenes('No optimized genes left.')
+
+        return optimized_mi
+
+    def stats(self) -> dict:
+        '''Returns cache statistics, eg.:
+        {'hits': 298, 'misses': 4, 'stale': 2, 'hit_rate': 0.987}
+        '''
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': self.hits / lookups if lookups else None}
@@ -0,0 +1,360 @@
+import os
+import subprocess
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product
+from typing import List, Optional, Tuple
+
+from .analyzesweep import sweep_path, get_sweep_data
+from .utils import timer, atomic_write
+
+_manifest_columns = ['srt_off', 'end_off', 'status', 'exit_code', 'secs',
+                     'attempts', 'error']
+
+
+def sweep_grid(step: int, limit_into_gene: int,
+               limit_out_gene: int) -> List[Tuple[int, int]]:
+    '''Returns all (start offset, end offset) combinations of a double sweep,
+    same as the ranges used in 'double-sweep_screen-analyzer.py'.
+    '''
+
+    sweep_range_start = range(-limit_out_gene, limit_into_gene + 1, step)
+    sweep_range_end = range(limit_out_gene, -limit_into_gene - 1, -step)
+
+    return list(product(sweep_range_start, sweep_range_end))
+
+
+def cell_filename(srt_off: int, end_off: int) -> str:
+    '''Returns name of the output file of a sweep point, as read by
+    'get_sweep_data', eg. 'out_start=tx-500_end=tx+1000_.txt'.
+    '''
+    return f'out_start=tx{srt_off:+}_end=tx{end_off:+}_.txt'
+
+
+def analyze_command(analyzer: str, params: dict, srt_off: int, end_off: int,
+                    output: str) -> List[str]:
+    '''Returns arguments of a 'screen-analyzer analyze' call for one sweep
+    point.
+    '''
+
+    cmd = [analyzer, 'analyze', params['screen_name'],
+           '--assembly', params['assembly'],
+           '--output', output,
+           '--mode', params['mode'],
+           '--start', f'tx{srt_off:+}',
+           '--end', f'tx{end_off:+}',
+           '--overlap', params['overlap'],
+           '--direction', params['direction']]
+
+    return cmd
+
+
+def read_manifest(out_path: str) -> pd.DataFrame:
+    '''Reads manifest of a sweep directory (written by 'run_sweep_cells'),
+    with one row per sweep point:
+    srt_off	end_off	status	exit_code	secs	attempts	error
+    -2000	2000	done	0	        3581.2	1	        NaN
+    -2000	1500	failed	1	        12.4	3	        exit code 1
+    -2000	1000	failed	NaN	        0.01	3	        [Errno 2] No such...
+    '''
+
+    filename = f'{out_path}sweep-manifest.csv'
+    if os.path.exists(filename):
+        manifest = pd.read_csv(filename)
+        # Manifests written before errors were recorded
+        manifest = manifest.reindex(columns=_manifest_columns)
+    else:
+        manifest = pd.DataFrame(columns=_manifest_columns)
+
+    return manifest
+
+
+def _write_manifest(out_path: str, records: dict) -> None:
+
+    manifest = pd.DataFrame(list(records.values()), columns=_manifest_columns)
+    manifest = manifest.sort_values(by=['srt_off', 'end_off'],
+                                    ascending=[True, False])
+    with atomic_write(f'{out_path}sweep-manifest.csv') as tmp:
+        manifest.to_csv(tmp, index=False)
+
+
+def _run_cell(analyzer: str, params: dict, out_path: str, srt_off: int,
+              end_off: int, retries: int, retry_delay: float) -> dict:
+    '''Runs screen-analyzer for a single sweep point. Output is written to a
+    temporary file that is only renamed to its final name if screen-analyzer
+    exits without errors, so existing output files are always complete.
+    Failed attempts are retried after 'retry_delay' secs, doubled after
+    every attempt.
+    '''
+
+    out_file = f'{out_path}{cell_filename(srt_off, end_off)}'
+    tmp_file = f'{out_path}.{cell_filename(srt_off, end_off)}.tmp'
+    counts_file = (f'{out_path}counts_start=tx{srt_off:+}'
+                   f'_end=tx{end_off:+}_.txt')
+    cmd = analyze_command(analyzer, params, srt_off, end_off, tmp_file)
+
+    start_time = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        if attempt > 1:
+            time.sleep(retry_delay * 2**(attempt - 2))
+        # A missing analyzer or an output file that can't be opened is
+        # retried like a non-zero exit, without stopping the other cells
+        try:
+            with open(counts_file, 'w') as counts:
+                exit_code = subprocess.call(cmd, stdout=subprocess.DEVNULL,
+                                            stderr=counts)
+            error = None if exit_code == 0 else f'exit code {exit_code}'
+        except OSError as err:
+            exit_code, error = None, str(err)
+        success = exit_code == 0 and os.path.exists(tmp_file)
+        if success:
+            os.replace(tmp_file, out_file)
+            break
+        if exit_code == 0:
+            error = 'no output file'
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return {'srt_off': srt_off, 'end_off': end_off,
+            'status': 'done' if success else 'failed',
+            'exit_code': exit_code,
+            'secs': round(time.perf_counter() - start_time, 2),
+            'attempts': attempt,
+            'error': error}
+
+
+@timer
+def run_sweep_cells(cells: List[Tuple[int, int]], out_dir: str,
+                    params: dict,
+                    analyzer: Optional[str] = './screen-analyzer',
+                    workers: Optional[int] = 4,
+                    retries: Optional[int] = 2,
+                    retry_delay: Optional[float] = 10) -> pd.DataFrame:
+    '''Runs 'screen-analyzer analyze' for every (start offset, end offset)
+    in 'cells', at most 'workers' at a time. Output files are written to
+    the directory given by 'sweep_path(out_dir, params)', with the names
+    expected by 'get_sweep_data'.
+
+    Cells whose output file already exists are skipped. Failed cells,
+    including those where the analyzer can't be run, are retried up to
+    'retries' times while the other cells go on, waiting 'retry_delay' secs
+    before the first retry and twice as long before each next one, so
+    short outages (eg. of network storage) don't use up all retries. Wall
+    time, exit status, number of attempts and last error of each cell are
+    kept in 'sweep-manifest.csv' in the same directory, which is updated
+    after every finished cell.
+
+    Returns manifest as dataframe (see 'read_manifest').
+    '''
+
+    out_path = sweep_path(out_dir, params)
+    if not os.path.exists(out_path):
+        os.makedirs(out_path, exist_ok=True)
+        print('Creating analyzed directory.')
+
+    records = {(x.srt_off, x.end_off): x._asdict() for x in
+               read_manifest(out_path)[_manifest_columns]
+               .itertuples(index=False)}
+
+    pending = []
+    for srt_off, end_off in cells:
+        if os.path.exists(f'{out_path}{cell_filename(srt_off, end_off)}'):
+            records.setdefault((srt_off, end_off),
+                               {'srt_off': srt_off, 'end_off': end_off,
+                                'status': 'done', 'exit_code': 0,
+                                'secs': None, 'attempts': 0, 'error': None})
+        else:
+            pending.append((srt_off, end_off))
+
+    print(f'Running {len(pending)} of {len(cells)} sweep points for screen '
+          f'{params["screen_name"]} ({workers} at a time).')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_cell, analyzer, params, out_path,
+                                   srt_off, end_off, retries, retry_delay)
+                   for srt_off, end_off in pending]
+        for idx, future in enumerate(as_completed(futures)):
+            result = future.result()
+            print(f'Finished analysis {idx + 1} of {len(pending)}: '
+                  f'start tx{result["srt_off"]:+} - end '
+                  f'tx{result["end_off"]:+} - {result["status"]}'
+                  + (f' ({result["error"]})' if result['error'] else ''))
+            records[(result['srt_off'], result['end_off'])] = result
+            _write_manifest(out_path, records)
+
+    manifest = read_manifest(out_path)
+
+    failed = manifest.query('status == "failed"')
+    if not failed.empty:
+        print(f'-- Warning! {len(failed)} sweep points failed, run again to '
+              'retry them.')
+
+    return manifest
+
+
+def run_double_sweep(out_dir: str, params: dict,
+                     limit_into_gene: Optional[int] = 10000,
+                     limit_out_gene: Optional[int] = 2000,
+                     **kwargs) -> pd.DataFrame:
+    '''Runs the full double sweep of start and end parameters with step
+    'params['step']'. Keyword arguments are passed to 'run_sweep_cells'.
+    '''
+
+    cells = sweep_grid(params['step'], limit_into_gene, limit_out_gene)
+    manifest = run_sweep_cells(cells, out_dir, params, **kwargs)
+
+    return manifest
+
+
+def _block_corners(blocks: List[Tuple[int, int, int, int]]) -> set:
+    return {(i, j) for (i1, i2, j1, j2) in blocks
+            for i in (i1, i2) for j in (j1, j2)}
+
+
+def _split_block(block: Tuple[int, int, int, int]) -> \
+        List[Tuple[int, int, int, int]]:
+    '''Splits block (srt idx 1, srt idx 2, end idx 1, end idx 2) of the fine
+    grid in (up to) four halves.
+    '''
+
+    i1, i2, j1, j2 = block
+    srt_halves = ([(i1, (i1 + i2)//2), ((i1 + i2)//2, i2)] if i2 - i1 > 1
+                  else [(i1, i2)])
+    end_halves = ([(j1, (j1 + j2)//2), ((j1 + j2)//2, j2)] if j2 - j1 > 1
+                  else [(j1, j2)])
+
+    return [(a, b, c, d) for (a, b) in srt_halves for (c, d) in end_halves]
+
+
+def _flag_blocks(blocks: List[Tuple[int, int, int, int]], sweep: pd.DataFrame,
+                 srt_offs: np.ndarray, end_offs: np.ndarray, step: int,
+                 slope_thr: float, p_thr: float,
+                 blocks_per_gene: int) -> np.ndarray:
+    '''Returns boolean array with the blocks to refine: for each gene, the
+    'blocks_per_gene' blocks where its log2_mi changes most between two
+    corners, among those where it changes enough to possibly hold a flag
+    (see 'flags_query') in between.
+    '''
+
+    gene_idx, genes = pd.factorize(sweep['gene_name'])
+    shape = (len(genes), len(srt_offs), len(end_offs))
+    srt_idx = np.searchsorted(srt_offs, sweep['srt_off'].to_numpy())
+    end_idx = np.searchsorted(end_offs, sweep['end_off'].to_numpy())
+
+    mi = np.full(shape, np.nan, dtype=np.float32)
+    mi[gene_idx, srt_idx, end_idx] = sweep['log2_mi'].to_numpy()
+    p_fdr = np.full(shape, np.nan, dtype=np.float32)
+    p_fdr[gene_idx, srt_idx, end_idx] = sweep['p_fdr'].to_numpy()
+
+    i1, i2, j1, j2 = (np.array(x) for x in zip(*blocks))
+
+    # The whole change between two corners could happen within one step of
+    # the fine grid, so compare it with the slope threshold at that step.
+    # A flag also needs a significant point next to the step
+    delta_thr = slope_thr*step*0.001
+
+    delta = np.zeros((len(genes), len(blocks)), dtype=np.float32)
+    for (a_i, a_j), (b_i, b_j) in [((i1, j1), (i2, j1)), ((i1, j2), (i2, j2)),
+                                   ((i1, j1), (i1, j2)), ((i2, j1), (i2, j2))]:
+        delta_mi = np.abs(mi[:, b_i, b_j] - mi[:, a_i, a_j])
+        significant = np.fmin(p_fdr[:, a_i, a_j], p_fdr[:, b_i, b_j]) < p_thr
+        delta = np.fmax(delta, np.where(significant, delta_mi, 0))
+
+    # 'flag_by_slope' flags a gene by its largest slopes, so following the
+    # largest changes of each gene is enough
+    top = np.argsort(-delta, axis=1)[:, :blocks_per_gene]
+    candidate = np.take_along_axis(delta, top, axis=1) > delta_thr
+    flagged = np.zeros(len(blocks), dtype=bool)
+    flagged[top[candidate]] = True
+
+    return flagged
+
+
+@timer
+def run_adaptive_sweep(out_dir: str, params: dict,
+                       limit_into_gene: Optional[int] = 10000,
+                       limit_out_gene: Optional[int] = 2000,
+                       coarse_step: Optional[int] = 2000,
+                       slope_thr: Optional[float] = 1,
+                       p_thr: Optional[float] = 1e-5,
+                       blocks_per_gene: Optional[int] = 1,
+                       **kwargs) -> pd.DataFrame:
+    '''Runs a double sweep coarse to fine instead of running every point of
+    the grid with step 'params['step']':
+
+    1. Runs a coarse grid with step 'coarse_step' (plus the grid limits).
+    2. For each gene, finds the 'blocks_per_gene' blocks between
+       neighbouring grid points where log2_mi changes most between two
+       corners while being significant (p_fdr < 'p_thr'). Splits them in
+       four if that change is more than 'slope_thr' per 1,000 bp at the
+       fine step (thresholds as in 'flags_query'). Runs the new corners.
+    3. Repeats 2. on the new blocks until the fine step is reached.
+
+    Every point runs all genes, so refining wherever any gene changes runs
+    almost the whole grid on a real screen. A gene is flagged by any of its
+    slopes, so only its largest changes are followed. Its changes in other
+    blocks are only seen as the interpolated change between the block
+    corners. A larger 'blocks_per_gene' runs more points and misses fewer
+    flagged genes.
+
+    Experimental: the flagged genes are not guaranteed to match those of
+    the full grid. On 20,000 simulated genes (benchmarks/
+    bench_adaptive_sweep.py) it runs 487 of 625 points and finds 103 of 107
+    flagged genes with blocks_per_gene=1. Use 'run_double_sweep' for
+    screens.
+
+    All points lie on the fine grid and are written with the usual names and
+    layout, so 'get_sweep_data' reads the result as a sweep with step
+    'params['step']' in which points in flat regions are missing. Write it
+    with 'write_sweep_data(..., fill_grid=True)' to compute the slopes next
+    to them from interpolated log2_mi. Keyword arguments are passed to
+    'run_sweep_cells'.
+
+    Returns manifest as dataframe (see 'read_manifest').
+    '''
+
+    step = params['step']
+    if coarse_step % step:
+        raise ValueError('coarse_step must be a multiple of params["step"]')
+
+    srt_offs = np.arange(-limit_out_gene, limit_into_gene + 1, step)
+    end_offs = np.arange(-limit_into_gene, limit_out_gene + 1, step)
+
+    # Coarse grid in index units of the fine grid. Start offsets are counted
+    # from -limit_out_gene and end offsets from +limit_out_gene, same as in
+    # 'sweep_grid'
+    k = coarse_step // step
+    srt_coarse = sorted(set(range(0, len(srt_offs), k))
+                        | {len(srt_offs) - 1})
+    end_coarse = sorted({len(end_offs) - 1 - j for j in
+                         range(0, len(end_offs), k)} | {0})
+    blocks = [(a, b, c, d) for a, b in zip(srt_coarse[:-1], srt_coarse[1:])
+              for c, d in zip(end_coarse[:-1], end_coarse[1:])]
+
+    cells = _block_corners(blocks)
+    level = 1
+    while True:
+        print(f'\nAdaptive sweep level {level}: {len(cells)} points')
+        manifest = run_sweep_cells([(int(srt_offs[i]), int(end_offs[j]))
+                                    for i, j in sorted(cells)],
+                                   out_dir, params, **kwargs)
+
+        blocks = [x for x in blocks if x[1] - x[0] > 1 or x[3] - x[2] > 1]
+        if not blocks:
+            break
+
+        sweep = get_sweep_data(out_dir, params)
+        flagged = _flag_blocks(blocks, sweep, srt_offs, end_offs, step,
+                               slope_thr, p_thr, blocks_per_gene)
+        blocks = [sub for block, flag in zip(blocks, flagged) if flag
+                  for sub in _split_block(block)]
+        cells = _block_corners(blocks)
+        level += 1
+
+    n_done = (manifest.status == 'done').sum()
+    print(f'Adaptive sweep holds {n_done} of '
+          f'{len(srt_offs)*len(end_offs)} grid points.')
+
+    return manifest
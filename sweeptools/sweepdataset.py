@@ -0,0 +1,239 @@
+import os
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from urllib.parse import quote
+from typing import List, Optional
+
+from .analyzesweep import sweep_path, write_gene_sorted_parquet, tx_mask
+from .utils import timer, atomic_write, parquet_fingerprint
+
+# Partitions of the consolidated dataset, in directory order
+_partition_schema = pa.schema([('screen_name', pa.string()),
+                               ('assembly', pa.string()),
+                               ('trim_length', pa.string()),
+                               ('mode', pa.string()),
+                               ('direction', pa.string()),
+                               ('overlap', pa.string()),
+                               ('step', pa.int32())])
+_partition_cols = _partition_schema.names
+
+
+def partition_path(dataset_dir: str, params: dict) -> str:
+    '''Returns path of the directory holding the sweep of a screen in the
+    consolidated dataset created by 'consolidate_screens', eg.
+    'data/sweep-dataset/sweeps/screen_name=PDL1_IFNg/assembly=hg38/
+    trim_length=50/mode=collapse/direction=sense/overlap=both/step=500/'
+    '''
+    parts = '/'.join(f'{col}={quote(str(params[col]), safe="")}'
+                     for col in _partition_cols)
+
+    return f'{dataset_dir}/sweeps/{parts}/'
+
+
+def _partition_filter(params: Optional[dict]) -> Optional[ds.Expression]:
+    '''Dataset filter keeping the partitions given in 'params'. Partitions
+    missing from 'params' or set to None or '' are not filtered, so eg.
+    {'screen_name': '', 'assembly': 'hg38'} keeps all hg38 screens. Values
+    may also be lists.
+    '''
+    expr = None
+    for col in _partition_cols:
+        value = (params or {}).get(col)
+        if value is None or value == '':
+            continue
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        values = pa.array(list(values)).cast(_partition_schema.field(col).type)
+        cond = ds.field(col).isin(values)
+        expr = cond if expr is None else expr & cond
+
+    return expr
+
+
+def open_sweep_dataset(dataset_dir: str) -> ds.Dataset:
+    '''Opens the consolidated dataset created by 'consolidate_screens' as a
+    hive-partitioned pyarrow dataset.
+    '''
+    return ds.dataset(f'{dataset_dir}/sweeps', format='parquet',
+                      partitioning=ds.partitioning(_partition_schema,
+                                                   flavor='hive'))
+
+
+def _at_tx(sweep: pd.DataFrame, params: dict) -> pd.DataFrame:
+    at_tx = sweep[tx_mask(sweep)]
+    at_tx = at_tx[['gene_name'] + [col for col in at_tx.columns
+                                   if col != 'gene_name']]
+    for col in _partition_cols:
+        at_tx.insert(_partition_cols.index(col), col, params[col])
+
+    return at_tx.astype({col: ('int32' if col == 'step' else str)
+                         for col in _partition_cols})
+
+
+def _update_at_tx(dataset_dir: str, new_at_tx: List[pd.DataFrame]) -> None:
+    '''Replaces the tx start and end points of the screens in 'new_at_tx'
+    in 'at_tx.parquet'.
+    '''
+    at_tx_file = f'{dataset_dir}/at_tx.parquet'
+    new_at_tx = pd.concat(new_at_tx, ignore_index=True)
+
+    if os.path.exists(at_tx_file):
+        at_tx = pd.read_parquet(at_tx_file, engine='pyarrow')
+        replaced = (at_tx[_partition_cols].merge(
+            new_at_tx[_partition_cols].drop_duplicates(), how='left',
+            indicator=True)['_merge'] == 'both').to_numpy()
+        new_at_tx = pd.concat([at_tx[~replaced], new_at_tx],
+                              ignore_index=True)
+
+    new_at_tx = new_at_tx.sort_values(by=_partition_cols + ['gene_name'],
+                                      ignore_index=True)
+    with atomic_write(at_tx_file) as tmp:
+        new_at_tx.to_parquet(tmp, engine='pyarrow', compression='snappy',
+                             index=False)
+
+
+def _source_fingerprint(filename: str) -> Optional[str]:
+    '''Fingerprint of the analyzed sweep a partition file was copied from
+    (None for files written before it was kept).
+    '''
+    metadata = pq.read_schema(filename).metadata or {}
+    fingerprint = metadata.get(b'source_fingerprint')
+
+    return fingerprint.decode() if fingerprint is not None else None
+
+
+@timer
+def consolidate_screens(sweep_data_dir: str, dataset_dir: str, params: dict,
+                        screens: Optional[List[str]] = None,
+                        overwrite: Optional[bool] = False) -> pd.DataFrame:
+    '''Copies the analyzed sweeps written by 'write_sweep_data' for many
+    screens into a single dataset in 'dataset_dir', partitioned by
+    screen_name/assembly/trim_length/mode/direction/overlap/step. Files are
+    sorted by gene in row groups of whole genes, so queries for a gene skip
+    the rest of each file (see 'read_gene_across_screens').
+    The tx start and end points of all screens are also kept together in
+    'at_tx.parquet' (see 'read_at_tx').
+
+    'screens' defaults to all screens in 'sweep_data_dir'. The fingerprint
+    of the analyzed sweep of each screen (see 'parquet_fingerprint') is
+    kept in the metadata of its partition. Screens already in the dataset
+    are skipped unless their analyzed sweep changed or 'overwrite'.
+
+    Returns dataframe with one row per screen, eg.:
+    screen_name     status      secs    error
+    PDL1_IFNg       done        3.1     None
+    p-RPA           skipped     0.0     None
+    '''
+
+    if screens is None:
+        screens = sorted(x for x in os.listdir(sweep_data_dir)
+                         if os.path.isdir(f'{sweep_data_dir}/{x}'))
+
+    summary = []
+    new_at_tx = []
+    for idx, screen in enumerate(screens):
+        screen_params = {**params, 'screen_name': screen}
+        out_path = partition_path(dataset_dir, screen_params)
+        out_file = f'{out_path}part-0.parquet'
+
+        start_time = time.perf_counter()
+        try:
+            sweep_file = (f'{sweep_path(sweep_data_dir, screen_params)}'
+                          f'all_gene_info.parquet.snappy')
+            fingerprint = parquet_fingerprint(sweep_file)
+            exists = os.path.exists(out_file)
+            if (exists and not overwrite
+                    and _source_fingerprint(out_file) == fingerprint):
+                status, error = 'skipped', None
+            else:
+                if exists and not overwrite:
+                    print(f'Analyzed sweep of screen {screen} changed, '
+                          'replacing it.')
+                sweep = pd.read_parquet(sweep_file, engine='pyarrow')
+                sweep = sweep.reset_index()
+
+                os.makedirs(out_path, exist_ok=True)
+                with atomic_write(out_file) as tmp:
+                    write_gene_sorted_parquet(
+                        sweep, tmp,
+                        metadata={'source_fingerprint': fingerprint})
+                new_at_tx.append(_at_tx(sweep, screen_params))
+                status, error = 'done', None
+        except Exception as err:
+            status, error = 'failed', f'{type(err).__name__}: {err}'
+
+        print(f'{status.capitalize()} screen {screen} - '
+              f'{idx + 1} of {len(screens)}')
+        summary.append({'screen_name': screen, 'status': status,
+                        'secs': time.perf_counter() - start_time,
+                        'error': error})
+
+    if new_at_tx:
+        _update_at_tx(dataset_dir, new_at_tx)
+
+    summary = pd.DataFrame(summary, columns=['screen_name', 'status', 'secs',
+                                             'error'])
+
+    failed = summary.query('status == "failed"')
+    if not failed.empty:
+        print('-- Warning! The following screens failed:')
+        print('\n'.join(failed.screen_name))
+
+    return summary
+
+
+def read_gene_across_screens(dataset_dir: str, gene: str,
+                             params: Optional[dict] = None,
+                             columns: Optional[List[str]] = None) -> \
+        pd.DataFrame:
+    '''Reads all sweep points of 'gene' in every screen of the consolidated
+    dataset created by 'consolidate_screens'. Only the row group holding
+    the gene is read from each file.
+
+    params: dict of partitions to keep (see '_partition_filter'), eg.
+            {'screen_name': '', 'assembly': 'hg38', 'step': 500}
+    columns: sweep columns to read, eg. ['log2_mi', 'p']. Default: all
+
+    Returns long dataframe with partition columns followed by gene_name,
+    srt_off, end_off and the sweep columns.
+    '''
+    dataset = open_sweep_dataset(dataset_dir)
+
+    expr = ds.field('gene_name') == gene
+    partition_expr = _partition_filter(params)
+    if partition_expr is not None:
+        expr = expr & partition_expr
+
+    if columns is not None:
+        columns = (_partition_cols + ['gene_name', 'srt_off', 'end_off']
+                   + [c for c in columns if c not in
+                      _partition_cols + ['gene_name', 'srt_off', 'end_off']])
+
+    gene_sweep = dataset.to_table(columns=columns, filter=expr).to_pandas()
+    first = _partition_cols + ['gene_name', 'srt_off', 'end_off']
+    gene_sweep = gene_sweep[first + [c for c in gene_sweep.columns
+                                     if c not in first]]
+
+    return gene_sweep.sort_values(by=first, ignore_index=True)
+
+
+def read_at_tx(dataset_dir: str, params: Optional[dict] = None,
+               columns: Optional[List[str]] = None) -> pd.DataFrame:
+    '''Reads the point at tx start and tx end of every gene in every screen
+    of the consolidated dataset created by 'consolidate_screens', from a
+    single file.
+
+    params: dict of partitions to keep (see 'read_gene_across_screens')
+    columns: sweep columns to read, eg. ['log2_mi', 'p']. Default: all
+    '''
+    if columns is not None:
+        columns = (_partition_cols + ['gene_name']
+                   + [c for c in columns
+                      if c not in _partition_cols + ['gene_name']])
+
+    at_tx = ds.dataset(f'{dataset_dir}/at_tx.parquet', format='parquet')
+
+    return at_tx.to_table(columns=columns,
+                          filter=_partition_filter(params)).to_pandas()
@@ -1,5 +1,10 @@
 import functools
+import hashlib
+import os
 import time
+import uuid
+from contextlib import contextmanager
+
 
 def timer(func):
     '''Print the runtime of the decorated function'''
@@ -12,4 +17,49 @@ def timer(func):
         print(f'Finished {func.__name__!r} in {run_time:.2f} secs '
               f'({run_time/60:.2f} mins)')
         return value
-    return wrapper_timer
\ No newline at end of file
+    return wrapper_timer
+
+
+@contextmanager
+def atomic_write(filename: str):
+    '''Yields a temporary file name in the same directory as 'filename'.
+    The temporary file is renamed to 'filename' only if the block finishes
+    without errors, so an interrupted write never leaves a partial file.
+    '''
+    dirname, basename = os.path.split(filename)
+    tmp_name = os.path.join(dirname, f'.{basename}.{uuid.uuid4().hex}.tmp')
+    try:
+        yield tmp_name
+        os.replace(tmp_name, filename)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def file_checksum(filename: str) -> str:
+    '''Returns the first 16 hex digits of the sha1 checksum of a file.'''
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()[:16]
+
+
+def parquet_fingerprint(filename: str) -> str:
+    '''Returns a checksum of the size, modification time and footer (schema,
+    row group statistics and offsets) of a parquet file. It changes when the
+    file is rewritten, without reading its data.
+    '''
+
+    stat = os.stat(filename)
+    with open(filename, 'rb') as file:
+        file.seek(stat.st_size - 8)
+        footer_length = int.from_bytes(file.read(4), 'little')
+        file.seek(stat.st_size - 8 - footer_length)
+        footer = file.read(footer_length)
+
+    sha1 = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    sha1.update(footer)
+
+    return sha1.hexdigest()[:16]
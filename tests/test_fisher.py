@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from scipy.stats import fisher_exact, false_discovery_control
+
+from sweeptools.fishertest import fisher_exact_batch, bh_fdr, FisherCache
+
+
+def random_tables(rng: np.random.Generator, n: int) -> dict:
+    '''Random 2x2 tables, including tables with tied probabilities and
+    with the large totals of sweeps and of 'get_ratios' in
+    app-insertions-by-region.py.
+    '''
+    sym = rng.integers(0, 30, (n, 2))
+    return {
+        'small counts': rng.integers(0, 20, (n, 4)),
+        'sweep': np.c_[rng.integers(0, 300, (n, 2)),
+                       rng.integers(1000000, 3000000, (n, 2))],
+        'tied probabilities': np.c_[sym, sym[:, ::-1]],
+        'window': np.c_[rng.integers(1, 200, n), np.full(n, 20000000),
+                        rng.integers(1, 200, n), np.full(n, 20000000)],
+        'empty margins': np.c_[np.zeros((n, 2), dtype=int),
+                               rng.integers(0, 20, (n, 2))]}
+
+
+tables = random_tables(np.random.default_rng(0), 300)
+
+
+@pytest.mark.parametrize('name', list(tables))
+def test_matches_scipy(name):
+    p = fisher_exact_batch(*tables[name].T)
+    p_scipy = np.array([fisher_exact(x.reshape(2, 2),
+                                     alternative='two-sided')[1]
+                        for x in tables[name]])
+    np.testing.assert_allclose(p, p_scipy, rtol=1e-6, atol=1e-300)
+
+
+def test_cache_gives_same_p_values():
+    a, b, c, d = np.concatenate(list(tables.values())).T
+    cache = FisherCache()
+    p = fisher_exact_batch(a, b, c, d)
+    np.testing.assert_array_equal(fisher_exact_batch(a, b, c, d, cache), p)
+    np.testing.assert_array_equal(fisher_exact_batch(a, b, c, d, cache), p)
+
+
+def test_shapes_and_negative_counts():
+    assert fisher_exact_batch(1, 2, 3, 4).shape == ()
+    assert fisher_exact_batch(np.zeros((2, 0)), 1, 1, 1).shape == (2, 0)
+    with pytest.raises(ValueError):
+        fisher_exact_batch([1, -1], 2, 3, 4)
+
+
+def test_bh_matches_scipy_per_group():
+    rng = np.random.default_rng(1)
+    p = rng.random(2000) ** 3
+    group = rng.integers(0, 10, len(p))
+    p_fdr = bh_fdr(p, group, monotone=True)
+    for g in range(10):
+        np.testing.assert_allclose(p_fdr[group == g],
+                                   false_discovery_control(p[group == g]))
+
+
+def test_bh_as_screen_analyzer():
+    p = np.array([0.04, np.nan, 0.01, 0.01, 0.5])
+    # p * n / rank, ties ranked in order, NaNs ignored
+    np.testing.assert_allclose(bh_fdr(p), [0.04*4/3, np.nan, 0.01*4/1,
+                                           0.01*4/2, 0.5*4/4])
@@ -0,0 +1,39 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+
+from sweeptools.analyzesweep import flag_by_slope
+from benchmarks.synthetic import synthetic_analyzed_sweep
+from benchmarks.bench_flag_by_slope import flag_by_slope_loop
+
+
+@pytest.fixture(scope='module')
+def grouped_sweep():
+    # Complete grid: the per gene implementation raises KeyError when the
+    # point at the previous end offset of a flag is missing
+    return synthetic_analyzed_sweep(40).groupby('gene_name')
+
+
+@pytest.mark.parametrize('slope_thr, p_thr', [(1, 1e-5), (2, 1e-3),
+                                              (0.5, 1e-8)])
+def test_matches_per_gene_loop(grouped_sweep, slope_thr, p_thr):
+    with contextlib.redirect_stdout(io.StringIO()):
+        vectorized = flag_by_slope(grouped_sweep, p_thr, slope_thr)
+        looped = flag_by_slope_loop(grouped_sweep, p_thr, slope_thr)
+
+    assert len(vectorized) > 0
+    # Genes with equal log2 MI at tx may be in a different order
+    assert np.allclose(abs(vectorized.mi_at_tx.astype(float)),
+                       abs(looped.mi_at_tx.astype(float)), equal_nan=True)
+    vectorized = vectorized.sort_values(by='gene', ignore_index=True)
+    looped = looped.sort_values(by='gene', ignore_index=True)
+    assert vectorized.to_csv(index=False) == looped.to_csv(index=False)
+
+
+def test_no_flags(grouped_sweep):
+    with contextlib.redirect_stdout(io.StringIO()):
+        flagged = flag_by_slope(grouped_sweep, 1e-30, 100)
+
+    assert flagged.empty
+    assert list(flagged.columns[:3]) == ['gene', 'mi_at_tx', 'p_at_tx']
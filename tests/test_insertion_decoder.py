@@ -0,0 +1,77 @@
+import contextlib
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from ctypes import sizeof
+
+from sweeptools.analyzeinsertions import (CInsertion, read_insertion_file,
+                                          write_insertions, _insertion_dtype)
+from benchmarks.bench_insertion_decoder import (write_insertion_file,
+                                                read_insertion_file_ctypes)
+
+
+def write_records(filename: str, chrs: list, strands: list) -> None:
+    records = np.zeros(len(chrs), dtype=_insertion_dtype)
+    records['c'] = chrs
+    records['s'] = strands
+    records['p'] = np.arange(len(chrs))
+    records.tofile(filename)
+
+
+def test_dtype_matches_ctypes_layout():
+    assert _insertion_dtype.itemsize == sizeof(CInsertion)
+    assert [_insertion_dtype.fields[x][1] for x in ['c', 's', 'p']] == \
+        [CInsertion.c.offset, CInsertion.s.offset, CInsertion.p.offset]
+
+
+def test_matches_ctypes_loop(tmp_path):
+    filename = f'{tmp_path}/high'
+    write_insertion_file(filename, 5000)
+    # Trailing partial record is ignored by both implementations
+    with open(filename, 'ab') as file:
+        file.write(b'\x01\x2b')
+
+    decoded = read_insertion_file(filename)
+
+    assert decoded.pos.dtype == np.int32
+    assert all(isinstance(decoded[x].dtype, pd.CategoricalDtype)
+               for x in ['chr', 'strand'])
+    pd.testing.assert_frame_equal(
+        decoded.astype({'chr': object, 'strand': object, 'pos': np.int64}),
+        read_insertion_file_ctypes(filename))
+
+    # Re-encoding the decoded records gives back the file byte for byte.
+    # Categories are chr0-chr22, chrX, chrY and file code 23 is unused
+    records = np.zeros(len(decoded), dtype=_insertion_dtype)
+    chr_idx = decoded.chr.cat.codes.to_numpy()
+    records['c'] = np.where(chr_idx < 23, chr_idx, chr_idx + 1)
+    records['s'] = decoded.strand.astype(str).str.encode('utf-8')
+    records['p'] = decoded.pos
+    with open(filename, 'rb') as file:
+        original = file.read()[:len(decoded) * sizeof(CInsertion)]
+    assert records.tobytes() == original
+
+
+def test_strands_of_files_with_one_strand(tmp_path):
+    data_path = f'{tmp_path}/in/SCREEN/hg38/50/'
+    os.makedirs(data_path)
+    write_records(f'{data_path}high', [1, 2, 24], [b'+'] * 3)
+    write_records(f'{data_path}low', [1, 25], [b'-'] * 2)
+
+    assert list(read_insertion_file(f'{data_path}high').strand.cat
+                .categories) == ['+', '-']
+    with contextlib.redirect_stdout(io.StringIO()):
+        insertions = write_insertions(f'{tmp_path}/in', f'{tmp_path}/out',
+                                      'SCREEN', 'hg38', 50)
+    assert isinstance(insertions.strand.dtype, pd.CategoricalDtype)
+    assert list(insertions.strand.cat.categories) == ['+', '-']
+
+
+@pytest.mark.parametrize('chrs, strands', [([1, 23], [b'+', b'+']),
+                                           ([1, 2], [b'+', b'?'])])
+def test_unknown_codes_raise(tmp_path, chrs, strands):
+    write_records(f'{tmp_path}/high', chrs, strands)
+    with pytest.raises(ValueError):
+        read_insertion_file(f'{tmp_path}/high')